@@ -0,0 +1,440 @@
+from __future__ import annotations
+
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+
+# ----------------------------
+# Buffered engagement_events writer
+# ----------------------------
+# Requests only validate and enqueue (no DB work). A daemon thread drains the queue in
+# batches: COPY into a temp staging table, then one INSERT ... SELECT that holds back rows
+# whose session / impression / item do not exist (so one bad reference never fails a batch)
+# and skips event_ids already written (so replays are idempotent).
+#
+# Held-back rows are usually just early: sessions are upserted lazily (session cache) and,
+# with the event log, impressions only exist once the loader has run. They are kept and
+# retried every DEFER_RETRY_S, and given up on (expired_rows) DEFER_MAX_S after the flush
+# that first held them back.
+#
+# When Postgres is slow or down (flush exceeds FLUSH_TIMEOUT_MS or errors), batches are
+# appended to JSONL spill files and replayed once flushes succeed again. When the queue is
+# full, events go to a small overflow buffer that the writer thread spills in one file per
+# pass; requests never touch the disk. Beyond that, enqueue raises WriterOverloaded.
+
+_PROJECT_ROOT = Path(__file__).resolve().parents[3]  # backend/app/events -> project root
+SPILL_DIR = Path(os.getenv("ENGAGEMENT_SPILL_DIR", str(_PROJECT_ROOT / "data" / "spill" / "engagement")))
+
+QUEUE_MAX = int(os.getenv("ENGAGEMENT_QUEUE_MAX", "100000"))
+OVERFLOW_MAX = int(os.getenv("ENGAGEMENT_OVERFLOW_MAX", "10000"))
+BATCH_SIZE = int(os.getenv("ENGAGEMENT_BATCH_SIZE", "5000"))
+FLUSH_INTERVAL_S = float(os.getenv("ENGAGEMENT_FLUSH_INTERVAL_S", "1.0"))
+FLUSH_TIMEOUT_MS = int(os.getenv("ENGAGEMENT_FLUSH_TIMEOUT_MS", "2000"))
+SPILL_RETRY_S = 30.0
+DEFER_MAX_S = float(os.getenv("ENGAGEMENT_DEFER_MAX_S", "3600"))
+DEFER_RETRY_S = 5.0
+DEFER_MAX_ROWS = int(os.getenv("ENGAGEMENT_DEFER_MAX_ROWS", "50000"))  # beyond this, the oldest are spilled
+
+# Known defaults (migrations/001); replaced by the table contents on start
+DEFAULT_EVENT_TYPES = ("open", "save", "share", "hide", "dwell", "scroll")
+
+_COLUMNS = ("event_id", "session_id", "impression_id", "item_id", "event_type", "event_value", "occurred_at")
+
+_STAGE_SQL = """
+CREATE TEMP TABLE IF NOT EXISTS engagement_events_stage (
+  event_id UUID,
+  session_id UUID,
+  impression_id UUID,
+  item_id TEXT,
+  event_type TEXT,
+  event_value JSONB,
+  occurred_at TIMESTAMPTZ
+) ON COMMIT DELETE ROWS;
+"""
+
+_REFS_EXIST = """
+  (s.session_id IS NULL OR EXISTS (SELECT 1 FROM sessions x WHERE x.session_id = s.session_id))
+  AND (s.impression_id IS NULL OR EXISTS (SELECT 1 FROM impressions_served x WHERE x.impression_id = s.impression_id))
+  AND (s.item_id IS NULL OR EXISTS (SELECT 1 FROM items x WHERE x.item_id = s.item_id))
+"""
+
+_INSERT_FROM_STAGE_SQL = f"""
+INSERT INTO engagement_events(event_id, session_id, impression_id, item_id, event_type, event_value, occurred_at)
+SELECT s.event_id, s.session_id, s.impression_id, s.item_id, s.event_type, s.event_value, s.occurred_at
+FROM engagement_events_stage s
+WHERE {_REFS_EXIST}
+ON CONFLICT (event_id) DO NOTHING;
+"""
+
+# Rows held back by the insert above (a reference not written yet)
+_UNRESOLVED_SQL = f"""
+SELECT s.event_id::text
+FROM engagement_events_stage s
+WHERE NOT ({_REFS_EXIST});
+"""
+
+# Row layout in the queue / spill files (plain tuples: cheap to build, pickle-free to spill)
+Row = tuple  # (event_id, session_id, impression_id, item_id, event_type, event_value_json, occurred_at_iso)
+
+
+class WriterOverloaded(Exception):
+    """Both the queue and the overflow buffer are full; the event was not accepted."""
+
+
+class EngagementWriter:
+    def __init__(self, spill_dir: Path = SPILL_DIR) -> None:
+        self.spill_dir = Path(spill_dir)
+        self._queue: queue.Queue[Row] = queue.Queue(maxsize=QUEUE_MAX)
+        # Interned type names: validation is a set lookup, and every queued row shares one string object
+        self._event_types: dict[str, str] = {t: sys.intern(t) for t in DEFAULT_EVENT_TYPES}
+        self._spill_lock = threading.Lock()
+        self._overflow_lock = threading.Lock()
+        self._overflow: list[Row] = []
+        self._spill_seq = 0
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+        self._next_spill_retry = 0.0
+        self._flush_ms: deque[float] = deque(maxlen=200)
+        # Writer thread only: event_id -> (monotonic time first held back, row)
+        self._deferred: dict[str, tuple[float, Row]] = {}
+        self._next_defer_retry = 0.0
+        self._counters = {
+            "enqueued": 0,
+            "invalid": 0,
+            "flushed_rows": 0,
+            "flush_batches": 0,
+            "flush_failures": 0,
+            "skipped_rows": 0,
+            "deferred_rows": 0,
+            "expired_rows": 0,
+            "spilled_rows": 0,
+            "replayed_rows": 0,
+            "overflow_rows": 0,
+            "rejected_rows": 0,
+        }
+        self._last_flush_at: float | None = None
+        self._last_error: str | None = None
+
+    # ----------------------------
+    # Request path
+    # ----------------------------
+    def intern_event_type(self, event_type: str) -> str | None:
+        """The shared string for a known event type, None if the type is not in engagement_event_types."""
+        return self._event_types.get(event_type)
+
+    def enqueue(
+        self,
+        *,
+        event_type: str,
+        session_id: str | None = None,
+        impression_id: str | None = None,
+        item_id: str | None = None,
+        event_value: dict | None = None,
+        occurred_at: datetime | None = None,
+    ) -> str:
+        """
+        Validates and queues one event; returns its event_id. Raises ValueError if invalid,
+        WriterOverloaded if there is no room left.
+        """
+        et = self.intern_event_type(event_type)
+        if et is None:
+            self._counters["invalid"] += 1
+            raise ValueError(f"unknown event_type {event_type!r}")
+        try:
+            session_id = str(uuid.UUID(session_id)) if session_id else None
+            impression_id = str(uuid.UUID(impression_id)) if impression_id else None
+        except ValueError:
+            self._counters["invalid"] += 1
+            raise ValueError("session_id / impression_id must be UUIDs") from None
+
+        if occurred_at is None:
+            occurred_at = datetime.now(timezone.utc)
+        elif occurred_at.tzinfo is None:
+            occurred_at = occurred_at.replace(tzinfo=timezone.utc)
+
+        event_id = str(uuid.uuid4())
+        row = (
+            event_id,
+            session_id,
+            impression_id,
+            item_id or None,
+            et,
+            json.dumps(event_value, separators=(",", ":")) if event_value is not None else None,
+            occurred_at.isoformat(),
+        )
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            # Backpressure without blocking the request; the writer thread spills these
+            with self._overflow_lock:
+                if len(self._overflow) >= OVERFLOW_MAX:
+                    self._counters["rejected_rows"] += 1
+                    raise WriterOverloaded("engagement queue is full") from None
+                self._overflow.append(row)
+                self._counters["overflow_rows"] += 1
+        self._counters["enqueued"] += 1
+        return event_id
+
+    def metrics(self) -> dict:
+        flush_ms = sorted(self._flush_ms)
+
+        def pct(p: float) -> float | None:
+            return round(flush_ms[min(len(flush_ms) - 1, int(p * len(flush_ms)))], 2) if flush_ms else None
+
+        return {
+            **self._counters,
+            "queue_depth": self._queue.qsize(),
+            "queue_max": QUEUE_MAX,
+            "overflow_depth": len(self._overflow),
+            "spill_files": len(self._spill_files()),
+            "deferred_pending": len(self._deferred),
+            "flush_ms_p50": pct(0.50),
+            "flush_ms_p95": pct(0.95),
+            "last_flush_at": self._last_flush_at,
+            "last_error": self._last_error,
+            "event_types": sorted(self._event_types),
+        }
+
+    # ----------------------------
+    # Postgres
+    # ----------------------------
+    def load_event_types(self, cur) -> None:
+        cur.execute("SELECT event_type FROM engagement_event_types;")
+        self._event_types = {str(t): sys.intern(str(t)) for (t,) in cur.fetchall()}
+
+    def _copy_batch(self, conn, rows: list[Row]) -> set[str]:
+        """Writes the rows that can be written; returns the event_ids held back."""
+        with conn.cursor() as cur:
+            cur.execute(f"SET LOCAL statement_timeout = {FLUSH_TIMEOUT_MS};")
+            cur.execute(_STAGE_SQL)
+            with cur.copy(f"COPY engagement_events_stage ({', '.join(_COLUMNS)}) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row(row)
+            cur.execute(_INSERT_FROM_STAGE_SQL)
+            inserted = cur.rowcount
+            cur.execute(_UNRESOLVED_SQL)
+            unresolved = {r[0] for r in cur.fetchall()}
+        conn.commit()
+        # event_ids already written (replays)
+        self._counters["skipped_rows"] += max(0, len(rows) - max(inserted, 0) - len(unresolved))
+        return unresolved
+
+    def _defer(self, rows: list[Row], unresolved: set[str]) -> None:
+        """Tracks held-back rows (keeping when each was first held back); forgets written ones."""
+        now = time.monotonic()
+        for row in rows:
+            if row[0] not in unresolved:
+                self._deferred.pop(row[0], None)
+            elif row[0] not in self._deferred:
+                self._deferred[row[0]] = (now, row)
+                self._counters["deferred_rows"] += 1
+        overflow = len(self._deferred) - DEFER_MAX_ROWS
+        if overflow > 0:
+            # Insertion order is first-held-back order; the spill replay retries them later
+            oldest = list(self._deferred)[:overflow]
+            self._spill([self._deferred.pop(k)[1] for k in oldest])
+
+    def _retry_deferred(self) -> None:
+        now = time.monotonic()
+        expired = [k for k, (first, _) in self._deferred.items() if now - first >= DEFER_MAX_S]
+        for k in expired:
+            del self._deferred[k]
+        if expired:
+            self._counters["expired_rows"] += len(expired)
+            print(f"[engagement] Gave up on {len(expired)} events whose session/impression/item never appeared")
+        rows = [row for _, row in self._deferred.values()]
+        for start in range(0, len(rows), BATCH_SIZE):
+            # Still deferred on failure; retried with the next pass
+            if not self._flush(rows[start : start + BATCH_SIZE]):
+                return
+
+    def _flush(self, rows: list[Row]) -> bool:
+        from backend.app.db import get_conn
+
+        t0 = time.perf_counter()
+        try:
+            with get_conn() as conn:
+                try:
+                    unresolved = self._copy_batch(conn, rows)
+                except Exception:
+                    conn.rollback()
+                    raise
+        except Exception as e:
+            self._counters["flush_failures"] += 1
+            self._last_error = str(e)
+            print(f"[engagement] Flush of {len(rows)} events failed, spilling: {e}")
+            return False
+        self._defer(rows, unresolved)
+        self._flush_ms.append((time.perf_counter() - t0) * 1000.0)
+        self._counters["flushed_rows"] += len(rows)
+        self._counters["flush_batches"] += 1
+        self._last_flush_at = time.time()
+        self._last_error = None
+        return True
+
+    # ----------------------------
+    # Spill files (JSONL, one row per line)
+    # ----------------------------
+    def _spill_files(self) -> list[Path]:
+        return sorted(self.spill_dir.glob("spill-*.jsonl")) if self.spill_dir.exists() else []
+
+    def _spill(self, rows: list[Row]) -> None:
+        with self._spill_lock:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            # One file per spill; names sort oldest first
+            self._spill_seq += 1
+            path = self.spill_dir / f"spill-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{self._spill_seq:06d}.jsonl"
+            with open(path, "x", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps(row, separators=(",", ":")) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        self._counters["spilled_rows"] += len(rows)
+
+    def _claimed_path(self, path: Path) -> Path:
+        # The claiming pid is part of the name so restarts only take back orphaned claims
+        return path.with_name(f"{path.stem}.{os.getpid()}.replaying")
+
+    def _reclaim_orphans(self, *, include_own: bool) -> None:
+        """Puts .replaying files whose claiming process is gone back in line as .jsonl."""
+        if not self.spill_dir.exists():
+            return
+        for claimed in self.spill_dir.glob("spill-*.replaying"):
+            stem, _, pid = claimed.stem.rpartition(".")
+            if not stem:
+                # Claimed before owners were recorded: only safe to take back on start
+                stem, owner = claimed.stem, os.getpid()
+            else:
+                owner = int(pid)
+            if owner == os.getpid():
+                if not include_own:
+                    continue
+            elif _pid_alive(owner):
+                continue
+            try:
+                os.replace(claimed, claimed.with_name(f"{stem}.jsonl"))
+            except FileNotFoundError:
+                pass  # reclaimed by another worker first
+
+    def _spill_overflow(self) -> None:
+        with self._overflow_lock:
+            rows, self._overflow = self._overflow, []
+        if rows:
+            self._spill(rows)
+
+    def _replay_spill(self) -> None:
+        """Re-sends spilled files oldest first; stops at the first failure (DB still unhealthy)."""
+        self._reclaim_orphans(include_own=False)
+        for path in self._spill_files():
+            if self._stop.is_set():
+                return
+            claimed = self._claimed_path(path)
+            try:
+                os.replace(path, claimed)
+            except FileNotFoundError:
+                continue  # another worker sharing the spill dir claimed it first
+            with open(claimed, encoding="utf-8") as f:
+                rows = [tuple(json.loads(line)) for line in f if line.strip()]
+            for start in range(0, len(rows), BATCH_SIZE):
+                if not self._flush(rows[start : start + BATCH_SIZE]):
+                    # Back in line as-is; the already-sent part is skipped by event_id on the next replay
+                    os.replace(claimed, path)
+                    return
+                self._counters["replayed_rows"] += len(rows[start : start + BATCH_SIZE])
+            claimed.unlink()
+
+    # ----------------------------
+    # Writer thread
+    # ----------------------------
+    def _drain(self, max_rows: int, wait_s: float) -> list[Row]:
+        rows: list[Row] = []
+        deadline = time.monotonic() + wait_s
+        while len(rows) < max_rows:
+            remaining = deadline - time.monotonic()
+            try:
+                row = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            rows.append(row)
+        return rows
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self._spill_overflow()
+                rows = self._drain(BATCH_SIZE, FLUSH_INTERVAL_S)
+                if rows and not self._flush(rows):
+                    self._spill(rows)
+                    self._next_spill_retry = time.monotonic() + SPILL_RETRY_S
+                    continue
+                if self._deferred and time.monotonic() >= self._next_defer_retry:
+                    self._next_defer_retry = time.monotonic() + DEFER_RETRY_S
+                    self._retry_deferred()
+                if time.monotonic() >= self._next_spill_retry and self._spill_files():
+                    self._next_spill_retry = time.monotonic() + SPILL_RETRY_S
+                    self._replay_spill()
+            except Exception as e:
+                # Spill dir unwritable, unreadable spill file, ...: keep the thread alive
+                self._last_error = str(e)
+                print(f"[engagement] Writer loop error: {e}")
+                self._stop.wait(1.0)
+
+    def start(self) -> None:
+        from backend.app.db import get_conn
+
+        try:
+            with get_conn() as conn:
+                with conn.cursor() as cur:
+                    self.load_event_types(cur)
+        except Exception as e:
+            print(f"[engagement] Could not load engagement_event_types, using defaults: {e}")
+
+        # A replay interrupted by a restart is retried like any other spill file; claims of
+        # live workers sharing the spill dir are left alone
+        try:
+            self._reclaim_orphans(include_own=True)
+        except OSError as e:
+            print(f"[engagement] Could not reclaim interrupted spill replays: {e}")
+
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="engagement-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout_s: float = 10.0) -> None:
+        """Stops the thread, then flushes (or spills) whatever is still queued."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout_s)
+        while True:
+            rows = self._drain(BATCH_SIZE, 0.0)
+            if not rows:
+                break
+            if not self._flush(rows):
+                self._spill(rows)
+        self._spill_overflow()
+        # Still waiting for their references: replayed (and re-deferred) after the restart
+        if self._deferred:
+            self._spill([row for _, row in self._deferred.values()])
+            self._deferred.clear()
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # exists, owned by another user
+    return True
+
+
+# Module-level writer (one per process)
+ENGAGEMENT_WRITER = EngagementWriter()
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+from pathlib import Path
+import json
+import os
+import socket
+import threading
+import time
+
+# ----------------------------
+# Durable append-only event log (impressions + clicks)
+# ----------------------------
+# With EVENT_LOG_ENABLED=1 the API appends one JSON line per impression / click to a local
+# segment file instead of writing Postgres inside the request; backend/scripts/event_log_loader.py
+# bulk-loads the segments. Request latency then only depends on a local append + fsync.
+#
+# Layout: <EVENT_LOG_DIR>/<writer_id>/<seq:012d>.jsonl, one directory per process, segments
+# rotated by size/age. Only this process ever writes its directory, so no file locking.
+# close() leaves a CLOSED_MARKER file, telling the loader the directory can be removed once
+# it has loaded everything in it.
+#
+# Durability: appends are group-committed. A syncer thread fsyncs every FSYNC_INTERVAL_MS
+# while there is unsynced data, and append(wait=True) returns once its line is on disk, so
+# concurrent requests share one fsync instead of paying one each.
+
+_PROJECT_ROOT = Path(__file__).resolve().parents[3]  # backend/app/events -> project root
+EVENT_LOG_DIR = Path(os.getenv("EVENT_LOG_DIR", str(_PROJECT_ROOT / "data" / "event_log")))
+EVENT_LOG_ENABLED = os.getenv("EVENT_LOG_ENABLED", "0") == "1"
+
+SEGMENT_MAX_BYTES = int(os.getenv("EVENT_LOG_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+SEGMENT_MAX_AGE_S = float(os.getenv("EVENT_LOG_SEGMENT_AGE_S", "60"))
+FSYNC_INTERVAL_MS = float(os.getenv("EVENT_LOG_FSYNC_MS", "5"))
+
+SEGMENT_SUFFIX = ".jsonl"
+CLOSED_MARKER = "_closed"
+
+
+# Postgres column ranges. A value outside them would fail the loader's COPY, so records are
+# checked before they are appended.
+INT32_RANGE = (-(2**31), 2**31 - 1)
+INT64_RANGE = (-(2**63), 2**63 - 1)
+
+
+def check_int_fields(values: dict, bounds: tuple[int, int] = INT32_RANGE) -> None:
+    """Raises ValueError for the first non-None value outside bounds."""
+    for name, v in values.items():
+        if v is not None and not bounds[0] <= v <= bounds[1]:
+            raise ValueError(f"{name} out of range: {v}")
+
+
+def segment_name(seq: int) -> str:
+    return f"{seq:012d}{SEGMENT_SUFFIX}"
+
+
+class EventLog:
+    def __init__(self, root: Path = EVENT_LOG_DIR, writer_id: str | None = None) -> None:
+        self.writer_id = writer_id or os.getenv("EVENT_LOG_WRITER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+        self.dir = Path(root) / self.writer_id
+        self._cond = threading.Condition()
+        self._sync_lock = threading.Lock()   # held while fsyncing / closing the current file
+        self._file = None
+        self._seq = 0
+        self._opened_at = 0.0
+        self._size = 0
+        self._appended = 0                   # lines written to the OS
+        self._synced = 0                     # lines known to be on disk
+        self._fsyncs = 0
+        self._thread: threading.Thread | None = None
+
+    # ----------------------------
+    # Segments
+    # ----------------------------
+    def _open_next(self) -> None:
+        self._seq += 1
+        path = self.dir / segment_name(self._seq)
+        self._file = open(path, "ab")
+        self._opened_at = time.monotonic()
+        self._size = 0
+
+    def _rotate_if_needed(self) -> None:
+        """Called with _cond held."""
+        if self._size < SEGMENT_MAX_BYTES and time.monotonic() - self._opened_at < SEGMENT_MAX_AGE_S:
+            return
+        if self._size == 0:
+            self._opened_at = time.monotonic()
+            return
+        with self._sync_lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        self._fsyncs += 1
+        self._synced = self._appended
+        self._cond.notify_all()
+        self._open_next()
+
+    # ----------------------------
+    # Append (request path)
+    # ----------------------------
+    def append(self, record: dict, *, wait: bool = True) -> None:
+        """Appends one record; with wait=True returns only after it has been fsynced."""
+        line = (json.dumps(record, separators=(",", ":"), default=str) + "\n").encode("utf-8")
+        with self._cond:
+            if self._file is None:
+                raise RuntimeError("EventLog.start() has not been called")
+            self._rotate_if_needed()
+            self._file.write(line)
+            self._size += len(line)
+            self._appended += 1
+            mine = self._appended
+            self._cond.notify_all()
+            if wait:
+                while self._synced < mine:
+                    self._cond.wait()
+
+    def _sync_loop(self) -> None:
+        while True:
+            with self._cond:
+                while self._synced >= self._appended:
+                    self._cond.wait()
+            # Group-commit window: let concurrent appends join this fsync
+            time.sleep(FSYNC_INTERVAL_MS / 1000.0)
+            with self._cond:
+                target = self._appended
+                f = self._file
+                if f is not None:
+                    f.flush()
+            with self._sync_lock:
+                # A rotation / close in between already synced (and closed) the file
+                if f is not None and not f.closed:
+                    os.fsync(f.fileno())
+            with self._cond:
+                self._fsyncs += 1
+                self._synced = max(self._synced, target)
+                self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "writer_id": self.writer_id,
+                "segment": segment_name(self._seq),
+                "segment_bytes": self._size,
+                "appended": self._appended,
+                "synced": self._synced,
+                "fsyncs": self._fsyncs,
+            }
+
+    def start(self) -> None:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        with self._cond:
+            if self._file is None:
+                # Reusing a writer_id (EVENT_LOG_WRITER_ID): the directory is live again
+                (self.dir / CLOSED_MARKER).unlink(missing_ok=True)
+                # Never append to a segment the loader may consider finished
+                existing = [int(p.stem) for p in self.dir.glob(f"*{SEGMENT_SUFFIX}") if p.stem.isdigit()]
+                self._seq = max(existing, default=0)
+                self._open_next()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._sync_loop, name="event-log-fsync", daemon=True)
+            self._thread.start()
+        print(f"[event_log] Appending to {self.dir} (segment {segment_name(self._seq)})")
+
+    def close(self) -> None:
+        with self._cond:
+            if self._file is None:
+                return
+            with self._sync_lock:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+            self._synced = self._appended
+            self._file = None
+            self._cond.notify_all()
+        (self.dir / CLOSED_MARKER).touch()
+
+
+# Module-level log (one per process); None unless EVENT_LOG_ENABLED=1
+EVENT_LOG = EventLog() if EVENT_LOG_ENABLED else None
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from datetime import datetime, timezone
+import os
+import threading
+import uuid
+
+# ----------------------------
+# Session ids and lazy sessions rows
+# ----------------------------
+# /session/start mints the UUID in-process and queues the sessions row; a daemon thread
+# writes queued rows in batches. Sessions known to have a row are kept in a bounded LRU set,
+# so /recommendations only touches the sessions table the first time this process sees a
+# session (e.g. one started before a restart, or by another worker), instead of on every call.
+#
+# Writes are upserts that only fill in missing metadata, so the batch writer, the request
+# path and the event log loader can create the same row in any order.
+
+SESSION_CACHE_MAX = int(os.getenv("SESSION_CACHE_MAX", "200000"))
+FLUSH_INTERVAL_S = float(os.getenv("SESSION_FLUSH_INTERVAL_S", "1.0"))
+BATCH_SIZE = 1000
+
+_COLUMNS = ("session_id", "anonymous_id", "device_type", "app_version", "user_agent", "referrer", "started_at")
+
+_UPSERT_SQL = """
+INSERT INTO sessions(session_id, anonymous_id, device_type, app_version, user_agent, referrer, started_at)
+SELECT *
+FROM unnest(%s::uuid[], %s::text[], %s::text[], %s::text[], %s::text[], %s::text[], %s::timestamptz[])
+ON CONFLICT (session_id) DO UPDATE SET
+  anonymous_id = COALESCE(sessions.anonymous_id, EXCLUDED.anonymous_id),
+  device_type = COALESCE(sessions.device_type, EXCLUDED.device_type),
+  app_version = COALESCE(sessions.app_version, EXCLUDED.app_version),
+  user_agent = COALESCE(sessions.user_agent, EXCLUDED.user_agent),
+  referrer = COALESCE(sessions.referrer, EXCLUDED.referrer),
+  started_at = LEAST(sessions.started_at, EXCLUDED.started_at);
+"""
+
+Row = tuple  # in _COLUMNS order
+
+
+def _upsert(cur, rows: list[Row]) -> None:
+    cur.execute(_UPSERT_SQL, [list(col) for col in zip(*rows)])
+
+
+class SessionCache:
+    def __init__(self, max_known: int = SESSION_CACHE_MAX) -> None:
+        self.max_known = max_known
+        self._lock = threading.Lock()
+        self._known: OrderedDict[str, None] = OrderedDict()  # sessions with a row, LRU order
+        self._pending: dict[str, Row] = {}                    # started here, row not written yet
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+        self._counters = {"started": 0, "hits": 0, "misses": 0, "flushed": 0, "flush_failures": 0}
+
+    # ----------------------------
+    # Request path
+    # ----------------------------
+    def start_session(
+        self,
+        anonymous_id: str | None,
+        *,
+        device_type: str | None = None,
+        app_version: str | None = None,
+        user_agent: str | None = None,
+        referrer: str | None = None,
+    ) -> str:
+        """New session id; its sessions row is written by the flusher (or the first request using it)."""
+        session_id = str(uuid.uuid4())
+        row = (session_id, anonymous_id, device_type, app_version, user_agent, referrer, datetime.now(timezone.utc))
+        with self._lock:
+            self._pending[session_id] = row
+            self._counters["started"] += 1
+        return session_id
+
+    def ensure(self, cur, session_id: str) -> bool:
+        """
+        Makes sure the session has a row, within the caller's transaction.
+        No-op for known sessions; otherwise upserts it and returns True. Call mark_known()
+        once that transaction has committed.
+        """
+        with self._lock:
+            if session_id in self._known:
+                self._known.move_to_end(session_id)
+                self._counters["hits"] += 1
+                return False
+            self._counters["misses"] += 1
+            row = self._pending.get(session_id)
+        _upsert(cur, [row or (session_id, None, None, None, None, None, datetime.now(timezone.utc))])
+        return True
+
+    def mark_known(self, session_ids) -> None:
+        if isinstance(session_ids, str):
+            session_ids = [session_ids]
+        with self._lock:
+            for sid in session_ids:
+                self._pending.pop(sid, None)
+                self._known[sid] = None
+                self._known.move_to_end(sid)
+            while len(self._known) > self.max_known:
+                self._known.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "known": len(self._known),
+                "pending": len(self._pending),
+                "hit_rate": round(self._counters["hits"] / lookups, 4) if lookups else None,
+            }
+
+    # ----------------------------
+    # Batch writer
+    # ----------------------------
+    def flush(self) -> int:
+        """Writes all pending sessions rows; returns how many were written."""
+        from backend.app.db import get_conn
+
+        with self._lock:
+            rows = list(self._pending.values())
+        if not rows:
+            return 0
+        try:
+            with get_conn() as conn:
+                try:
+                    with conn.cursor() as cur:
+                        for start in range(0, len(rows), BATCH_SIZE):
+                            _upsert(cur, rows[start : start + BATCH_SIZE])
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+        except Exception as e:
+            # Rows stay pending; requests for these sessions still write them themselves
+            self._counters["flush_failures"] += 1
+            print(f"[sessions] Flush of {len(rows)} sessions failed: {e}")
+            return 0
+        self.mark_known([r[0] for r in rows])
+        self._counters["flushed"] += len(rows)
+        return len(rows)
+
+    def _run(self) -> None:
+        while not self._stop.wait(FLUSH_INTERVAL_S):
+            self.flush()
+
+    def start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="session-flusher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout_s: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout_s)
+        self.flush()
+
+
+# Module-level cache (one per process)
+SESSION_CACHE = SessionCache()
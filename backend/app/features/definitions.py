@@ -0,0 +1,24 @@
+from __future__ import annotations
+
+# ----------------------------
+# Ranker features (single definition for serving, logging and training)
+# ----------------------------
+# Column order is the model's input order.
+RANKER_FEATURES = ["retrieval_score", "position", "is_warm_user", "user_click_count", "item_age_hours"]
+
+# A user is warm once they have at least this many clicks
+WARM_MIN_CLICKS = 1
+
+
+def is_warm_user(user_click_count: int) -> int:
+    return 1 if int(user_click_count) >= WARM_MIN_CLICKS else 0
+
+
+def item_age_hours(ingested_at_epoch: float | None, served_at_epoch: float) -> float:
+    """
+    Hours between catalog ingestion and serving. Unknown items get 0.0
+    (same fallback the online path has always used).
+    """
+    if ingested_at_epoch is None:
+        return 0.0
+    return float((served_at_epoch - ingested_at_epoch) / 3600.0)
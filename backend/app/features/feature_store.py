@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+import os
+import threading
+import time
+
+from backend.app.features.definitions import is_warm_user, item_age_hours
+from backend.app.features.recent_clicks import RecentClicks
+
+# How often each worker tails clicks/items written by other workers
+REFRESH_INTERVAL_S = float(os.getenv("FEATURE_STORE_REFRESH_S", "5"))
+# Re-read this much history on every tail: rows can commit out of ingested_at order.
+# Clicks are tailed by ingested_at (migrations/004), not clicked_at: the event log loader
+# writes them after the fact, with the API's clicked_at.
+TAIL_OVERLAP_S = 60.0
+
+
+@dataclass(frozen=True)
+class FeatureSnapshot:
+    """Point-in-time feature values for one request (logged with the impression)."""
+
+    user_click_count: int
+    is_warm_user: int
+    item_age_hours: list[float]
+
+
+class FeatureStore:
+    """
+    In-memory online store for the ranker's user/item features.
+
+    - user_click_count: anonymous_id -> clicks so far
+    - item ingested_at: item_id -> epoch seconds
+    - recent_clicks: anonymous_id -> newest clicked item_ids (per-user ring buffers, loaded on demand)
+
+    Warmed from Postgres once, then maintained incrementally: this worker records its own
+    clicks immediately, and a background tail picks up clicks/items written elsewhere.
+    Click ids seen within the overlap window are remembered so nothing is counted twice.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._user_clicks: dict[str, int] = {}
+        self._item_ingested: dict[str, float] = {}
+        self._recent_click_ids: dict[str, float] = {}  # click_id -> ingested_at epoch
+        self._clicks_tail_from: float = 0.0
+        self._items_tail_from: float = 0.0
+        self._thread: threading.Thread | None = None
+        self.recent_clicks = RecentClicks()
+        self.ready = False
+
+    # ----------------------------
+    # Reads (O(1) dict lookups)
+    # ----------------------------
+    def user_click_count(self, anonymous_id: str) -> int:
+        return self._user_clicks.get(anonymous_id, 0)
+
+    def ingested_at(self, item_id: str) -> float | None:
+        return self._item_ingested.get(item_id)
+
+    def snapshot(self, anonymous_id: str, item_ids: list[str], served_at_epoch: float) -> FeatureSnapshot:
+        n = self.user_click_count(anonymous_id)
+        return FeatureSnapshot(
+            user_click_count=n,
+            is_warm_user=is_warm_user(n),
+            item_age_hours=[item_age_hours(self.ingested_at(i), served_at_epoch) for i in item_ids],
+        )
+
+    # ----------------------------
+    # Writes (event stream)
+    # ----------------------------
+    def record_click(
+        self,
+        anonymous_id: str | None,
+        click_id: str,
+        clicked_at_epoch: float,
+        item_id: str | None = None,
+        ingested_at_epoch: float | None = None,
+    ) -> None:
+        """ingested_at defaults to clicked_at (a click inserted by the API gets both from now())."""
+        if not anonymous_id:
+            return
+        with self._lock:
+            if click_id in self._recent_click_ids:
+                return
+            self._recent_click_ids[click_id] = clicked_at_epoch if ingested_at_epoch is None else ingested_at_epoch
+            self._user_clicks[anonymous_id] = self._user_clicks.get(anonymous_id, 0) + 1
+        if item_id is not None:
+            self.recent_clicks.record_click(anonymous_id, click_id, item_id, clicked_at_epoch)
+
+    def record_item(self, item_id: str, ingested_at_epoch: float) -> None:
+        self._item_ingested[item_id] = ingested_at_epoch
+
+    # ----------------------------
+    # Postgres sync
+    # ----------------------------
+    def warm(self, cur) -> None:
+        t0 = time.perf_counter()
+        # One snapshot for all warm queries (must be the transaction's first statement);
+        # now() is then the snapshot time the tail resumes from.
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
+        cur.execute("SELECT EXTRACT(EPOCH FROM now())::float8;")
+        db_now = float(cur.fetchone()[0])
+
+        cur.execute(
+            """
+            SELECT i.anonymous_id, COUNT(*)::int
+            FROM clicks c
+            JOIN impressions_served i ON i.impression_id = c.impression_id
+            WHERE i.anonymous_id IS NOT NULL
+            GROUP BY i.anonymous_id;
+            """
+        )
+        user_clicks = {str(a): int(n) for a, n in cur.fetchall()}
+
+        cur.execute("SELECT item_id, EXTRACT(EPOCH FROM ingested_at)::float8 FROM items;")
+        items = {str(i): float(ts) for i, ts in cur.fetchall()}
+
+        # Clicks committed during the warm query are re-read by the first tail; remember
+        # the ones already counted so they are not counted again.
+        cur.execute(
+            """
+            SELECT click_id::text, EXTRACT(EPOCH FROM ingested_at)::float8
+            FROM clicks
+            WHERE ingested_at > to_timestamp(%s);
+            """,
+            (db_now - TAIL_OVERLAP_S,),
+        )
+        recent = {cid: float(ts) for cid, ts in cur.fetchall()}
+
+        with self._lock:
+            self._user_clicks = user_clicks
+            self._item_ingested = items
+            self._recent_click_ids = recent
+            self._clicks_tail_from = db_now
+            self._items_tail_from = db_now
+            self.ready = True
+
+        print(
+            f"[feature_store] Warmed: users={len(user_clicks)} items={len(items)} "
+            f"in {time.perf_counter() - t0:.2f}s"
+        )
+
+    def refresh(self, cur) -> None:
+        """Applies clicks/items written since the last tail (by any worker)."""
+        cur.execute("SELECT EXTRACT(EPOCH FROM now())::float8;")
+        db_now = float(cur.fetchone()[0])
+
+        cur.execute(
+            """
+            SELECT c.click_id::text, i.anonymous_id, EXTRACT(EPOCH FROM c.clicked_at)::float8, c.item_id,
+                   EXTRACT(EPOCH FROM c.ingested_at)::float8
+            FROM clicks c
+            JOIN impressions_served i ON i.impression_id = c.impression_id
+            WHERE c.ingested_at > to_timestamp(%s);
+            """,
+            (self._clicks_tail_from - TAIL_OVERLAP_S,),
+        )
+        for click_id, anon, ts, item_id, ingested in cur.fetchall():
+            self.record_click(anon, click_id, float(ts), item_id, float(ingested))
+
+        cur.execute(
+            """
+            SELECT item_id, EXTRACT(EPOCH FROM ingested_at)::float8
+            FROM items
+            WHERE ingested_at > to_timestamp(%s);
+            """,
+            (self._items_tail_from - TAIL_OVERLAP_S,),
+        )
+        for item_id, ts in cur.fetchall():
+            self.record_item(str(item_id), float(ts))
+
+        with self._lock:
+            cutoff = db_now - 2 * TAIL_OVERLAP_S
+            self._recent_click_ids = {k: v for k, v in self._recent_click_ids.items() if v >= cutoff}
+            self._clicks_tail_from = db_now
+            self._items_tail_from = db_now
+
+    def _refresh_loop(self, interval_s: float) -> None:
+        from backend.app.db import get_conn
+
+        while True:
+            time.sleep(interval_s)
+            try:
+                with get_conn() as conn:
+                    with conn.cursor() as cur:
+                        if self.ready:
+                            self.refresh(cur)
+                        else:
+                            self.warm(cur)
+            except Exception as e:
+                print(f"[feature_store] Refresh failed: {e}")
+
+    def start(self, interval_s: float = REFRESH_INTERVAL_S) -> None:
+        """Warms synchronously, then keeps tailing in a daemon thread."""
+        from backend.app.db import get_conn
+
+        try:
+            with get_conn() as conn:
+                with conn.cursor() as cur:
+                    self.warm(cur)
+        except Exception as e:
+            # Requests fall back to the SQL feature queries until a later tail warms the store
+            print(f"[feature_store] Warm failed, will retry in background: {e}")
+
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._refresh_loop, args=(interval_s,), name="feature-store-refresh", daemon=True
+            )
+            self._thread.start()
+
+
+# Module-level store (one per process)
+FEATURE_STORE = FeatureStore()
@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+from collections import OrderedDict, deque
+import bisect
+import os
+import threading
+
+# Newest clicks kept per user (/users/{id}/recent_clicks allows limit <= 100)
+PER_USER = int(os.getenv("RECENT_CLICKS_PER_USER", "100"))
+# Users kept in memory (least recently used are dropped and re-warmed on next access)
+MAX_USERS = int(os.getenv("RECENT_CLICKS_MAX_USERS", "50000"))
+
+Click = tuple  # (clicked_at_epoch, click_id, item_id)
+
+
+class RecentClicks:
+    """
+    Per-user ring buffers of the newest clicks: anonymous_id -> deque[(clicked_at, click_id, item_id)].
+
+    A user's buffer is loaded from Postgres on first access (warm), then kept current by
+    record_click (this worker's /click plus the feature store's tail of other workers'
+    clicks). Clicks of users that are not loaded are ignored; they are read by the warm.
+    Clicks recorded while a user is being warmed are merged in afterwards, so none are lost.
+    """
+
+    def __init__(self, per_user: int = PER_USER, max_users: int = MAX_USERS) -> None:
+        self.per_user = per_user
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._users: OrderedDict[str, deque[Click]] = OrderedDict()
+        self._warming: dict[str, list[Click]] = {}
+        self._counters = {"hits": 0, "misses": 0, "evicted": 0}
+
+    def _insert(self, buf: deque[Click], click: Click) -> None:
+        """Keeps buf ordered by clicked_at (oldest first); tail rows can arrive out of order."""
+        if any(c[1] == click[1] for c in buf):
+            return
+        if not buf or click[0] >= buf[-1][0]:
+            buf.append(click)  # the common case; drops the oldest when full
+            return
+        if len(buf) == buf.maxlen and click[0] < buf[0][0]:
+            return  # older than everything kept
+        items = list(buf)
+        bisect.insort(items, click)
+        buf.clear()
+        buf.extend(items[-buf.maxlen :])
+
+    # ----------------------------
+    # Reads
+    # ----------------------------
+    def get(self, anonymous_id: str, k: int) -> list[str] | None:
+        """Newest-first item_ids of the user's last k clicks; None if the user is not loaded."""
+        with self._lock:
+            buf = self._users.get(anonymous_id)
+            if buf is None:
+                self._counters["misses"] += 1
+                return None
+            self._users.move_to_end(anonymous_id)
+            self._counters["hits"] += 1
+            return [c[2] for c in list(buf)[: -k - 1 : -1]] if k > 0 else []
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "users": len(self._users),
+                "max_users": self.max_users,
+                "hit_rate": round(self._counters["hits"] / lookups, 4) if lookups else None,
+            }
+
+    # ----------------------------
+    # Writes
+    # ----------------------------
+    def record_click(self, anonymous_id: str, click_id: str, item_id: str, clicked_at_epoch: float) -> None:
+        click = (clicked_at_epoch, click_id, item_id)
+        with self._lock:
+            buf = self._users.get(anonymous_id)
+            if buf is not None:
+                self._insert(buf, click)
+            elif anonymous_id in self._warming:
+                self._warming[anonymous_id].append(click)
+
+    def warm(self, cur, anonymous_id: str) -> None:
+        """Loads the user's newest clicks from Postgres (clicks joined through impressions_served)."""
+        with self._lock:
+            self._warming.setdefault(anonymous_id, [])
+        try:
+            cur.execute(
+                """
+                SELECT EXTRACT(EPOCH FROM c.clicked_at)::float8, c.click_id::text, c.item_id
+                FROM clicks c
+                JOIN impressions_served i ON i.impression_id = c.impression_id
+                WHERE i.anonymous_id = %s
+                ORDER BY c.clicked_at DESC
+                LIMIT %s;
+                """,
+                (anonymous_id, self.per_user),
+            )
+            rows = [(float(ts), cid, item_id) for ts, cid, item_id in cur.fetchall()]
+        finally:
+            with self._lock:
+                recorded = self._warming.pop(anonymous_id, [])
+
+        buf: deque[Click] = deque(reversed(rows), maxlen=self.per_user)
+        with self._lock:
+            # A concurrent warm of the same user may have finished first
+            for click in list(self._users.get(anonymous_id, ())) + recorded:
+                self._insert(buf, click)
+            self._users[anonymous_id] = buf
+            self._users.move_to_end(anonymous_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+                self._counters["evicted"] += 1
@@ -5,9 +5,17 @@ from backend.app.db import get_conn
 from backend.app.routes.session import router as session_router
 from backend.app.routes.recommendations import router as recommendations_router
 from backend.app.routes.clicks import router as clicks_router
+from backend.app.routes.events import router as events_router
+from backend.app.routes.metrics import router as metrics_router
 from backend.app.routers.users import router as users_router
-from backend.app.retrieval.faiss_store import get_store  # add this
+from backend.app.retrieval.faiss_store import get_store, start_store_watcher
 from backend.app.routes.auth import router as auth_router
+from backend.app.features.feature_store import FEATURE_STORE
+from backend.app.ranking.online_lr import ONLINE_LR
+from backend.app.events.engagement_writer import ENGAGEMENT_WRITER
+from backend.app.events.event_log import EVENT_LOG
+from backend.app.events.session_cache import SESSION_CACHE
+from backend.app.security.password_hasher import PASSWORD_HASHER
 
 app = FastAPI(title="News Recsys Platform API", version="0.1.0")
 
@@ -27,6 +35,8 @@ app.add_middleware(
 app.include_router(session_router)
 app.include_router(recommendations_router)
 app.include_router(clicks_router)
+app.include_router(events_router)
+app.include_router(metrics_router)
 app.include_router(users_router)
 app.include_router(auth_router)
 
@@ -36,6 +46,32 @@ def startup_event():
     print("[startup] loading FAISS store...")
     get_store()
     print("[startup] FAISS store loaded ")
+    # Picks up new bundles (data/models/faiss/CURRENT) and hot-swaps them in the background
+    start_store_watcher()
+    # Online ranker features (user click counts, item ingest times) served from memory
+    FEATURE_STORE.start()
+    # Click-stream LR ranker (only when ONLINE_LR_RANKER=1)
+    if ONLINE_LR is not None:
+        ONLINE_LR.start()
+    # Buffered engagement_events writer (COPY batches, spill to disk when Postgres is slow)
+    ENGAGEMENT_WRITER.start()
+    # Batched sessions inserts for ids minted by /session/start
+    SESSION_CACHE.start()
+    # bcrypt runs in its own small process pool (auth routes); spawn the workers now
+    PASSWORD_HASHER.start()
+    # Local append-only impression/click log (only when EVENT_LOG_ENABLED=1)
+    if EVENT_LOG is not None:
+        EVENT_LOG.start()
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    # Flush (or spill) queued engagement events before the process exits
+    ENGAGEMENT_WRITER.stop()
+    SESSION_CACHE.stop()
+    PASSWORD_HASHER.stop()
+    if EVENT_LOG is not None:
+        EVENT_LOG.close()
 
 
 @app.get("/health")
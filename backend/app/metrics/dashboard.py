@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+from concurrent.futures import Future
+from datetime import datetime, timezone
+import os
+import threading
+import time
+
+# ----------------------------
+# Dashboard metrics (served by /metrics, read from the rollup tables)
+# ----------------------------
+# Results are cached per (query, window) for a few seconds. Concurrent requests for a key
+# that is being computed wait for that computation instead of starting their own, so N
+# dashboards refreshing at once cost one pooled connection and one query per TTL, not N.
+
+SUMMARY_TTL_S = float(os.getenv("METRICS_SUMMARY_TTL_S", "10"))
+RECENT_TTL_S = float(os.getenv("METRICS_RECENT_TTL_S", "5"))
+COMPUTE_TIMEOUT_S = 30.0
+
+
+class CoalescingCache:
+    """TTL cache where concurrent misses for one key share a single computation."""
+
+    def __init__(self, max_entries: int = 256) -> None:
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: dict[tuple, tuple[float, object]] = {}  # key -> (expires_at monotonic, value)
+        self._inflight: dict[tuple, Future] = {}
+        self._counters = {"hits": 0, "misses": 0, "coalesced": 0, "errors": 0}
+
+    def get(self, key: tuple, ttl_s: float, compute):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._counters["hits"] += 1
+                return entry[1]
+            fut = self._inflight.get(key)
+            leader = fut is None
+            if leader:
+                fut = Future()
+                self._inflight[key] = fut
+                self._counters["misses"] += 1
+            else:
+                self._counters["coalesced"] += 1
+        if not leader:
+            return fut.result(timeout=COMPUTE_TIMEOUT_S)
+
+        try:
+            value = compute()
+        except Exception as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+                self._counters["errors"] += 1
+            fut.set_exception(e)
+            raise
+        with self._lock:
+            self._inflight.pop(key, None)
+            self._entries[key] = (time.monotonic() + ttl_s, value)
+            if len(self._entries) > self.max_entries:
+                now = time.monotonic()
+                self._entries = {k: v for k, v in self._entries.items() if v[0] > now}
+        fut.set_result(value)
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._counters, "entries": len(self._entries), "inflight": len(self._inflight)}
+
+
+CACHE = CoalescingCache()
+
+
+# ----------------------------
+# Queries
+# ----------------------------
+def hist_percentile(lower_ms: list[int], counts: list[int], q: float, max_ms: int | None) -> float | None:
+    """Percentile from dwell histogram counts, interpolating linearly inside the bucket it falls in."""
+    total = sum(counts)
+    if total == 0:
+        return None
+    target = q * total
+    seen = 0
+    for i, n in enumerate(counts):
+        if n and seen + n >= target:
+            lo = float(lower_ms[i])
+            hi = float(lower_ms[i + 1]) if i + 1 < len(lower_ms) else float(max_ms or lo)
+            return lo + (hi - lo) * (target - seen) / n
+        seen += n
+    return None
+
+
+def _summary(cur, window_hours: int) -> dict:
+    # Rollups are hourly: the window starts at the top of the hour it falls in
+    cur.execute("SELECT date_trunc('hour', now() - make_interval(hours => %s));", (window_hours,))
+    from_hour = cur.fetchone()[0]
+
+    cur.execute(
+        """
+        SELECT surface, locale, SUM(impressions)::bigint, SUM(clicks)::bigint
+        FROM metrics_hourly
+        WHERE hour >= %s
+        GROUP BY surface, locale
+        ORDER BY 3 DESC;
+        """,
+        (from_hour,),
+    )
+    segments = [
+        {"surface": s, "locale": loc, "impressions": int(i), "clicks": int(c), "ctr": c / i if i else 0.0}
+        for s, loc, i, c in cur.fetchall()
+    ]
+
+    cur.execute(
+        """
+        SELECT COALESCE(SUM(dwell_count), 0)::bigint, COALESCE(SUM(dwell_sum_ms), 0)::bigint,
+               MAX(dwell_max_ms), MAX(updated_at)
+        FROM metrics_hourly
+        WHERE hour >= %s;
+        """,
+        (from_hour,),
+    )
+    dwell_count, dwell_sum_ms, dwell_max_ms, rolled_up_at = cur.fetchone()
+
+    # Element-wise sum of the hourly histograms
+    cur.execute(
+        """
+        SELECT b.lower_ms, COALESCE(SUM(m.dwell_hist[b.bucket]), 0)::bigint
+        FROM metrics_dwell_buckets b
+        LEFT JOIN metrics_hourly m ON m.hour >= %s
+        GROUP BY b.bucket, b.lower_ms
+        ORDER BY b.bucket;
+        """,
+        (from_hour,),
+    )
+    hist = cur.fetchall()
+    lower_ms = [int(r[0]) for r in hist]
+    counts = [int(r[1]) for r in hist]
+
+    cur.execute(
+        """
+        SELECT item_id, SUM(clicks)::bigint
+        FROM metrics_item_clicks_hourly
+        WHERE hour >= %s
+        GROUP BY item_id
+        ORDER BY 2 DESC
+        LIMIT 10;
+        """,
+        (from_hour,),
+    )
+    top_items = [{"item_id": i, "clicks": int(c)} for i, c in cur.fetchall()]
+
+    impressions = sum(s["impressions"] for s in segments)
+    clicks = sum(s["clicks"] for s in segments)
+    return {
+        "window_hours": window_hours,
+        "from_hour": from_hour.isoformat(),
+        "rolled_up_at": rolled_up_at.isoformat() if rolled_up_at else None,
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "impressions": impressions,
+        "clicks": clicks,
+        "ctr": clicks / impressions if impressions else 0.0,
+        "dwell": {
+            "count": int(dwell_count),
+            "avg_ms": dwell_sum_ms / dwell_count if dwell_count else None,
+            "p50_ms": hist_percentile(lower_ms, counts, 0.50, dwell_max_ms),
+            "p95_ms": hist_percentile(lower_ms, counts, 0.95, dwell_max_ms),
+            "max_ms": dwell_max_ms,
+            "hist": {"lower_ms": lower_ms, "counts": counts},
+        },
+        "segments": segments,
+        "top_items": top_items,
+    }
+
+
+def _table(cur) -> dict:
+    """Columnar result: {"columns": [...], "rows": [[...], ...]} (no repeated keys per row)."""
+    return {"columns": [d.name for d in cur.description], "rows": [list(r) for r in cur.fetchall()]}
+
+
+def _recent(cur, window_hours: int, limit: int) -> dict:
+    # LIMIT reads on the served_at / clicked_at indexes
+    cur.execute(
+        """
+        SELECT impression_id, anonymous_id, session_id, surface, locale, served_at
+        FROM impressions_served
+        WHERE served_at >= now() - make_interval(hours => %s)
+        ORDER BY served_at DESC
+        LIMIT %s;
+        """,
+        (window_hours, limit),
+    )
+    impressions = _table(cur)
+    cur.execute(
+        """
+        SELECT impression_id, item_id, position, dwell_ms, open_type, clicked_at
+        FROM clicks
+        WHERE clicked_at >= now() - make_interval(hours => %s)
+        ORDER BY clicked_at DESC
+        LIMIT %s;
+        """,
+        (window_hours, limit),
+    )
+    clicks = _table(cur)
+    return {
+        "window_hours": window_hours,
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "impressions": impressions,
+        "clicks": clicks,
+    }
+
+
+def _with_cursor(fn, *args):
+    from backend.app.db import get_conn
+
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            return fn(cur, *args)
+
+
+def summary(window_hours: int) -> dict:
+    return CACHE.get(("summary", window_hours), SUMMARY_TTL_S, lambda: _with_cursor(_summary, window_hours))
+
+
+def recent(window_hours: int, limit: int) -> dict:
+    return CACHE.get(("recent", window_hours, limit), RECENT_TTL_S, lambda: _with_cursor(_recent, window_hours, limit))
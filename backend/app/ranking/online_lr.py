@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from pathlib import Path
+import os
+import threading
+import time
+
+import numpy as np
+
+# ----------------------------
+# Online logistic-regression ranker (learns from the click stream)
+# ----------------------------
+# Same inputs as ranker_lr_v1 (retrieval_score, position), but updated continuously: a daemon
+# thread tails labeled impressions from Postgres and applies mini-batch SGD. Each update
+# builds a new immutable LRCoefficients and rebinds one attribute, so the request path never
+# takes a lock and never sees a half-written model.
+#
+# An impression becomes a training example LABEL_DELAY_S after it was written (ingested_at,
+# migrations/004), so clicks on it (almost always within seconds) have been written too.
+# Written, not served: with the event log the loader inserts rows after their served_at. Every worker learns from the same ordered
+# stream, so their copies stay close; checkpoints are written atomically (last writer wins).
+
+ONLINE_LR_FEATURES = ["retrieval_score", "position"]
+
+_PROJECT_ROOT = Path(__file__).resolve().parents[3]  # backend/app/ranking -> project root
+CHECKPOINT_PATH = _PROJECT_ROOT / "data" / "models" / "rankers" / "ranker_lr_online.npz"
+OFFLINE_LR_PATH = _PROJECT_ROOT / "data" / "models" / "rankers" / "ranker_lr_v1.joblib"
+
+# Serving uses the online ranker only when enabled (it then takes precedence over LightGBM/LR)
+ONLINE_LR_ENABLED = os.getenv("ONLINE_LR_RANKER", "0") == "1"
+TAIL_INTERVAL_S = float(os.getenv("ONLINE_LR_INTERVAL_S", "10"))
+LABEL_DELAY_S = float(os.getenv("ONLINE_LR_LABEL_DELAY_S", "120"))
+CHECKPOINT_EVERY_S = float(os.getenv("ONLINE_LR_CHECKPOINT_S", "300"))
+MAX_WINDOW_S = 600.0  # ingested_at span read per query while catching up
+
+# RMSProp-scaled SGD: per-feature step sizes (position is ~10x the scale of retrieval_score)
+# that do not decay to zero, so the model keeps tracking shifts in click behaviour.
+BATCH_SIZE = 256
+LEARNING_RATE = 0.02
+RMS_DECAY = 0.99
+L2 = 1e-4
+_EPS = 1e-8
+
+
+@dataclass(frozen=True)
+class LRCoefficients:
+    weights: np.ndarray   # float64 [len(ONLINE_LR_FEATURES)]
+    bias: float
+    n_examples: int       # examples learned from since initialization
+    updated_at: float     # epoch seconds of the last update
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        z = np.asarray(X, dtype=np.float64) @ self.weights + self.bias
+        return 1.0 / (1.0 + np.exp(-z))
+
+
+class OnlineLR:
+    """
+    Mini-batch SGD logistic regression fed by labeled impressions.
+
+    Reads (`predict`) use whatever `coefficients` points to; only the learner thread
+    writes, so the swap is a plain attribute rebind.
+    """
+
+    def __init__(self, checkpoint_path: Path = CHECKPOINT_PATH) -> None:
+        n = len(ONLINE_LR_FEATURES)
+        self.checkpoint_path = Path(checkpoint_path)
+        self.coefficients = LRCoefficients(weights=np.zeros(n), bias=0.0, n_examples=0, updated_at=0.0)
+        # Learner-thread state
+        self._sq_grad = np.zeros(n + 1)       # RMSProp accumulator (weights..., bias)
+        self._cursor: float | None = None     # ingested_at (epoch) up to which impressions were learned
+        self._last_checkpoint = time.monotonic()
+        self._thread: threading.Thread | None = None
+        self.ready = False
+
+    # ----------------------------
+    # Serving
+    # ----------------------------
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """Click probabilities for rows of ONLINE_LR_FEATURES."""
+        return self.coefficients.predict(X)
+
+    # ----------------------------
+    # Learning
+    # ----------------------------
+    def partial_fit(self, X: np.ndarray, y: np.ndarray, *, now: float | None = None) -> None:
+        """Applies mini-batch updates for (X, y) in order, then publishes the new coefficients."""
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if len(y) == 0:
+            return
+        coef = self.coefficients
+        params = np.r_[coef.weights, coef.bias]
+        for start in range(0, len(y), BATCH_SIZE):
+            xb = X[start : start + BATCH_SIZE]
+            err = 1.0 / (1.0 + np.exp(-(xb @ params[:-1] + params[-1]))) - y[start : start + BATCH_SIZE]
+            grad = np.r_[xb.T @ err, err.sum()] / len(err)
+            grad[:-1] += L2 * params[:-1]
+            self._sq_grad = RMS_DECAY * self._sq_grad + (1.0 - RMS_DECAY) * grad * grad
+            params = params - LEARNING_RATE * grad / (np.sqrt(self._sq_grad) + _EPS)
+
+        self.coefficients = LRCoefficients(
+            weights=params[:-1],
+            bias=float(params[-1]),
+            n_examples=coef.n_examples + len(y),
+            updated_at=time.time() if now is None else now,
+        )
+
+    def init_from_sklearn(self, model) -> None:
+        """Warm start from the offline LogisticRegression (trained on the same two features)."""
+        self.coefficients = LRCoefficients(
+            weights=np.asarray(model.coef_[0], dtype=np.float64).copy(),
+            bias=float(model.intercept_[0]),
+            n_examples=0,
+            updated_at=time.time(),
+        )
+
+    # ----------------------------
+    # Checkpoints
+    # ----------------------------
+    def save(self, path: Path | None = None) -> None:
+        path = Path(path or self.checkpoint_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        coef = self.coefficients
+        tmp = path.with_name(path.name + ".tmp.npz")
+        np.savez(
+            tmp,
+            features=np.asarray(ONLINE_LR_FEATURES, dtype=str),
+            weights=coef.weights,
+            bias=np.float64(coef.bias),
+            n_examples=np.int64(coef.n_examples),
+            updated_at=np.float64(coef.updated_at),
+            sq_grad=self._sq_grad,
+            cursor=np.float64(np.nan if self._cursor is None else self._cursor),
+        )
+        os.replace(tmp, path)
+
+    def load(self, path: Path | None = None) -> bool:
+        path = Path(path or self.checkpoint_path)
+        if not path.exists():
+            return False
+        with np.load(path, allow_pickle=False) as z:
+            if [str(f) for f in z["features"]] != ONLINE_LR_FEATURES:
+                print(f"[online_lr] Ignoring checkpoint with features {list(z['features'])}: {path}")
+                return False
+            self._sq_grad = z["sq_grad"].astype(np.float64)
+            cursor = float(z["cursor"])
+            self._cursor = None if np.isnan(cursor) else cursor
+            self.coefficients = LRCoefficients(
+                weights=z["weights"].astype(np.float64),
+                bias=float(z["bias"]),
+                n_examples=int(z["n_examples"]),
+                updated_at=float(z["updated_at"]),
+            )
+        return True
+
+    # ----------------------------
+    # Postgres event tail
+    # ----------------------------
+    def tail(self, cur) -> int:
+        """Learns from impressions written in (cursor, now - LABEL_DELAY_S]; returns examples used."""
+        cur.execute("SELECT EXTRACT(EPOCH FROM now())::float8;")
+        labeled_until = float(cur.fetchone()[0]) - LABEL_DELAY_S
+        if self._cursor is None:
+            # First start without a checkpoint: only learn from new traffic
+            self._cursor = labeled_until
+
+        n = 0
+        while self._cursor < labeled_until:
+            upper = min(labeled_until, self._cursor + MAX_WINDOW_S)
+            cur.execute(
+                """
+                SELECT
+                  ii.retrieval_score,
+                  ii.position,
+                  EXISTS (
+                    SELECT 1 FROM clicks c
+                    WHERE c.impression_id = ii.impression_id AND c.item_id = ii.item_id
+                  )::int
+                FROM impressions_served i
+                JOIN impression_items ii ON ii.impression_id = i.impression_id
+                WHERE i.ingested_at > to_timestamp(%s) AND i.ingested_at <= to_timestamp(%s)
+                ORDER BY i.ingested_at, ii.impression_id, ii.position;
+                """,
+                (self._cursor, upper),
+            )
+            rows = cur.fetchall()
+            if rows:
+                data = np.asarray(rows, dtype=np.float64)
+                self.partial_fit(np.nan_to_num(data[:, :2]), data[:, 2])
+                n += len(rows)
+            self._cursor = upper
+        return n
+
+    def _learn_loop(self, interval_s: float) -> None:
+        from backend.app.db import get_conn
+
+        while True:
+            time.sleep(interval_s)
+            try:
+                with get_conn() as conn:
+                    with conn.cursor() as cur:
+                        n = self.tail(cur)
+                if n:
+                    coef = self.coefficients
+                    print(
+                        f"[online_lr] Learned from {n} examples (total {coef.n_examples}): "
+                        f"w={coef.weights.round(4).tolist()} b={coef.bias:.4f}"
+                    )
+                if time.monotonic() - self._last_checkpoint >= CHECKPOINT_EVERY_S:
+                    self.save()
+                    self._last_checkpoint = time.monotonic()
+            except Exception as e:
+                print(f"[online_lr] Update failed: {e}")
+
+    def start(self, interval_s: float = TAIL_INTERVAL_S) -> None:
+        """Resumes from the checkpoint (else the offline LR), then learns in a daemon thread."""
+        if self.load():
+            print(f"[online_lr] Resumed from checkpoint: {self.checkpoint_path}")
+        elif OFFLINE_LR_PATH.exists():
+            try:
+                import joblib
+
+                self.init_from_sklearn(joblib.load(OFFLINE_LR_PATH))
+                print(f"[online_lr] Initialized from offline LR: {OFFLINE_LR_PATH}")
+            except Exception as e:
+                print(f"[online_lr] Could not load offline LR, starting from zero: {e}")
+        self.ready = True
+
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._learn_loop, args=(interval_s,), name="online-lr-learner", daemon=True
+            )
+            self._thread.start()
+
+
+# Module-level learner (one per process); None unless ONLINE_LR_RANKER=1
+ONLINE_LR = OnlineLR() if ONLINE_LR_ENABLED else None
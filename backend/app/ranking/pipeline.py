@@ -0,0 +1,280 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from pathlib import Path
+import re
+
+import faiss
+import joblib
+import numpy as np
+import pandas as pd
+
+from backend.app.features.definitions import RANKER_FEATURES
+from backend.app.features.feature_store import FeatureSnapshot
+from backend.app.ranking.online_lr import ONLINE_LR_FEATURES, OnlineLR
+from backend.app.ranking.tree_scorer import TreeEnsemble, trees_path_for
+from backend.app.retrieval.faiss_store import FaissStore
+
+# ----------------------------
+# Recommendation stages (retrieve -> rank -> diversity re-rank)
+# ----------------------------
+# Pure functions over a FaissStore snapshot and a RankerSet: no database access, so the
+# API route and the offline replay harness run exactly the same code.
+
+# Retrieval settings (industry-style defaults for now)
+CANDIDATE_TOP_K = 200        # retrieve this many from FAISS then take page_size
+RECENT_CLICKS_K = 5          # clicked items averaged into the user vector
+
+# Diversity re-rank settings
+LAMBDA_DIVERSITY = 0.10
+PENALTY_CAP = 0.30
+
+
+@dataclass(frozen=True)
+class RankerSet:
+    lgbm: object | None = None   # LightGBM classifier (predict_proba over RANKER_FEATURES)
+    lr: object | None = None     # LR fallback (retrieval_score, position)
+    trees: TreeEnsemble | None = None  # numpy export of the LightGBM ranker (preferred when present)
+    online_lr: OnlineLR | None = None  # click-stream LR; takes precedence once started (ONLINE_LR_RANKER=1)
+
+
+def _load_model(path: Path, name: str):
+    if not path.exists():
+        print(f"[ranker] {name} ranker not found at: {path}")
+        return None
+    try:
+        model = joblib.load(path)
+        print(f"[ranker] Loaded {name} ranker from: {path}")
+        return model
+    except Exception as e:
+        print(f"[ranker] Failed to load {name} ranker at {path}: {e}")
+        return None
+
+
+def _load_trees(lgbm_path: Path) -> TreeEnsemble | None:
+    """The .trees.npz exported next to the LightGBM model, if it is current and matches RANKER_FEATURES."""
+    path = trees_path_for(lgbm_path)
+    if not path.exists():
+        return None
+    if lgbm_path.exists() and path.stat().st_mtime < lgbm_path.stat().st_mtime:
+        print(f"[ranker] Ignoring stale tree export (older than {lgbm_path.name}): {path}")
+        return None
+    try:
+        trees = TreeEnsemble.load(path)
+    except Exception as e:
+        print(f"[ranker] Failed to load tree export at {path}: {e}")
+        return None
+    if list(trees.feature_names) != list(RANKER_FEATURES):
+        print(f"[ranker] Ignoring tree export with features {list(trees.feature_names)} != {RANKER_FEATURES}")
+        return None
+    print(f"[ranker] Loaded LightGBM tree export ({trees.n_trees} trees) from: {path}")
+    return trees
+
+
+def load_rankers(
+    lgbm_path: Path | None,
+    lr_path: Path | None,
+    *,
+    online_lr: OnlineLR | None = None,
+) -> RankerSet:
+    trees = _load_trees(lgbm_path) if lgbm_path is not None else None
+    return RankerSet(
+        # The export scores identically, so the joblib model (and LightGBM itself) is only loaded without it
+        lgbm=_load_model(lgbm_path, "LightGBM") if lgbm_path is not None and trees is None else None,
+        lr=_load_model(lr_path, "LR") if lr_path is not None else None,
+        trees=trees,
+        online_lr=online_lr,
+    )
+
+
+def faiss_retrieve_candidates(
+    store: FaissStore, clicked_item_ids: list[str], top_k: int
+) -> list[tuple[str, float]]:
+    """
+    Build user vector from clicked embeddings and retrieve candidates from FAISS.
+    Returns ranked list of (candidate_item_id, faiss_score).
+    Score is inner-product on L2-normalized vectors => cosine similarity.
+
+    `store` is the request's snapshot: a hot-swap mid-request never mixes two bundles.
+    """
+    rows = store.ids.rows_for(clicked_item_ids)
+    rows = rows[rows >= 0]
+    if rows.size == 0:
+        return []
+
+    user_vec = np.asarray(store.embeddings[np.sort(rows)], dtype=np.float32).mean(axis=0, keepdims=True)
+    faiss.normalize_L2(user_vec)
+
+    scores, idxs = store.index.search(user_vec, top_k)
+
+    out: list[tuple[str, float]] = []
+    for s, i in zip(scores[0].tolist(), idxs[0].tolist()):
+        if i < 0:
+            continue  # FAISS pads with -1 when fewer than top_k vectors exist
+        out.append((store.ids.id_at(i), float(s)))
+    return out
+
+
+def warm_candidates(
+    store: FaissStore,
+    clicked_item_ids: list[str],
+    page_size: int,
+    *,
+    top_k: int = CANDIDATE_TOP_K,
+) -> list[tuple[str, float]]:
+    """FAISS candidates for a warm user, minus already-clicked items, cut to the page size."""
+    candidates = faiss_retrieve_candidates(store, clicked_item_ids, top_k=max(top_k, page_size))
+    clicked_set = set(clicked_item_ids)
+    candidates = [(cid, s) for (cid, s) in candidates if cid not in clicked_set]
+    return candidates[:page_size]
+
+
+# ----------------------------
+# Diversity reranker (stable for cold users)
+# ----------------------------
+_STOPWORDS = {
+    "the", "a", "an", "and", "or", "to", "of", "in", "on", "for", "with", "at", "by", "from",
+    "is", "are", "was", "were", "be", "been", "it", "this", "that", "as", "but", "not",
+}
+
+
+def tokenize_title(title: str) -> list[str]:
+    title = (title or "").lower()
+    title = re.sub(r"[^a-z0-9\s]", " ", title)
+    return [t for t in title.split() if len(t) >= 3 and t not in _STOPWORDS]
+
+
+def rerank_diversity(
+    ranked: list[dict],
+    titles: dict[str, str],
+    *,
+    lambda_diversity: float = LAMBDA_DIVERSITY,
+    penalty_cap: float = PENALTY_CAP,
+) -> list[dict]:
+    """
+    MMR-style greedy diversity reranker with fractional penalty.
+
+    penalty_frac = min(penalty_cap, lambda * max_jaccard_sim(selected, candidate))
+    final_score  = rank_score * (1 - penalty_frac)
+    """
+    if not ranked:
+        return ranked
+
+    item_tokens: dict[str, set[str]] = {
+        e["item_id"]: set(tokenize_title(titles.get(e["item_id"], ""))) for e in ranked
+    }
+
+    def _jaccard(a: set[str], b: set[str]) -> float:
+        if not a or not b:
+            return 0.0
+        inter = len(a & b)
+        if inter == 0:
+            return 0.0
+        return float(inter) / float(len(a | b))
+
+    remaining = ranked.copy()
+    remaining.sort(key=lambda x: float(x["rank_score"]), reverse=True)
+
+    selected: list[dict] = []
+    first = remaining.pop(0)
+    first["final_score"] = float(first["rank_score"])
+    first["retrieval_pos"] = int(first.get("retrieval_pos", 0))
+    selected.append(first)
+
+    while remaining:
+        best_idx = 0
+        best_final = -1e18
+
+        for idx, e in enumerate(remaining):
+            iid = e["item_id"]
+            cand_toks = item_tokens.get(iid, set())
+
+            max_sim = 0.0
+            for s in selected:
+                sim = _jaccard(cand_toks, item_tokens.get(s["item_id"], set()))
+                if sim > max_sim:
+                    max_sim = sim
+
+            penalty_frac = min(float(penalty_cap), float(lambda_diversity) * float(max_sim))
+            penalty_frac = max(0.0, min(1.0, penalty_frac))
+            final_score = float(e["rank_score"]) * (1.0 - penalty_frac)
+
+            if final_score > best_final:
+                best_final = final_score
+                best_idx = idx
+
+        chosen = remaining.pop(best_idx)
+        chosen["final_score"] = float(best_final)
+        chosen["retrieval_pos"] = int(chosen.get("retrieval_pos", 0))
+        selected.append(chosen)
+
+    return selected
+
+
+def rank_candidates(
+    candidates: list[tuple[str, float]],
+    *,
+    features: FeatureSnapshot,
+    rankers: RankerSet,
+) -> list[dict]:
+    """
+    Input: candidates in retrieval order [(item_id, retrieval_score), ...]
+    Output: list of dicts, sorted by model rank_score desc.
+    """
+    enriched = []
+    for retrieval_pos, (item_id, retrieval_score) in enumerate(candidates, start=1):
+        enriched.append(
+            {
+                "item_id": item_id,
+                "retrieval_score": float(retrieval_score),
+                "retrieval_pos": int(retrieval_pos),
+            }
+        )
+
+    if not enriched:
+        return enriched
+
+    ages = features.item_age_hours
+    if len(ages) != len(enriched):
+        ages = (ages + [0.0] * len(enriched))[: len(enriched)]
+
+    columns = {
+        "retrieval_score": [e["retrieval_score"] for e in enriched],
+        "position": [e["retrieval_pos"] for e in enriched],
+        "is_warm_user": [int(features.is_warm_user)] * len(enriched),
+        "user_click_count": [int(features.user_click_count)] * len(enriched),
+        "item_age_hours": [float(x) for x in ages],
+    }
+
+    if rankers.online_lr is not None and rankers.online_lr.ready:
+        X = np.array([columns[f] for f in ONLINE_LR_FEATURES], dtype=np.float64).T
+        probs = rankers.online_lr.predict(X).astype(np.float32)
+        model_name = "lr_online"
+    elif rankers.trees is not None:
+        X = np.array([columns[f] for f in RANKER_FEATURES], dtype=np.float64).T
+        probs = rankers.trees.predict(X).astype(np.float32)
+        model_name = "lgbm_v2"
+    elif rankers.lgbm is not None:
+        X_df = pd.DataFrame(columns, columns=RANKER_FEATURES)
+        probs = rankers.lgbm.predict_proba(X_df)[:, 1].astype(np.float32)
+        model_name = "lgbm_v2"
+    elif rankers.lr is not None:
+        X_lr = pd.DataFrame(columns, columns=["retrieval_score", "position"])
+        probs = rankers.lr.predict_proba(X_lr)[:, 1].astype(np.float32)
+        model_name = "lr_v1"
+    else:
+        probs = None
+        model_name = "fallback"
+
+    if probs is None:
+        for e in enriched:
+            e["rank_score"] = 1.0 / float(e["retrieval_pos"])
+            e["ranker"] = model_name
+        return enriched
+
+    for e, p in zip(enriched, probs.tolist()):
+        e["rank_score"] = float(p)
+        e["ranker"] = model_name
+
+    enriched.sort(key=lambda x: x["rank_score"], reverse=True)
+    return enriched
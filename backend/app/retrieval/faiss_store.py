@@ -2,16 +2,39 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from pathlib import Path
+import hashlib
+import json
+import os
+import threading
+import time
 import numpy as np
 import faiss
 
+from backend.app.retrieval.id_index import IdIndex
+
 
 @dataclass(frozen=True)
 class FaissStore:
-    news_ids: np.ndarray          # shape (N,), dtype=str
-    embeddings: np.ndarray        # shape (N, D), float32, L2-normalized
-    id2row: dict[str, int]        # news_id -> row index
+    ids: IdIndex                  # compact news_id <-> row mapping (sorted, searchsorted lookups)
+    embeddings: np.ndarray        # shape (N, D), float32, L2-normalized (memory-mapped for bundles)
     index: faiss.Index            # FAISS ANN index
+    version_tag: str | None = None         # bundle version (None for legacy loose files)
+    model_version_id: int | None = None    # model_versions row (component='faiss_index')
+
+
+# Bundle layout (written by src/recommendation/build_index.py):
+#   data/models/faiss/CURRENT                      -> text file with the active version_tag
+#   data/models/faiss/<version_tag>/manifest.json  -> files + sha256 checksums
+#   data/models/faiss/<version_tag>/news_embeddings.npy
+#   data/models/faiss/<version_tag>/news_ids.npy
+#   data/models/faiss/<version_tag>/news_retrieval.index
+BUNDLE_FILES = ("news_embeddings.npy", "news_ids.npy", "news_retrieval.index")
+MANIFEST_NAME = "manifest.json"
+CURRENT_POINTER = "CURRENT"
+
+VERIFY_CHECKSUMS = os.getenv("FAISS_VERIFY_CHECKSUMS", "1") == "1"
+MMAP_EMBEDDINGS = os.getenv("FAISS_MMAP_EMBEDDINGS", "1") == "1"
+RELOAD_INTERVAL_S = float(os.getenv("FAISS_RELOAD_INTERVAL_S", "30"))
 
 
 def _project_root() -> Path:
@@ -19,44 +42,236 @@ def _project_root() -> Path:
     return Path(__file__).resolve().parents[3]
 
 
-def load_faiss_store() -> FaissStore:
-    root = _project_root()
-    models_dir = root / "data" / "models"
+def _models_dir() -> Path:
+    return _project_root() / "data" / "models"
 
-    embed_path = models_dir / "news_embeddings.npy"
-    ids_path = models_dir / "news_ids.npy"
-    index_path = models_dir / "news_retrieval.index"
 
-    missing = [str(p) for p in (embed_path, ids_path, index_path) if not p.exists()]
+def bundles_dir() -> Path:
+    return _models_dir() / "faiss"
+
+
+def sha256_file(path: Path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def read_current_tag() -> str | None:
+    """
+    Returns the active bundle version_tag, or None if no bundle was published yet.
+    The pointer is replaced atomically (os.replace) by the builder, so a reader
+    always sees either the old or the new tag, never a partial write.
+    """
+    pointer = bundles_dir() / CURRENT_POINTER
+    if not pointer.exists():
+        return None
+    tag = pointer.read_text().strip()
+    return tag or None
+
+
+def _verify_bundle(bundle_dir: Path, manifest: dict) -> None:
+    files = manifest.get("files", {})
+    missing = [name for name in BUNDLE_FILES if not (bundle_dir / name).exists() or name not in files]
     if missing:
-        raise FileNotFoundError(f"Missing retrieval assets: {missing}")
+        raise FileNotFoundError(f"Bundle {bundle_dir} is incomplete: {missing}")
+
+    if not VERIFY_CHECKSUMS:
+        return
+
+    for name in BUNDLE_FILES:
+        expected = files[name]["sha256"]
+        actual = sha256_file(bundle_dir / name)
+        if actual != expected:
+            raise ValueError(f"Checksum mismatch for {bundle_dir / name}: {actual} != {expected}")
+
+
+def _lookup_model_version_id(version_tag: str) -> int | None:
+    """
+    model_versions is the lineage table; a bundle that was never registered still serves,
+    impressions just carry a NULL faiss_index_version_id.
+    """
+    try:
+        from backend.app.db import get_conn
+
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT model_version_id
+                    FROM model_versions
+                    WHERE component = 'faiss_index' AND version_tag = %s;
+                    """,
+                    (version_tag,),
+                )
+                row = cur.fetchone()
+        return int(row[0]) if row else None
+    except Exception as e:
+        print(f"[faiss_store] model_versions lookup failed for {version_tag}: {e}")
+        return None
 
+
+def _load_assets(
+    embed_path: Path,
+    ids_path: Path,
+    index_path: Path,
+    *,
+    pre_normalized: bool = False,
+    ids_fixed_width: bool = False,
+) -> tuple[IdIndex, np.ndarray, faiss.Index]:
     print(f"[faiss_store] Loading ids from: {ids_path}")
-    news_ids = np.load(ids_path, allow_pickle=True).astype(str)
+    # Fixed-width unicode ids load as a flat buffer; legacy files are pickled object arrays
+    news_ids = np.load(ids_path, allow_pickle=not ids_fixed_width)
+
+    print("[faiss_store] Building compact id index...")
+    ids = IdIndex.from_ids(news_ids)
+    del news_ids
 
     print(f"[faiss_store] Loading embeddings from: {embed_path}")
-    embeddings = np.load(embed_path).astype(np.float32)
-    embeddings = np.ascontiguousarray(embeddings)
+    if pre_normalized:
+        # Manifest says rows are float32 + L2-normalized: map the file instead of copying it,
+        # pages are only faulted in for the rows a request actually reads.
+        embeddings = np.load(embed_path, mmap_mode="r" if MMAP_EMBEDDINGS else None)
+        if embeddings.dtype != np.float32 or not embeddings.flags["C_CONTIGUOUS"]:
+            embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    else:
+        embeddings = np.load(embed_path).astype(np.float32)
+        embeddings = np.ascontiguousarray(embeddings)
 
-    # Safety: embeddings should already be normalized (cosine/IP). Normalize again defensively.
-    faiss.normalize_L2(embeddings)
+        # Safety: embeddings should already be normalized (cosine/IP). Normalize again defensively.
+        faiss.normalize_L2(embeddings)
 
     print(f"[faiss_store] Loading FAISS index from: {index_path}")
     index = faiss.read_index(str(index_path))
 
-    print("[faiss_store] Building id->row map...")
-    id2row = {str(nid): i for i, nid in enumerate(news_ids)}
+    return ids, embeddings, index
+
+
+def load_bundle(version_tag: str) -> FaissStore:
+    return load_bundle_dir(bundles_dir() / version_tag)
+
+
+def load_bundle_dir(bundle_dir: Path, *, lookup_version_id: bool = True) -> FaissStore:
+    """`lookup_version_id=False` keeps offline users (replay workers) off the database."""
+    manifest_path = bundle_dir / MANIFEST_NAME
+    if not manifest_path.exists():
+        raise FileNotFoundError(f"Missing bundle manifest: {manifest_path}")
 
-    print(f"[faiss_store] Ready. N={len(news_ids)}, D={embeddings.shape[1]}")
-    return FaissStore(news_ids=news_ids, embeddings=embeddings, id2row=id2row, index=index)
+    manifest = json.loads(manifest_path.read_text())
+    _verify_bundle(bundle_dir, manifest)
+    version_tag = manifest.get("version_tag", bundle_dir.name)
 
+    ids, embeddings, index = _load_assets(
+        bundle_dir / "news_embeddings.npy",
+        bundle_dir / "news_ids.npy",
+        bundle_dir / "news_retrieval.index",
+        pre_normalized=bool(manifest.get("normalized", False)),
+        ids_fixed_width=manifest.get("ids_format") == "fixed_unicode",
+    )
+    model_version_id = _lookup_model_version_id(version_tag) if lookup_version_id else None
 
-# Module-level singleton (loaded once per process)
+    print(
+        f"[faiss_store] Ready. bundle={version_tag} model_version_id={model_version_id} "
+        f"N={len(ids)}, D={embeddings.shape[1]}, ids={ids.encoding}"
+    )
+    return FaissStore(
+        ids=ids,
+        embeddings=embeddings,
+        index=index,
+        version_tag=version_tag,
+        model_version_id=model_version_id,
+    )
+
+
+def load_faiss_store() -> FaissStore:
+    """
+    Loads the bundle named by data/models/faiss/CURRENT.
+    Falls back to the legacy loose files in data/models/ when no bundle was published.
+    """
+    tag = read_current_tag()
+    if tag is not None:
+        return load_bundle(tag)
+
+    models_dir = _models_dir()
+
+    embed_path = models_dir / "news_embeddings.npy"
+    ids_path = models_dir / "news_ids.npy"
+    index_path = models_dir / "news_retrieval.index"
+
+    missing = [str(p) for p in (embed_path, ids_path, index_path) if not p.exists()]
+    if missing:
+        raise FileNotFoundError(f"Missing retrieval assets: {missing}")
+
+    ids, embeddings, index = _load_assets(embed_path, ids_path, index_path)
+
+    print(f"[faiss_store] Ready (legacy loose files). N={len(ids)}, D={embeddings.shape[1]}")
+    return FaissStore(ids=ids, embeddings=embeddings, index=index)
+
+
+# Module-level store (loaded once per process, replaced atomically on a new bundle).
+# Readers call get_store() once per request and keep that snapshot for the whole request;
+# rebinding STORE never mutates a FaissStore that an in-flight request still holds.
 STORE: FaissStore | None = None
+_LOAD_LOCK = threading.Lock()  # serializes loaders only, readers never take it
+_WATCHER: threading.Thread | None = None
 
 
 def get_store() -> FaissStore:
     global STORE
-    if STORE is None:
-        STORE = load_faiss_store()
-    return STORE
+    store = STORE
+    if store is None:
+        with _LOAD_LOCK:
+            if STORE is None:
+                STORE = load_faiss_store()
+            store = STORE
+    return store
+
+
+def reload_store_if_changed() -> bool:
+    """
+    Builds the new FaissStore off to the side while the current one keeps serving,
+    then swaps the module reference. Returns True if a swap happened.
+    """
+    global STORE
+    tag = read_current_tag()
+    if tag is None:
+        return False
+
+    with _LOAD_LOCK:
+        current = STORE
+        if current is not None and current.version_tag == tag:
+            return False
+
+        new_store = load_bundle(tag)
+        STORE = new_store
+
+    old_tag = current.version_tag if current is not None else None
+    print(f"[faiss_store] Swapped store: {old_tag} -> {new_store.version_tag}")
+    return True
+
+
+def _watch_loop(interval_s: float) -> None:
+    while True:
+        time.sleep(interval_s)
+        try:
+            reload_store_if_changed()
+        except Exception as e:
+            # Keep serving the old snapshot; a broken bundle must never take retrieval down.
+            print(f"[faiss_store] Reload failed, keeping current store: {e}")
+
+
+def start_store_watcher(interval_s: float = RELOAD_INTERVAL_S) -> threading.Thread | None:
+    global _WATCHER
+    if interval_s <= 0:
+        return None
+    if _WATCHER is not None and _WATCHER.is_alive():
+        return _WATCHER
+
+    _WATCHER = threading.Thread(target=_watch_loop, args=(interval_s,), name="faiss-store-watcher", daemon=True)
+    _WATCHER.start()
+    print(f"[faiss_store] Watching {bundles_dir() / CURRENT_POINTER} every {interval_s:.0f}s")
+    return _WATCHER
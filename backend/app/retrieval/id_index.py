@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Iterable
+import numpy as np
+
+ENCODING_MIND_INT64 = "mind_int64"
+ENCODING_BYTES = "bytes"
+
+# int64 holds up to 18 decimal digits safely
+_MAX_DIGITS = 18
+
+
+def _mind_codes(ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized MIND id ('N12345') -> int64 code. Returns (codes, valid mask).
+
+    Only ids that round-trip exactly ('N' + digits, no leading zero) are valid,
+    so f"N{code}" always reproduces the original id.
+    """
+    digits = np.char.lstrip(ids, "N")
+    lengths = np.char.str_len(digits)
+    valid = (
+        np.char.startswith(ids, "N")
+        & (np.char.str_len(ids) == lengths + 1)
+        & (lengths >= 1)
+        & (lengths <= _MAX_DIGITS)
+        & np.char.isdigit(digits)
+        # isdigit also accepts non-ASCII digits ('²', '１'); ASCII iff UTF-8 length == char length
+        & (np.char.str_len(np.char.encode(digits, "utf-8")) == lengths)
+        & ~np.char.startswith(digits, "0")
+    )
+    codes = np.full(ids.shape[0], -1, dtype=np.int64)
+    if valid.any():
+        codes[valid] = digits[valid].astype(np.int64)
+    return codes, valid
+
+
+@dataclass(frozen=True)
+class IdIndex:
+    """
+    Compact news_id <-> row mapping.
+
+    keys_sorted / rows_sorted: encoded ids (int64 for MIND ids, fixed-width bytes otherwise)
+    in sorted order, with the embedding row of each key. Batch id->row resolution is a
+    single np.searchsorted instead of a Python dict over every id.
+
+    by_row: encoded id of each row (row -> id).
+    """
+
+    encoding: str
+    keys_sorted: np.ndarray
+    rows_sorted: np.ndarray
+    by_row: np.ndarray
+
+    def __len__(self) -> int:
+        return int(self.by_row.shape[0])
+
+    @classmethod
+    def from_ids(cls, news_ids: np.ndarray) -> "IdIndex":
+        ids = np.asarray(news_ids)
+        if ids.dtype.kind != "U":
+            ids = ids.astype(str)
+
+        codes, valid = _mind_codes(ids)
+        if ids.shape[0] > 0 and bool(valid.all()):
+            encoding, by_row = ENCODING_MIND_INT64, codes
+        else:
+            encoding, by_row = ENCODING_BYTES, np.char.encode(ids, "utf-8")
+
+        order = np.argsort(by_row, kind="stable")
+        keys_sorted = np.ascontiguousarray(by_row[order])
+        if keys_sorted.shape[0] > 1 and bool(np.any(keys_sorted[1:] == keys_sorted[:-1])):
+            raise ValueError("Duplicate news_ids in id mapping")
+
+        return cls(encoding=encoding, keys_sorted=keys_sorted, rows_sorted=order.astype(np.int32), by_row=by_row)
+
+    def _encode(self, ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        if self.encoding == ENCODING_MIND_INT64:
+            return _mind_codes(ids)
+
+        encoded = np.char.encode(ids, "utf-8")
+        # Longer than any stored key -> cannot match (and would be truncated by the cast)
+        valid = np.char.str_len(encoded) <= self.keys_sorted.dtype.itemsize
+        return encoded.astype(self.keys_sorted.dtype), valid
+
+    def rows_for(self, news_ids: Iterable[str]) -> np.ndarray:
+        """Vectorized id -> row (int64). Missing ids map to -1."""
+        ids = np.asarray(list(news_ids) if not isinstance(news_ids, np.ndarray) else news_ids)
+        if ids.shape[0] == 0 or self.keys_sorted.shape[0] == 0:
+            return np.full(ids.shape[0], -1, dtype=np.int64)
+        if ids.dtype.kind != "U":
+            ids = ids.astype(str)
+
+        keys, valid = self._encode(ids)
+        pos = np.searchsorted(self.keys_sorted, keys)
+        pos = np.minimum(pos, self.keys_sorted.shape[0] - 1)
+        found = valid & (self.keys_sorted[pos] == keys)
+        return np.where(found, self.rows_sorted[pos].astype(np.int64), -1)
+
+    def row_of(self, news_id: str) -> int | None:
+        row = int(self.rows_for([news_id])[0])
+        return None if row < 0 else row
+
+    def __contains__(self, news_id: object) -> bool:
+        return isinstance(news_id, str) and self.row_of(news_id) is not None
+
+    def id_at(self, row: int) -> str:
+        key = self.by_row[int(row)]
+        if self.encoding == ENCODING_MIND_INT64:
+            return f"N{int(key)}"
+        return bytes(key).decode("utf-8")
+
+    def ids_at(self, rows: Iterable[int]) -> list[str]:
+        return [self.id_at(r) for r in rows]
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from backend.app.db import get_conn
+from backend.app.features.feature_store import FEATURE_STORE
 
 router = APIRouter(prefix="/users", tags=["users"])
 
@@ -15,28 +16,28 @@ def recent_clicks(anonymous_id: str, limit: int = 10):
     """
     Read-only endpoint: most recent clicked item_ids for an anonymous user.
 
-    We join:
+    Served from the feature store's per-user ring buffer. The first request for a user loads
+    it from Postgres, joining:
       clicks -> impressions_served (via impression_id) -> anonymous_id
     """
     if limit < 1 or limit > 100:
         raise HTTPException(status_code=400, detail="limit must be between 1 and 100")
 
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT c.item_id
-                FROM clicks c
-                JOIN impressions_served i ON i.impression_id = c.impression_id
-                WHERE i.anonymous_id = %s
-                ORDER BY c.clicked_at DESC
-                LIMIT %s;
-                """,
-                (anonymous_id, limit),
-            )
-            rows = cur.fetchall()
+    recent = FEATURE_STORE.recent_clicks
+    item_ids = recent.get(anonymous_id, limit)
+    if item_ids is None:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                recent.warm(cur, anonymous_id)
+        item_ids = recent.get(anonymous_id, limit) or []
 
     return RecentClicksResponse(
         anonymous_id=anonymous_id,
-        recent_clicks=[r[0] for r in rows],
+        recent_clicks=item_ids,
     )
+
+
+@router.get("/recent_clicks/metrics")
+def recent_clicks_metrics():
+    """Ring buffer hit rate and number of users held by this worker."""
+    return FEATURE_STORE.recent_clicks.stats()
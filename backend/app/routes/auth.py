@@ -1,15 +1,16 @@
 from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, EmailStr
-from passlib.context import CryptContext
 import jwt
 import os
 from datetime import datetime, timedelta, timezone
 
 from backend.app.db import get_conn
+from backend.app.security.password_hasher import HASH_TIMEOUT_S, PASSWORD_HASHER, HasherBusy
+from backend.app.security.token_cache import TOKEN_CACHE, CachedToken, token_digest
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
-pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
 JWT_SECRET = os.getenv("JWT_SECRET", "dev_secret_change_me")
 JWT_ALG = "HS256"
 JWT_EXP_HOURS = int(os.getenv("JWT_EXP_HOURS", "72"))
@@ -36,54 +37,139 @@ def _create_token(user_id: str, email: str) -> str:
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALG)
 
-def get_current_user(request: Request):
+def _verified_token(request: Request) -> CachedToken:
     auth = request.headers.get("authorization")
     if not auth or not auth.lower().startswith("bearer "):
         raise HTTPException(status_code=401, detail="Missing bearer token")
     token = auth.split(" ", 1)[1].strip()
+    digest = token_digest(token)
+    entry = TOKEN_CACHE.get(digest)
+    if entry is not None:
+        return entry
     try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
-        return {"user_id": payload["sub"], "email": payload.get("email")}
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG], options={"require": ["exp"]})
+        user = {"user_id": payload["sub"], "email": payload.get("email")}
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except Exception:
         raise HTTPException(status_code=401, detail="Invalid token")
+    return TOKEN_CACHE.put(digest, user, payload["exp"])
 
-@router.post("/register", response_model=AuthResp)
-def register(payload: RegisterReq):
-    password_hash = pwd_ctx.hash(payload.password)
+def _resolve_anonymous_id(user_id: str) -> str | None:
+    """users.anonymous_id (migrations/005); None if the user no longer exists."""
     with get_conn() as conn:
         with conn.cursor() as cur:
+            cur.execute("SELECT anonymous_id FROM users WHERE user_id = %s;", (int(user_id),))
+            row = cur.fetchone()
+            if row is None or row[0] is not None:
+                return row[0] if row else None
+            # Created between the migration's backfill and this code being deployed
             cur.execute(
                 """
-                INSERT INTO users (email, password_hash)
-                VALUES (%s, %s)
+                UPDATE users SET anonymous_id = COALESCE(anonymous_id, 'user_' || user_id)
+                WHERE user_id = %s
+                RETURNING anonymous_id;
+                """,
+                (int(user_id),),
+            )
+            anonymous_id = cur.fetchone()[0]
+        conn.commit()
+    return anonymous_id
+
+def get_current_user(request: Request):
+    return dict(_verified_token(request).user)
+
+def get_current_user_with_anon(request: Request):
+    """get_current_user plus the user's anonymous_id (users.anonymous_id), looked up once per token."""
+    entry = _verified_token(request)
+    if entry.anonymous_id is None:
+        anonymous_id = _resolve_anonymous_id(entry.user["user_id"])
+        if anonymous_id is None:
+            raise HTTPException(status_code=401, detail="Unknown user")
+        entry.anonymous_id = anonymous_id
+    return {**entry.user, "anonymous_id": entry.anonymous_id}
+
+def get_optional_user_with_anon(request: Request):
+    """
+    Like get_current_user_with_anon for routes that also serve anonymous callers: None without
+    a token, and also for an expired / invalid one (the route works without auth, so a stale
+    token must not turn into a 401).
+    """
+    if not request.headers.get("authorization"):
+        return None
+    try:
+        return get_current_user_with_anon(request)
+    except HTTPException as e:
+        if e.status_code == 401:
+            return None
+        raise
+
+def _busy() -> HTTPException:
+    # Login spike: shed auth load instead of letting it queue up behind bcrypt
+    return HTTPException(
+        status_code=503,
+        detail="Authentication is busy, retry shortly",
+        headers={"Retry-After": str(max(1, int(HASH_TIMEOUT_S)))},
+    )
+
+def _insert_user(email: str, password_hash: str) -> tuple[str, str]:
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            # anonymous_id is derived from the new user_id, so take the id first
+            cur.execute(
+                """
+                WITH new_id AS (SELECT nextval(pg_get_serial_sequence('users', 'user_id')) AS user_id)
+                INSERT INTO users (user_id, email, password_hash, anonymous_id)
+                SELECT user_id, %s, %s, 'user_' || user_id FROM new_id
                 RETURNING user_id::text, email
                 """,
-                (payload.email.lower(), password_hash),
+                (email, password_hash),
             )
             user_id, email = cur.fetchone()
             conn.commit()
-    token = _create_token(user_id, email)
-    return AuthResp(access_token=token)
+    return user_id, email
 
-@router.post("/login", response_model=AuthResp)
-def login(payload: LoginReq):
+def _fetch_user(email: str):
     with get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 "SELECT user_id::text, email, password_hash FROM users WHERE email=%s",
-                (payload.email.lower(),),
+                (email,),
             )
-            row = cur.fetchone()
-            if not row:
-                raise HTTPException(status_code=401, detail="Invalid credentials")
-            user_id, email, password_hash = row
-            if not pwd_ctx.verify(payload.password, password_hash):
-                raise HTTPException(status_code=401, detail="Invalid credentials")
+            return cur.fetchone()
+
+# async handlers: DB work runs in the threadpool and bcrypt in PASSWORD_HASHER's process pool,
+# so a login waiting on its hash holds neither a threadpool slot nor a DB connection.
+@router.post("/register", response_model=AuthResp)
+async def register(payload: RegisterReq):
+    try:
+        password_hash = await PASSWORD_HASHER.hash(payload.password)
+    except HasherBusy:
+        raise _busy()
+    user_id, email = await run_in_threadpool(_insert_user, payload.email.lower(), password_hash)
     token = _create_token(user_id, email)
     return AuthResp(access_token=token)
 
+@router.post("/login", response_model=AuthResp)
+async def login(payload: LoginReq):
+    row = await run_in_threadpool(_fetch_user, payload.email.lower())
+    if not row:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    user_id, email, password_hash = row
+    try:
+        ok = await PASSWORD_HASHER.verify(payload.password, password_hash)
+    except HasherBusy:
+        raise _busy()
+    if not ok:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    token = _create_token(user_id, email)
+    return AuthResp(access_token=token)
+
+@router.get("/metrics")
+def auth_metrics():
+    """bcrypt pool load (in-flight/queued hashes, rejections, timeouts, latencies) and token cache hit rate."""
+    return {"password_hasher": PASSWORD_HASHER.metrics(), "token_cache": TOKEN_CACHE.stats()}
+
 @router.get("/me")
 def me(user=Depends(get_current_user)):
     return user
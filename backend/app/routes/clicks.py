@@ -1,6 +1,19 @@
+from datetime import datetime, timezone
+import uuid
+
 from fastapi import APIRouter, HTTPException
+from pydantic import ValidationError
+
 from backend.app.db import get_conn
-from backend.app.schemas import ClickRequest, ClickResponse
+from backend.app.schemas import (
+    ClickBatchRequest,
+    ClickBatchResponse,
+    ClickEventResult,
+    ClickRequest,
+    ClickResponse,
+)
+from backend.app.events.event_log import EVENT_LOG, check_int_fields
+from backend.app.features.feature_store import FEATURE_STORE
 
 router = APIRouter(prefix="/click", tags=["click"])
 
@@ -11,6 +24,9 @@ def log_click(payload: ClickRequest):
     Logs a click event.
     Idempotent: one click per (impression_id, item_id).
     """
+    if EVENT_LOG is not None:
+        return _log_click_event(payload)
+
     with get_conn() as conn:
         try:
             with conn.cursor() as cur:
@@ -19,7 +35,10 @@ def log_click(payload: ClickRequest):
                     INSERT INTO clicks(impression_id, item_id, position, dwell_ms, open_type)
                     VALUES (%s, %s, %s, %s, %s)
                     ON CONFLICT (impression_id, item_id) DO NOTHING
-                    RETURNING click_id;
+                    RETURNING
+                      click_id,
+                      clicked_at,
+                      (SELECT anonymous_id FROM impressions_served WHERE impression_id = clicks.impression_id);
                     """,
                     (
                         payload.impression_id,
@@ -38,4 +57,163 @@ def log_click(payload: ClickRequest):
     if row is None:
         return ClickResponse(status="duplicate_ignored")
 
+    # Visible to this worker's next request; other workers pick it up on their next tail
+    click_id, clicked_at, anonymous_id = row
+    FEATURE_STORE.record_click(anonymous_id, str(click_id), clicked_at.timestamp(), payload.item_id)
+
+    return ClickResponse(status="ok")
+
+
+def _log_click_event(payload: ClickRequest) -> ClickResponse:
+    """
+    Appends the click to the local event log (EVENT_LOG_ENABLED=1). Duplicates are dropped
+    when the loader inserts it, and the feature store sees it on its next tail after that.
+    """
+    try:
+        impression_id = str(uuid.UUID(payload.impression_id))
+    except ValueError:
+        # A malformed id would fail the loader's COPY for the whole batch
+        raise HTTPException(status_code=422, detail="impression_id must be a UUID") from None
+    try:
+        _check_click_fields(payload)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e)) from None
+
+    EVENT_LOG.append(_click_record(payload, impression_id))
     return ClickResponse(status="ok")
+
+
+def _check_click_fields(payload: ClickRequest) -> None:
+    check_int_fields({"position": payload.position, "dwell_ms": payload.dwell_ms})
+
+
+def _click_record(payload: ClickRequest, impression_id: str) -> dict:
+    return {
+        "type": "click",
+        "click_id": str(uuid.uuid4()),
+        "impression_id": impression_id,
+        "item_id": payload.item_id,
+        "position": payload.position,
+        "clicked_at": datetime.now(timezone.utc).isoformat(),
+        "dwell_ms": payload.dwell_ms,
+        "open_type": payload.open_type,
+    }
+
+
+# One statement for the whole batch: unnest the column arrays, keep rows whose impression and
+# item exist (FK-safe, so one bad event cannot abort the batch), insert them, and report per
+# input index whether a row was written (ok) or already existed (duplicate).
+_BATCH_INSERT_SQL = """
+WITH incoming AS (
+  SELECT *
+  FROM unnest(%s::int[], %s::uuid[], %s::text[], %s::int[], %s::int[], %s::text[])
+    AS t(idx, impression_id, item_id, position, dwell_ms, open_type)
+),
+valid AS (
+  SELECT inc.*, i.anonymous_id
+  FROM incoming inc
+  JOIN impressions_served i ON i.impression_id = inc.impression_id
+  JOIN items it ON it.item_id = inc.item_id
+),
+ins AS (
+  INSERT INTO clicks(impression_id, item_id, position, dwell_ms, open_type)
+  SELECT impression_id, item_id, position, dwell_ms, open_type
+  FROM valid
+  ORDER BY idx
+  ON CONFLICT (impression_id, item_id) DO NOTHING
+  RETURNING click_id, clicked_at, impression_id, item_id
+)
+SELECT v.idx, ins.click_id, ins.clicked_at, v.anonymous_id
+FROM valid v
+LEFT JOIN ins ON ins.impression_id = v.impression_id AND ins.item_id = v.item_id;
+"""
+
+
+@router.post("/batch", response_model=ClickBatchResponse)
+def log_click_batch(payload: ClickBatchRequest):
+    """
+    Logs many click events in one round trip and one transaction.
+    Same idempotency as POST /click; each event gets its own status:
+      ok        - inserted
+      duplicate - (impression_id, item_id) already clicked, or repeated in this batch
+      invalid   - malformed event, or unknown impression / item
+
+    With EVENT_LOG_ENABLED=1 the events go to the event log like POST /click (their impression
+    may not be loaded yet): well-formed events are "ok" and the loader drops duplicates and
+    unknown references.
+    """
+    results: list[ClickEventResult | None] = [None] * len(payload.clicks)
+    events: list[tuple[int, ClickRequest]] = []
+    seen: set[tuple[str, str]] = set()
+
+    for idx, raw in enumerate(payload.clicks):
+        try:
+            event = ClickRequest.model_validate(raw)
+            impression_id = str(uuid.UUID(event.impression_id))
+            if EVENT_LOG is not None:
+                _check_click_fields(event)
+        except (ValidationError, ValueError) as e:
+            results[idx] = ClickEventResult(index=idx, status="invalid", detail=str(e).splitlines()[0])
+            continue
+        key = (impression_id, event.item_id)
+        if key in seen:
+            results[idx] = ClickEventResult(index=idx, status="duplicate", detail="repeated in batch")
+            continue
+        seen.add(key)
+        events.append((idx, event.model_copy(update={"impression_id": impression_id})))
+
+    if EVENT_LOG is not None:
+        return _log_click_batch_events(results, events)
+
+    rows = []
+    if events:
+        with get_conn() as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        _BATCH_INSERT_SQL,
+                        (
+                            [idx for idx, _ in events],
+                            [e.impression_id for _, e in events],
+                            [e.item_id for _, e in events],
+                            [e.position for _, e in events],
+                            [e.dwell_ms for _, e in events],
+                            [e.open_type for _, e in events],
+                        ),
+                    )
+                    rows = cur.fetchall()
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                raise HTTPException(status_code=500, detail=str(e))
+
+    item_by_idx = {idx: e.item_id for idx, e in events}
+    for idx, click_id, clicked_at, anonymous_id in rows:
+        if click_id is None:
+            results[idx] = ClickEventResult(index=idx, status="duplicate")
+            continue
+        results[idx] = ClickEventResult(index=idx, status="ok")
+        FEATURE_STORE.record_click(anonymous_id, str(click_id), clicked_at.timestamp(), item_by_idx[idx])
+
+    for idx, _ in events:
+        if results[idx] is None:
+            results[idx] = ClickEventResult(index=idx, status="invalid", detail="unknown impression_id or item_id")
+
+    return _batch_response(results)
+
+
+def _log_click_batch_events(
+    results: list[ClickEventResult | None], events: list[tuple[int, ClickRequest]]
+) -> ClickBatchResponse:
+    # One fsync for the batch: only the last append waits, and it is synced after all the others
+    for n, (idx, event) in enumerate(events):
+        EVENT_LOG.append(_click_record(event, event.impression_id), wait=n == len(events) - 1)
+        results[idx] = ClickEventResult(index=idx, status="ok")
+    return _batch_response(results)
+
+
+def _batch_response(results: list[ClickEventResult]) -> ClickBatchResponse:
+    counts = {"ok": 0, "duplicate": 0, "invalid": 0}
+    for r in results:
+        counts[r.status] += 1
+    return ClickBatchResponse(**counts, results=results)
@@ -0,0 +1,56 @@
+from fastapi import APIRouter, status
+from pydantic import ValidationError
+
+from backend.app.events.engagement_writer import ENGAGEMENT_WRITER, WriterOverloaded
+from backend.app.schemas import (
+    EngagementBatchRequest,
+    EngagementBatchResponse,
+    EngagementEvent,
+    EngagementEventError,
+)
+
+router = APIRouter(prefix="/events", tags=["events"])
+
+
+@router.post("", response_model=EngagementBatchResponse, status_code=status.HTTP_202_ACCEPTED)
+def ingest_events(payload: EngagementBatchRequest):
+    """
+    Queues engagement events (open/save/share/hide/dwell/scroll) for the buffered writer.
+    Accepted events are written to engagement_events within about a second, or spilled to
+    disk and replayed if Postgres is unavailable. Events whose session / impression is not
+    written yet are retried until it is (up to ENGAGEMENT_DEFER_MAX_S). Invalid events are
+    reported by index; so are events rejected because this worker's writer is overloaded
+    (counted in `rejected`, safe to resend).
+    """
+    accepted = 0
+    rejected = 0
+    errors: list[EngagementEventError] = []
+    for idx, raw in enumerate(payload.events):
+        try:
+            event = EngagementEvent.model_validate(raw)
+            ENGAGEMENT_WRITER.enqueue(
+                event_type=event.event_type,
+                session_id=event.session_id,
+                impression_id=event.impression_id,
+                item_id=event.item_id,
+                event_value=event.event_value,
+                occurred_at=event.occurred_at,
+            )
+        except (ValidationError, ValueError) as e:
+            errors.append(EngagementEventError(index=idx, detail=str(e).splitlines()[0]))
+            continue
+        except WriterOverloaded as e:
+            rejected += 1
+            errors.append(EngagementEventError(index=idx, detail=f"{e}, retry later"))
+            continue
+        accepted += 1
+
+    return EngagementBatchResponse(
+        accepted=accepted, invalid=len(errors) - rejected, rejected=rejected, errors=errors
+    )
+
+
+@router.get("/metrics")
+def writer_metrics():
+    """Queue depth, flush latency/throughput and spill counters of this worker's writer."""
+    return ENGAGEMENT_WRITER.metrics()
@@ -0,0 +1,32 @@
+from fastapi import APIRouter, HTTPException, Query
+
+from backend.app.metrics import dashboard
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+@router.get("/summary")
+def metrics_summary(window_hours: int = Query(24, ge=1, le=168)):
+    """
+    Impressions, clicks, CTR (overall and per surface/locale), dwell avg/p50/p95 and top
+    clicked items over the last `window_hours`, from the hourly rollups. Cached for a few seconds.
+    """
+    try:
+        return dashboard.summary(window_hours)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"metrics unavailable: {e}")
+
+
+@router.get("/recent")
+def metrics_recent(window_hours: int = Query(24, ge=1, le=168), limit: int = Query(50, ge=10, le=200)):
+    """Newest impressions and clicks in the window, as {"columns": [...], "rows": [[...]]} tables."""
+    try:
+        return dashboard.recent(window_hours, limit)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"metrics unavailable: {e}")
+
+
+@router.get("/cache")
+def metrics_cache():
+    """Hit / coalesced / miss counts of the metrics cache."""
+    return dashboard.CACHE.stats()
@@ -1,30 +1,24 @@
 from fastapi import APIRouter
 from backend.app.schemas import SessionStartRequest, SessionStartResponse
-from backend.app.db import get_conn
+from backend.app.events.session_cache import SESSION_CACHE
 
 router = APIRouter(prefix="/session", tags=["session"])
 
 
 @router.post("/start", response_model=SessionStartResponse)
 def start_session(payload: SessionStartRequest):
-    # Insert session into DB and return session_id
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                INSERT INTO sessions(anonymous_id, device_type, app_version, user_agent, referrer)
-                VALUES (%s, %s, %s, %s, %s)
-                RETURNING session_id;
-                """,
-                (
-                    payload.anonymous_id,
-                    payload.device_type,
-                    payload.app_version,
-                    payload.user_agent,
-                    payload.referrer,
-                ),
-            )
-            session_id = cur.fetchone()[0]
-        conn.commit()
+    # Session id is minted in-process; the sessions row is written in the next batch
+    session_id = SESSION_CACHE.start_session(
+        payload.anonymous_id,
+        device_type=payload.device_type,
+        app_version=payload.app_version,
+        user_agent=payload.user_agent,
+        referrer=payload.referrer,
+    )
+    return SessionStartResponse(session_id=session_id)
 
-    return SessionStartResponse(session_id=str(session_id))
+
+@router.get("/metrics")
+def session_metrics():
+    """Known-session hit rate and pending/flushed session rows of this worker."""
+    return SESSION_CACHE.stats()
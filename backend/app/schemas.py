@@ -1,5 +1,6 @@
 from pydantic import BaseModel
-from typing import Optional, List
+from datetime import datetime
+from typing import Any, Dict, Optional, List
 from pydantic import BaseModel, Field
 
 # -------------------------
@@ -55,3 +56,56 @@ class ClickRequest(BaseModel):
 
 class ClickResponse(BaseModel):
     status: str
+
+
+# Events are validated one by one in the route, so one malformed event is reported
+# as "invalid" instead of rejecting the whole batch.
+MAX_CLICK_BATCH = 1000
+
+
+class ClickBatchRequest(BaseModel):
+    clicks: List[Dict[str, Any]] = Field(..., max_length=MAX_CLICK_BATCH)
+
+
+class ClickEventResult(BaseModel):
+    index: int
+    status: str                   # "ok" | "duplicate" | "invalid"
+    detail: Optional[str] = None
+
+
+class ClickBatchResponse(BaseModel):
+    ok: int
+    duplicate: int
+    invalid: int
+    results: List[ClickEventResult]
+
+
+# -------------------------
+# Engagement event schemas
+# -------------------------
+MAX_ENGAGEMENT_BATCH = 5000
+
+
+class EngagementEvent(BaseModel):
+    event_type: str               # one of engagement_event_types
+    session_id: Optional[str] = None
+    impression_id: Optional[str] = None
+    item_id: Optional[str] = None
+    event_value: Optional[Dict[str, Any]] = None
+    occurred_at: Optional[datetime] = None  # client time; server receive time if omitted
+
+
+class EngagementBatchRequest(BaseModel):
+    events: List[Dict[str, Any]] = Field(..., max_length=MAX_ENGAGEMENT_BATCH)
+
+
+class EngagementEventError(BaseModel):
+    index: int
+    detail: str
+
+
+class EngagementBatchResponse(BaseModel):
+    accepted: int
+    invalid: int
+    rejected: int = 0  # writer overloaded; these events can be resent
+    errors: List[EngagementEventError]
@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+
+# ----------------------------
+# Bounded bcrypt offload for the auth routes
+# ----------------------------
+# bcrypt is deliberately slow (~100s of ms per call). Running it inline in a sync handler
+# holds a threadpool slot (and, before this, a pooled DB connection) for that long, so a
+# login storm starves /recommendations. Instead hashes run in a small dedicated process pool:
+#   - at most HASH_WORKERS hashes run at once, whatever the login rate
+#   - at most HASH_QUEUE_MAX more wait; beyond that requests are rejected immediately (503)
+#   - a request waits at most HASH_TIMEOUT_S for its result (503 after that)
+#   - a worker that dies breaks the pool; that request gets a 503 and the next one starts a new pool
+# Callers await the result, so a waiting login holds no thread and no DB connection.
+#
+# This module is imported by the pool's (spawned) worker processes, so it must not import
+# the app, the DB pool or anything heavy at module level.
+
+HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", "2"))
+HASH_QUEUE_MAX = int(os.getenv("AUTH_HASH_QUEUE_MAX", "32"))
+HASH_TIMEOUT_S = float(os.getenv("AUTH_HASH_TIMEOUT_S", "5"))
+
+
+class HasherBusy(Exception):
+    """The hash queue is full, the result did not arrive within HASH_TIMEOUT_S, or the pool broke."""
+
+
+# ----------------------------
+# Worker process side
+# ----------------------------
+_pwd_ctx = None
+
+
+def _init_worker() -> None:
+    global _pwd_ctx
+    from passlib.context import CryptContext
+
+    _pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def _hash(password: str) -> tuple[str, float, float]:
+    started = time.time()
+    return _pwd_ctx.hash(password), started, time.time()
+
+
+def _verify(password: str, password_hash: str) -> tuple[bool, float, float]:
+    started = time.time()
+    return _pwd_ctx.verify(password, password_hash), started, time.time()
+
+
+def _noop() -> None:
+    return None
+
+
+# ----------------------------
+# API process side
+# ----------------------------
+class PasswordHasher:
+    def __init__(self, workers: int = HASH_WORKERS, queue_max: int = HASH_QUEUE_MAX) -> None:
+        self.workers = workers
+        self.queue_max = queue_max
+        self._pool: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+        self._in_flight = 0                                   # running + queued
+        self._queue_ms: deque[float] = deque(maxlen=500)     # submit -> worker start
+        self._hash_ms: deque[float] = deque(maxlen=500)      # bcrypt time in the worker
+        self._counters = {"submitted": 0, "completed": 0, "rejected": 0, "timeouts": 0, "errors": 0, "pool_restarts": 0}
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawn, not fork: the API process has threads (DB pool, writers) that fork would copy mid-state
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                )
+            return self._pool
+
+    def _discard_pool(self, pool: ProcessPoolExecutor) -> None:
+        """Drops a broken pool so the next call spawns a new one (unless another call already did)."""
+        with self._lock:
+            if self._pool is not pool:
+                return
+            self._pool = None
+            self._counters["pool_restarts"] += 1
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self, fut: Future) -> None:
+        with self._lock:
+            self._in_flight -= 1
+        if fut.cancelled():
+            return  # timed out while still queued; already counted
+        if fut.exception() is not None:
+            self._counters["errors"] += 1
+            return
+        self._counters["completed"] += 1
+        _, started, finished = fut.result()
+        self._queue_ms.append(max(0.0, (started - fut.submitted_at) * 1000.0))
+        self._hash_ms.append((finished - started) * 1000.0)
+
+    async def _run(self, fn, *args):
+        with self._lock:
+            if self._in_flight >= self.workers + self.queue_max:
+                self._counters["rejected"] += 1
+                raise HasherBusy("password hash queue is full")
+            self._in_flight += 1
+            self._counters["submitted"] += 1
+        pool = self._get_pool()
+        try:
+            fut = pool.submit(fn, *args)
+        except Exception as e:
+            with self._lock:
+                self._in_flight -= 1
+            if isinstance(e, BrokenProcessPool):
+                self._discard_pool(pool)
+                raise HasherBusy("password hash workers restarting") from None
+            raise
+        fut.submitted_at = time.time()
+        # The slot is freed when the worker is done, even if the caller timed out
+        fut.add_done_callback(self._release)
+        try:
+            result, _, _ = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(fut)), HASH_TIMEOUT_S)
+        except asyncio.TimeoutError:
+            self._counters["timeouts"] += 1
+            fut.cancel()  # only succeeds if it is still queued
+            raise HasherBusy(f"password hash did not finish within {HASH_TIMEOUT_S}s") from None
+        except BrokenProcessPool:
+            # A worker died (OOM kill, crash); every future of this pool fails the same way
+            self._discard_pool(pool)
+            raise HasherBusy("password hash workers restarting") from None
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password)
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        return await self._run(_verify, password, password_hash)
+
+    def metrics(self) -> dict:
+        def pct(values: deque, p: float) -> float | None:
+            v = sorted(values)
+            return round(v[min(len(v) - 1, int(p * len(v)))], 2) if v else None
+
+        with self._lock:
+            in_flight = self._in_flight
+        return {
+            **self._counters,
+            "workers": self.workers,
+            "queue_max": self.queue_max,
+            "in_flight": in_flight,
+            "queued": max(0, in_flight - self.workers),
+            "queue_ms_p50": pct(self._queue_ms, 0.50),
+            "queue_ms_p95": pct(self._queue_ms, 0.95),
+            "hash_ms_p50": pct(self._hash_ms, 0.50),
+            "hash_ms_p95": pct(self._hash_ms, 0.95),
+        }
+
+    def start(self) -> None:
+        """Spawns the workers up front so the first logins do not pay for process startup."""
+        pool = self._get_pool()
+        for f in [pool.submit(_noop) for _ in range(self.workers)]:
+            f.result()
+
+    def stop(self) -> None:
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Module-level hasher (one pool per API process)
+PASSWORD_HASHER = PasswordHasher()
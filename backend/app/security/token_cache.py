@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from dataclasses import dataclass
+import hashlib
+import os
+import threading
+import time
+
+# ----------------------------
+# Verified-token cache for get_current_user
+# ----------------------------
+# A bearer token is decoded and HMAC-verified once; later requests with the same token are
+# a digest lookup. Entries are keyed by SHA-256 of the token (the raw token is never held),
+# expire at the token's own `exp`, and are evicted LRU beyond TOKEN_CACHE_MAX. Per-token
+# lookups that never change for the token's lifetime (the user's anonymous_id) are stored
+# on the entry, so they also run once per token.
+
+TOKEN_CACHE_MAX = int(os.getenv("TOKEN_CACHE_MAX", "50000"))
+
+
+@dataclass
+class CachedToken:
+    user: dict                       # what get_current_user returns
+    exp: float                       # epoch seconds (the token's exp claim)
+    anonymous_id: str | None = None  # resolved lazily by get_current_user_with_anon
+
+
+def token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
+
+class TokenCache:
+    def __init__(self, max_entries: int = TOKEN_CACHE_MAX) -> None:
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[bytes, CachedToken] = OrderedDict()
+        self._counters = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+
+    def get(self, digest: bytes, *, now: float | None = None) -> CachedToken | None:
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            if entry.exp <= now:
+                # Fall through to a full decode, which reports the expiry
+                del self._entries[digest]
+                self._counters["expired"] += 1
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(digest)
+            self._counters["hits"] += 1
+            return entry
+
+    def put(self, digest: bytes, user: dict, exp: float) -> CachedToken:
+        entry = CachedToken(user=user, exp=float(exp))
+        with self._lock:
+            self._entries[digest] = entry
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evicted"] += 1
+        return entry
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hit_rate": round(self._counters["hits"] / lookups, 4) if lookups else None,
+            }
+
+
+# Module-level cache (one per process)
+TOKEN_CACHE = TokenCache()
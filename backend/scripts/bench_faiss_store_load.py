@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing as mp
+import resource
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+
+# ----------------------------
+# Loaders under test (each runs in a fresh process so RSS is not shared)
+# ----------------------------
+def _legacy_load(models_dir: str) -> None:
+    """The pre-bundle loader: pickled ids -> str, dict over every id, re-normalize."""
+    import faiss
+
+    d = Path(models_dir)
+    news_ids = np.load(d / "news_ids.npy", allow_pickle=True).astype(str)
+    embeddings = np.ascontiguousarray(np.load(d / "news_embeddings.npy").astype(np.float32))
+    faiss.normalize_L2(embeddings)
+    index = faiss.read_index(str(d / "news_retrieval.index"))
+    id2row = {str(nid): i for i, nid in enumerate(news_ids)}
+    assert len(id2row) == index.ntotal
+
+
+def _bundle_load(bundle_dir: str) -> None:
+    from backend.app.retrieval.faiss_store import load_bundle_dir
+
+    store = load_bundle_dir(Path(bundle_dir))
+    assert len(store.ids) == store.index.ntotal
+
+
+def _measure(target, path: str, out: mp.Queue) -> None:
+    t0 = time.perf_counter()
+    target(path)
+    elapsed = time.perf_counter() - t0
+    # Linux reports ru_maxrss in KiB
+    out.put({"seconds": elapsed, "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0})
+
+
+def _run(target, path: str) -> dict:
+    ctx = mp.get_context("spawn")
+    q = ctx.Queue()
+    p = ctx.Process(target=_measure, args=(target, path, q))
+    p.start()
+    result = q.get()
+    p.join()
+    return result
+
+
+# ----------------------------
+# Synthetic assets (when no real data/models is around)
+# ----------------------------
+def _write_synthetic(root: Path, n: int, dim: int) -> tuple[Path, Path]:
+    import faiss
+    from src.recommendation.build_index import write_bundle
+
+    rng = np.random.default_rng(0)
+    emb = rng.standard_normal((n, dim), dtype=np.float32)
+    faiss.normalize_L2(emb)
+    ids = np.array([f"N{i}" for i in rng.permutation(n) + 1], dtype=object)
+
+    index = faiss.IndexFlatIP(dim)
+    index.add(emb)
+
+    legacy = root / "legacy"
+    legacy.mkdir(parents=True)
+    np.save(legacy / "news_embeddings.npy", emb)
+    np.save(legacy / "news_ids.npy", ids)
+    faiss.write_index(index, str(legacy / "news_retrieval.index"))
+
+    tag, _manifest = write_bundle(str(root / "faiss"), emb, ids, index, index_type="IndexFlatIP")
+    return legacy, root / "faiss" / tag
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="FaissStore boot time / peak RSS: legacy loader vs bundle loader")
+    parser.add_argument("--legacy-dir", default="data/models", help="Dir with loose news_*.npy + news_retrieval.index")
+    parser.add_argument("--bundle-dir", default=None, help="Bundle dir (default: data/models/faiss/<CURRENT>)")
+    parser.add_argument("--synthetic", type=int, default=0, help="Generate N synthetic items instead of using data/models")
+    parser.add_argument("--dim", type=int, default=384)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.synthetic > 0:
+            print(f"Generating synthetic assets: N={args.synthetic}, D={args.dim}")
+            legacy_dir, bundle_dir = _write_synthetic(Path(tmp), args.synthetic, args.dim)
+        else:
+            legacy_dir = Path(args.legacy_dir)
+            if args.bundle_dir:
+                bundle_dir = Path(args.bundle_dir)
+            else:
+                tag = (Path("data/models/faiss") / "CURRENT").read_text().strip()
+                bundle_dir = Path("data/models/faiss") / tag
+
+        results = {
+            "legacy": _run(_legacy_load, str(legacy_dir)),
+            "bundle": _run(_bundle_load, str(bundle_dir)),
+        }
+
+    print(json.dumps(results, indent=2))
+    speedup = results["legacy"]["seconds"] / max(results["bundle"]["seconds"], 1e-9)
+    print(f"Boot speedup: {speedup:.2f}x")
+    print(f"Peak RSS: {results['legacy']['peak_rss_mb']:.0f} MB -> {results['bundle']['peak_rss_mb']:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+from pathlib import Path
+import argparse
+import json
+import time
+
+import joblib
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+
+from backend.app.features.definitions import RANKER_FEATURES
+from backend.app.ranking.tree_scorer import TreeEnsemble
+
+# ----------------------------
+# Serving-latency benchmark: numpy tree scorer vs LightGBM
+# ----------------------------
+# Times one ranker call per request batch size, the way rank_candidates makes it:
+#   sklearn   - LGBMClassifier.predict_proba on a DataFrame (the previous serving path)
+#   booster   - lightgbm.Booster.predict on a float64 array
+#   numpy     - TreeEnsemble.predict on the same array
+# and checks that the numpy scores are bit-identical to LightGBM's.
+
+MODEL_PATH = Path("data/models/rankers/ranker_lgbm_v2.joblib")
+BATCH_SIZES = [1, 10, 50, 200]
+
+
+def _synthetic_features(n_rows: int, seed: int) -> pd.DataFrame:
+    """Random rows with the value ranges of the served RANKER_FEATURES."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "retrieval_score": rng.random(n_rows),
+            "position": rng.integers(1, 11, n_rows),
+            "is_warm_user": rng.integers(0, 2, n_rows),
+            "user_click_count": rng.poisson(3, n_rows),
+            "item_age_hours": rng.exponential(48, n_rows),
+        },
+        columns=RANKER_FEATURES,
+    )
+
+
+def _synthetic_model(X: pd.DataFrame, seed: int) -> lgb.LGBMClassifier:
+    """Same hyperparameters as train_ranker_lgbm_v2, fit on a random click model."""
+    rng = np.random.default_rng(seed + 1)
+    n_rows = len(X)
+    logit = 2 * X["retrieval_score"] - 0.2 * X["position"] + 0.3 * X["is_warm_user"] - 0.01 * X["item_age_hours"]
+    y = (rng.random(n_rows) < 1 / (1 + np.exp(-logit))).astype(int)
+    clf = lgb.LGBMClassifier(
+        n_estimators=400,
+        learning_rate=0.05,
+        num_leaves=31,
+        subsample=0.9,
+        colsample_bytree=0.9,
+        random_state=42,
+        verbose=-1,
+    )
+    clf.fit(X, y)
+    return clf
+
+
+def _time_us(fn, repeat: int) -> float:
+    fn()  # warm-up
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) / repeat * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the numpy tree scorer against LightGBM")
+    parser.add_argument("--model", type=Path, default=MODEL_PATH, help="LGBMClassifier joblib file")
+    parser.add_argument("--synthetic", action="store_true", help="Train a throwaway model on random data instead")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    X_pool = _synthetic_features(20_000, args.seed)
+    if args.synthetic:
+        clf, source = _synthetic_model(X_pool, args.seed), "synthetic"
+    else:
+        clf, source = joblib.load(args.model), str(args.model)
+
+    booster = clf.booster_
+    trees = TreeEnsemble.from_model_string(booster.model_to_string())
+    X_all = X_pool.to_numpy(dtype=np.float64)
+
+    exact = bool(np.array_equal(trees.predict(X_all), booster.predict(X_all)))
+    results = []
+    for b in BATCH_SIZES:
+        X_df = X_pool.iloc[:b]
+        X = X_all[:b]
+        results.append(
+            {
+                "batch": b,
+                "sklearn_us": round(_time_us(lambda: clf.predict_proba(X_df), args.repeat), 1),
+                "booster_us": round(_time_us(lambda: booster.predict(X), args.repeat), 1),
+                "numpy_us": round(_time_us(lambda: trees.predict(X), args.repeat), 1),
+            }
+        )
+
+    print(
+        json.dumps(
+            {
+                "model": source,
+                "trees": trees.n_trees,
+                "nodes": int(len(trees.feature)),
+                "bit_identical": exact,
+                "results": results,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
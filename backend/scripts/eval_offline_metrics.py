@@ -1,95 +1,40 @@
 from __future__ import annotations
 
 import argparse
-import math
 
 import numpy as np
 import pandas as pd
 
 from backend.app.db import get_conn
+from backend.scripts.ranking_metrics import GroupedRanking, bootstrap_ci, summarize
 
 
 # ----------------------------
 # Metrics helpers
 # ----------------------------
-def dcg_at_k(labels: list[int], k: int) -> float:
-    labels = labels[:k]
-    out = 0.0
-    for i, rel in enumerate(labels, start=1):
-        if rel > 0:
-            out += 1.0 / math.log2(i + 1)
-    return out
-
-
-def ndcg_at_k(labels: list[int], k: int) -> float:
-    dcg = dcg_at_k(labels, k)
-    ideal = dcg_at_k(sorted(labels, reverse=True), k)
-    return 0.0 if ideal == 0.0 else dcg / ideal
-
-
-def mrr_at_k(labels: list[int], k: int) -> float:
-    labels = labels[:k]
-    for i, rel in enumerate(labels, start=1):
-        if rel > 0:
-            return 1.0 / i
-    return 0.0
-
-
-def ctr_at_k(labels: list[int], k: int) -> float:
-    labels = labels[:k]
-    return 1.0 if any(rel > 0 for rel in labels) else 0.0
-
-
-def _eval_order_for_impression(g: pd.DataFrame, order: str, k: int = 10) -> tuple[float, float, float]:
-    """
-    Returns (CTR@k, NDCG@k, MRR@k) for one impression, given an ordering.
-
-    order options:
-      - "retrieval": retrieval baseline (retrieval_pos asc)
-      - "ranker":    rank_score desc
-      - "final":     final_score desc
-      - "served":    position asc      (exact served positions from DB)
-    """
-    if order == "retrieval":
-        if "retrieval_pos" not in g.columns:
-            raise ValueError("Missing column retrieval_pos. Did you add ii.retrieval_pos to the SQL SELECT?")
-        g2 = g.sort_values(["retrieval_pos"], ascending=[True])
-
-    elif order == "ranker":
-        g2 = g.sort_values(["rank_score", "position"], ascending=[False, True])
-
-    elif order == "final":
-        g2 = g.sort_values(["final_score", "position"], ascending=[False, True])
-
-    elif order == "served":
-        g2 = g.sort_values("position", ascending=True)
-
-    else:
-        raise ValueError(f"Unknown order='{order}'")
-
-    labels = g2["label"].astype(int).tolist()
-    return (
-        ctr_at_k(labels, k),
-        ndcg_at_k(labels, k),
-        mrr_at_k(labels, k),
-    )
-
-
-def eval_dataset(df: pd.DataFrame, order: str, k: int = 10) -> dict[str, float]:
-    ctrs, ndcgs, mrrs = [], [], []
-    for _, g in df.groupby("impression_id"):
-        c, n, m = _eval_order_for_impression(g, order=order, k=k)
-        ctrs.append(c)
-        ndcgs.append(n)
-        mrrs.append(m)
-
+# Orderings compared (higher score = shown first; ties broken by served position):
+#   - "retrieval": retrieval baseline (retrieval_pos asc)
+#   - "ranker":    rank_score desc
+#   - "final":     final_score desc
+#   - "served":    position asc      (exact served positions from DB)
+def order_scores(df: pd.DataFrame) -> dict[str, np.ndarray]:
+    if "retrieval_pos" not in df.columns:
+        raise ValueError("Missing column retrieval_pos. Did you add ii.retrieval_pos to the SQL SELECT?")
     return {
-        f"CTR@{k}": float(np.mean(ctrs)) if ctrs else 0.0,
-        f"NDCG@{k}": float(np.mean(ndcgs)) if ndcgs else 0.0,
-        f"MRR@{k}": float(np.mean(mrrs)) if mrrs else 0.0,
+        "retrieval": -df["retrieval_pos"].to_numpy(dtype=np.float64),
+        "ranker": df["rank_score"].to_numpy(dtype=np.float64),
+        "final": df["final_score"].to_numpy(dtype=np.float64),
+        "served": -df["position"].to_numpy(dtype=np.float64),
     }
 
 
+def eval_orders(df: pd.DataFrame, k: int = 10) -> dict[str, dict[str, np.ndarray]]:
+    """Per-impression CTR@k / NDCG@k / MRR@k for every ordering (one grouping, one sort each)."""
+    gr = GroupedRanking(df["impression_id"].to_numpy(), df["label"].to_numpy())
+    tiebreak = df["position"].to_numpy()
+    return {name: gr.per_group(s, k=k, tiebreak=tiebreak) for name, s in order_scores(df).items()}
+
+
 def lift_pct(new: float, base: float) -> float:
     eps = 1e-12
     return 100.0 * ((new - base) / (base + eps))
@@ -101,6 +46,12 @@ def lift_pct(new: float, base: float) -> float:
 def main() -> None:
     parser = argparse.ArgumentParser()
     parser.add_argument("--session-id", default=None, help="Filter evaluation to a specific session UUID")
+    parser.add_argument(
+        "--bootstrap",
+        type=int,
+        default=0,
+        help="Bootstrap resamples (over impressions) for 95%% CIs of metrics and lifts (0 = off)",
+    )
     args = parser.parse_args()
 
     # Build WHERE dynamically to avoid Postgres "AmbiguousParameter" typing errors
@@ -193,10 +144,11 @@ def main() -> None:
     # ----------------------------
     k = 10
 
-    retrieval_metrics = eval_dataset(df, order="retrieval", k=k)
-    ranker_metrics = eval_dataset(df, order="ranker", k=k)
-    final_metrics = eval_dataset(df, order="final", k=k)
-    served_metrics = eval_dataset(df, order="served", k=k)
+    per_imp = eval_orders(df, k=k)
+    retrieval_metrics = summarize(per_imp["retrieval"])
+    ranker_metrics = summarize(per_imp["ranker"])
+    final_metrics = summarize(per_imp["final"])
+    served_metrics = summarize(per_imp["served"])
 
     print("\n==============================")
     print("4-WAY METRICS COMPARISON")
@@ -216,6 +168,21 @@ def main() -> None:
     print(f"  NDCG@{k}: {lift_pct(final_metrics[f'NDCG@{k}'], ranker_metrics[f'NDCG@{k}']):+.2f}%")
     print(f"  MRR@{k}:  {lift_pct(final_metrics[f'MRR@{k}'], ranker_metrics[f'MRR@{k}']):+.2f}%")
 
+    if args.bootstrap > 0:
+        # Shared resamples: lift CIs are paired (same impressions under both orderings)
+        values = {}
+        for order, metrics in per_imp.items():
+            for name, arr in metrics.items():
+                values[f"{order} {name}"] = arr
+        for new, base in (("ranker", "retrieval"), ("final", "ranker")):
+            for name in per_imp[new]:
+                values[f"{new}-{base} {name}"] = per_imp[new][name] - per_imp[base][name]
+        ci = bootstrap_ci(values, n_boot=args.bootstrap)
+
+        print(f"\n95% bootstrap CIs ({args.bootstrap} resamples over impressions):")
+        for name, (lo, hi) in ci.items():
+            print(f"  {name:<28} [{lo:.4f}, {hi:.4f}]")
+
     print("\nNotes:")
     print(" - Retrieval-only uses retrieval_pos ASC (true retrieval baseline).")
     print(" - Ranker-only uses rank_score desc.")
@@ -0,0 +1,355 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from pathlib import Path
+import argparse
+import json
+import os
+import socket
+import time
+
+from backend.app.events.event_log import CLOSED_MARKER, EVENT_LOG_DIR, SEGMENT_SUFFIX
+
+# ----------------------------
+# Bulk loader for the local event log
+# ----------------------------
+# Tails every writer's segments (backend/app/events/event_log.py) and loads new records into
+# sessions / impressions_served / impression_items / clicks:
+#   COPY into temp staging tables -> INSERT ... SELECT ... ON CONFLICT DO NOTHING
+# Ids (impression_id, click_id) are generated by the API, so re-loading a record is a no-op.
+# Rows keep the API's served_at / clicked_at; ingested_at (migrations/004) defaults to the
+# load time, which is what the feature store and online LR tail by.
+#
+# The checkpoint (byte offset per segment + clicks still waiting for their impression) is
+# written atomically after each commit. A crash in between only re-loads records, which the
+# ON CONFLICTs absorb. Only complete lines are consumed, so a segment being appended to is
+# read up to its last newline.
+#
+# A batch that fails on its data (a value the COPY rejects, an unparsable line) is retried
+# one record at a time; records that still fail go to DEAD_LETTER_NAME with the error, so
+# one bad record cannot stall loading. Connection errors fail the pass and it is retried.
+#
+# A writer directory is finished once its process closed the log (CLOSED_MARKER) or, for the
+# default <host>-<pid> ids on this host, the process is gone. Its last segment is then deleted
+# like the others once loaded, and the empty directory removed.
+
+CHECKPOINT_NAME = "_loader_checkpoint.json"  # inside the event log root
+DEAD_LETTER_NAME = "_dead_letter.jsonl"      # inside the event log root
+# A click can be logged by another API worker than its impression; wait this long for it,
+# counted from the pass that first deferred it (not clicked_at: after loader downtime or
+# with a --max-bytes-limited backlog the impression may still be in an unread segment)
+DEFER_MAX_S = 3600.0
+
+_STAGE_SQL = """
+CREATE TEMP TABLE IF NOT EXISTS stage_impressions (
+  impression_id UUID, session_id UUID, user_id BIGINT, anonymous_id TEXT, served_at TIMESTAMPTZ,
+  surface TEXT, page_size INT, locale TEXT, faiss_index_version_id BIGINT,
+  user_click_count INT, is_warm_user SMALLINT
+) ON COMMIT DELETE ROWS;
+CREATE TEMP TABLE IF NOT EXISTS stage_impression_items (
+  impression_id UUID, position INT, retrieval_pos INT, item_id TEXT,
+  retrieval_score DOUBLE PRECISION, rank_score DOUBLE PRECISION, final_score DOUBLE PRECISION,
+  item_age_hours REAL
+) ON COMMIT DELETE ROWS;
+CREATE TEMP TABLE IF NOT EXISTS stage_clicks (
+  click_id UUID, impression_id UUID, item_id TEXT, position INT, clicked_at TIMESTAMPTZ,
+  dwell_ms INT, open_type TEXT
+) ON COMMIT DELETE ROWS;
+"""
+
+_IMPRESSION_COLS = [
+    "impression_id", "session_id", "user_id", "anonymous_id", "served_at", "surface", "page_size",
+    "locale", "faiss_index_version_id", "user_click_count", "is_warm_user",
+]
+_ITEM_COLS = [
+    "impression_id", "position", "retrieval_pos", "item_id", "retrieval_score", "rank_score",
+    "final_score", "item_age_hours",
+]
+_CLICK_COLS = ["click_id", "impression_id", "item_id", "position", "clicked_at", "dwell_ms", "open_type"]
+
+_LOAD_SQL = [
+    # impressions_served.session_id is a FK; sessions are created lazily by the API
+    """
+    INSERT INTO sessions(session_id)
+    SELECT DISTINCT session_id FROM stage_impressions
+    ON CONFLICT (session_id) DO NOTHING;
+    """,
+    # A user_id without a users row (deleted account) is logged as anonymous, not rejected
+    f"""
+    INSERT INTO impressions_served({", ".join(_IMPRESSION_COLS)})
+    SELECT {", ".join(
+        "CASE WHEN EXISTS (SELECT 1 FROM users u WHERE u.user_id = s.user_id) THEN s.user_id END"
+        if c == "user_id" else "s." + c
+        for c in _IMPRESSION_COLS
+    )}
+    FROM stage_impressions s
+    ON CONFLICT (impression_id) DO NOTHING;
+    """,
+    f"""
+    INSERT INTO impression_items({", ".join(_ITEM_COLS)})
+    SELECT {", ".join("s." + c for c in _ITEM_COLS)}
+    FROM stage_impression_items s
+    JOIN items it ON it.item_id = s.item_id
+    ON CONFLICT DO NOTHING;
+    """,
+    f"""
+    INSERT INTO clicks({", ".join(_CLICK_COLS)})
+    SELECT {", ".join("s." + c for c in _CLICK_COLS)}
+    FROM stage_clicks s
+    JOIN impressions_served i ON i.impression_id = s.impression_id
+    JOIN items it ON it.item_id = s.item_id
+    ON CONFLICT DO NOTHING;
+    """,
+]
+
+_DEFERRED_SQL = """
+SELECT s.click_id::text
+FROM stage_clicks s
+WHERE NOT EXISTS (SELECT 1 FROM impressions_served i WHERE i.impression_id = s.impression_id);
+"""
+
+
+def read_checkpoint(path: Path) -> dict:
+    if not path.exists():
+        return {"offsets": {}, "deferred_clicks": []}
+    return json.loads(path.read_text())
+
+
+def write_checkpoint(state: dict, path: Path) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump({**state, "updated_at": datetime.now(timezone.utc).isoformat()}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def list_segments(root: Path = EVENT_LOG_DIR) -> list[Path]:
+    """All segments, grouped by writer and in append order within each writer."""
+    return sorted(p for p in root.glob(f"*/*{SEGMENT_SUFFIX}") if p.stem.isdigit())
+
+
+def read_new_records(path: Path, offset: int, max_bytes: int) -> tuple[list[dict], int]:
+    """Complete lines after `offset` (at most ~max_bytes); returns (records, new offset)."""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        chunk = f.read(max_bytes)
+    end = chunk.rfind(b"\n") + 1
+    if end == 0:
+        return [], offset
+    records = [_parse_line(line) for line in chunk[:end].splitlines() if line.strip()]
+    return records, offset + end
+
+
+def _parse_line(line: bytes) -> dict:
+    try:
+        record = json.loads(line)
+    except ValueError:
+        record = None
+    if not isinstance(record, dict):
+        # Loaded as nothing; run_once dead-letters it
+        return {"type": "unparsable", "line": line.decode("utf-8", errors="replace")}
+    return record
+
+
+def _stage_rows(records: list[dict]) -> tuple[list[tuple], list[tuple], list[tuple]]:
+    impressions, items, clicks = [], [], []
+    for r in records:
+        if r["type"] == "impression":
+            impressions.append(tuple(r.get(c) for c in _IMPRESSION_COLS))
+            for it in r.get("items", []):
+                items.append(tuple(r["impression_id"] if c == "impression_id" else it.get(c) for c in _ITEM_COLS))
+        elif r["type"] == "click":
+            clicks.append(tuple(r.get(c) for c in _CLICK_COLS))
+    return impressions, items, clicks
+
+
+def load_records(conn, records: list[dict]) -> list[dict]:
+    """Loads one batch in one transaction; returns the click records whose impression is missing."""
+    impressions, items, clicks = _stage_rows(records)
+    with conn.cursor() as cur:
+        cur.execute(_STAGE_SQL)
+        for table, cols, rows in (
+            ("stage_impressions", _IMPRESSION_COLS, impressions),
+            ("stage_impression_items", _ITEM_COLS, items),
+            ("stage_clicks", _CLICK_COLS, clicks),
+        ):
+            if rows:
+                with cur.copy(f"COPY {table} ({', '.join(cols)}) FROM STDIN") as copy:
+                    for row in rows:
+                        copy.write_row(row)
+        for sql in _LOAD_SQL:
+            cur.execute(sql)
+        cur.execute(_DEFERRED_SQL)
+        missing = {cid for (cid,) in cur.fetchall()}
+    conn.commit()
+    return [r for r in records if r["type"] == "click" and r["click_id"] in missing]
+
+
+def append_dead_letter(path: Path, entries: list[dict]) -> None:
+    with open(path, "a", encoding="utf-8") as f:
+        for e in entries:
+            f.write(json.dumps({**e, "failed_at": datetime.now(timezone.utc).isoformat()}, default=str) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _is_transient(e: Exception) -> bool:
+    """Connection / server trouble (retry the pass), as opposed to a record Postgres rejects."""
+    import psycopg
+
+    return isinstance(e, (psycopg.OperationalError, psycopg.InterfaceError))
+
+
+def load_or_dead_letter(conn, records: list[dict]) -> tuple[list[dict], list[dict]]:
+    """load_records, isolating records that fail on their own; returns (deferred clicks, dead letters)."""
+    dead = [{"record": r, "error": "unparsable line"} for r in records if r.get("type") == "unparsable"]
+    records = [r for r in records if r.get("type") != "unparsable"]
+    try:
+        return load_records(conn, records), dead
+    except Exception as e:
+        conn.rollback()
+        if _is_transient(e):
+            raise
+        print(f"[loader] Batch of {len(records)} records failed ({e}); loading them one by one")
+
+    deferred: list[dict] = []
+    for r in records:
+        try:
+            deferred.extend(load_records(conn, [r]))
+        except Exception as e:
+            conn.rollback()
+            if _is_transient(e):
+                raise
+            dead.append({"record": r, "error": str(e)})
+    return deferred, dead
+
+
+def writer_finished(writer_dir: Path) -> bool:
+    """The writer will never append to this directory again."""
+    if (writer_dir / CLOSED_MARKER).exists():
+        return True
+    host, _, pid = writer_dir.name.rpartition("-")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False  # custom EVENT_LOG_WRITER_ID, or another host: only the marker tells
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False
+    return False
+
+
+def remove_finished_writers(root: Path) -> int:
+    """Removes finished writer directories that have no segments left; returns how many."""
+    removed = 0
+    for d in root.iterdir():
+        if not d.is_dir() or any(d.glob(f"*{SEGMENT_SUFFIX}")) or not writer_finished(d):
+            continue
+        (d / CLOSED_MARKER).unlink(missing_ok=True)
+        try:
+            d.rmdir()
+            removed += 1
+        except OSError:
+            pass  # a restarted writer reusing the id created a segment meanwhile
+    return removed
+
+
+def run_once(conn, state: dict, *, root: Path, max_bytes: int, delete_loaded: bool) -> dict:
+    """One pass over all segments; returns counters. `state` is updated and checkpointed."""
+    offsets: dict[str, int] = state["offsets"]
+    segments = list_segments(root)
+    newest = {}
+    for p in segments:
+        newest[p.parent.name] = p  # sorted, so the last one per writer wins
+
+    batch: list[dict] = list(state["deferred_clicks"])
+    n_deferred_in = len(batch)
+    new_offsets = dict(offsets)
+    for p in segments:
+        key = f"{p.parent.name}/{p.name}"
+        records, end = read_new_records(p, offsets.get(key, 0), max_bytes)
+        batch.extend(records)
+        new_offsets[key] = end
+
+    counters = {
+        "records": len(batch) - n_deferred_in,
+        "retried_clicks": n_deferred_in,
+        "deferred": 0,
+        "expired": 0,
+        "dead_letters": 0,
+    }
+    if batch:
+        deferred, dead = load_or_dead_letter(conn, batch)
+        if dead:
+            # Before the checkpoint: a crash in between re-loads (and re-dead-letters) them
+            append_dead_letter(root / DEAD_LETTER_NAME, dead)
+            counters["dead_letters"] = len(dead)
+        now = time.time()
+        for r in deferred:
+            r.setdefault("deferred_at", now)  # kept across passes in the checkpoint
+        keep = [r for r in deferred if now - r["deferred_at"] < DEFER_MAX_S]
+        counters["deferred"] = len(keep)
+        counters["expired"] = len(deferred) - len(keep)
+        state["deferred_clicks"] = keep
+    state["offsets"] = new_offsets
+
+    # Segments that are fully loaded and no longer appended to (a newer one exists, or the
+    # writer is finished). The size is read now, so lines appended after the read keep it.
+    if delete_loaded:
+        finished = {w: writer_finished(p.parent) for w, p in newest.items()}
+        for p in segments:
+            key = f"{p.parent.name}/{p.name}"
+            last_open = p == newest[p.parent.name] and not finished[p.parent.name]
+            if not last_open and new_offsets.get(key, 0) >= p.stat().st_size:
+                p.unlink()
+                state["offsets"].pop(key, None)
+        counters["writers_removed"] = remove_finished_writers(root)
+
+    write_checkpoint(state, root / CHECKPOINT_NAME)
+    return counters
+
+
+def main() -> None:
+    from backend.app.db import get_conn
+
+    parser = argparse.ArgumentParser(description="Load the API's local event log into Postgres")
+    parser.add_argument("--root", type=Path, default=EVENT_LOG_DIR)
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds between passes")
+    parser.add_argument("--once", action="store_true", help="Single pass, then exit")
+    parser.add_argument("--max-bytes", type=int, default=16 * 1024 * 1024, help="Max bytes read per segment per pass")
+    parser.add_argument("--keep-loaded", action="store_true", help="Keep fully loaded segments on disk")
+    args = parser.parse_args()
+
+    args.root.mkdir(parents=True, exist_ok=True)
+    state = read_checkpoint(args.root / CHECKPOINT_NAME)
+    print(
+        f"[loader] {args.root}: {len(state['offsets'])} segments checkpointed, "
+        f"{len(state['deferred_clicks'])} deferred clicks"
+    )
+
+    while True:
+        t0 = time.perf_counter()
+        try:
+            with get_conn() as conn:
+                try:
+                    c = run_once(
+                        conn, state, root=args.root, max_bytes=args.max_bytes, delete_loaded=not args.keep_loaded
+                    )
+                except Exception:
+                    conn.rollback()
+                    raise
+            if c["records"] or c["deferred"] or c["expired"] or c["dead_letters"] or c.get("writers_removed"):
+                print(f"[loader] {c} in {time.perf_counter() - t0:.3f}s")
+        except Exception as e:
+            # Nothing was checkpointed; the next pass re-reads from the same offsets
+            state = read_checkpoint(args.root / CHECKPOINT_NAME)
+            print(f"[loader] Pass failed: {e}")
+        if args.once:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
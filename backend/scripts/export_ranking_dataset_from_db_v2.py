@@ -3,9 +3,11 @@
 from __future__ import annotations
 
 from pathlib import Path
-import pandas as pd
+import argparse
 
-from backend.app.db import get_conn
+import pyarrow as pa
+
+from backend.scripts.ranking_export import add_export_args, export_ranking_dataset
 
 OUT_CSV = Path("ranking_dataset_v2.csv")
 OUT_PARQUET = Path("data/processed/ranking/ranking_dataset_v2.parquet")
@@ -32,33 +34,30 @@ LEFT JOIN clicked c
 ORDER BY i.served_at ASC, ii.impression_id ASC, ii.position ASC;
 """
 
+# Compact, explicit column types (SELECT order)
+SCHEMA = pa.schema(
+    [
+        ("impression_id", pa.string()),
+        ("anonymous_id", pa.string()),
+        ("item_id", pa.string()),
+        ("position", pa.int32()),
+        ("retrieval_score", pa.float32()),
+        ("served_at", pa.timestamp("us", tz="UTC")),
+        ("label", pa.int8()),
+    ]
+)
 
-def main() -> None:
-    # Pull online-aligned ranking data directly from Postgres logs
-    with get_conn() as conn:
-        df = pd.read_sql(SQL, conn)
-
-    # Parquet/Arrow cannot reliably infer python UUID objects -> cast to string
-    df["impression_id"] = df["impression_id"].astype(str)
-
-    # Type cleanup (important for ML)
-    df["position"] = df["position"].astype("int32")
-    df["retrieval_score"] = df["retrieval_score"].astype("float32")
-    df["label"] = df["label"].astype("int8")
-    df["served_at"] = pd.to_datetime(df["served_at"], utc=True)
-
-    OUT_CSV.parent.mkdir(parents=True, exist_ok=True)
-    OUT_PARQUET.parent.mkdir(parents=True, exist_ok=True)
 
-    df.to_csv(OUT_CSV, index=False)
-    df.to_parquet(OUT_PARQUET, index=False)
+def main() -> None:
+    args = add_export_args(argparse.ArgumentParser()).parse_args()
 
-    print("CSV written to:", OUT_CSV)
-    print("Parquet written to:", OUT_PARQUET)
-    print("Rows:", len(df))
-    print("Unique impressions:", df["impression_id"].nunique())
-    print("Label distribution:", df["label"].value_counts().to_dict())
-    print("Columns:", list(df.columns))
+    export_ranking_dataset(
+        SQL,
+        SCHEMA,
+        OUT_PARQUET,
+        out_csv=OUT_CSV if args.csv else None,
+        chunk_rows=args.chunk_rows,
+    )
 
 
 if __name__ == "__main__":
@@ -1,9 +1,11 @@
 from __future__ import annotations
 
 from pathlib import Path
-import pandas as pd
+import argparse
 
-from backend.app.db import get_conn
+import pyarrow as pa
+
+from backend.scripts.ranking_export import add_export_args, export_ranking_dataset
 
 OUT_CSV = Path("ranking_dataset_v3.csv")
 OUT_PARQUET = Path("data/processed/ranking/ranking_dataset_v3.parquet")
@@ -32,38 +34,34 @@ LEFT JOIN clicked c
 ORDER BY i.served_at ASC, ii.impression_id ASC, ii.position ASC;
 """
 
-def main() -> None:
-    with get_conn() as conn:
-        df = pd.read_sql(SQL, conn)
-
-    # Parquet compatibility (UUID objects -> string)
-    df["impression_id"] = df["impression_id"].astype(str)
-
-    # Types for ML
-    df["position"] = df["position"].astype("int32")
-    df["retrieval_score"] = df["retrieval_score"].astype("float32")
-
-    # rank_score / final_score can be NULL for older rows; coerce safely
-    df["rank_score"] = pd.to_numeric(df["rank_score"], errors="coerce").astype("float32")
-    df["final_score"] = pd.to_numeric(df["final_score"], errors="coerce").astype("float32")
+# Compact, explicit column types (SELECT order)
+SCHEMA = pa.schema(
+    [
+        ("impression_id", pa.string()),
+        ("anonymous_id", pa.string()),
+        ("item_id", pa.string()),
+        ("position", pa.int32()),
+        ("retrieval_score", pa.float32()),
+        # rank_score / final_score can be NULL for older rows
+        ("rank_score", pa.float32()),
+        ("final_score", pa.float32()),
+        ("served_at", pa.timestamp("us", tz="UTC")),
+        ("label", pa.int8()),
+    ]
+)
 
-    df["label"] = df["label"].astype("int8")
-    df["served_at"] = pd.to_datetime(df["served_at"], utc=True)
 
-    OUT_CSV.parent.mkdir(parents=True, exist_ok=True)
-    OUT_PARQUET.parent.mkdir(parents=True, exist_ok=True)
+def main() -> None:
+    args = add_export_args(argparse.ArgumentParser()).parse_args()
 
-    df.to_csv(OUT_CSV, index=False)
-    df.to_parquet(OUT_PARQUET, index=False)
+    export_ranking_dataset(
+        SQL,
+        SCHEMA,
+        OUT_PARQUET,
+        out_csv=OUT_CSV if args.csv else None,
+        chunk_rows=args.chunk_rows,
+    )
 
-    print("CSV written to:", OUT_CSV)
-    print("Parquet written to:", OUT_PARQUET)
-    print("Rows:", len(df))
-    print("Unique impressions:", df["impression_id"].nunique())
-    print("Label distribution:", df["label"].value_counts().to_dict())
-    print("Null rank_score:", int(df["rank_score"].isna().sum()))
-    print("Null final_score:", int(df["final_score"].isna().sum()))
-    print("Columns:", list(df.columns))
 
 if __name__ == "__main__":
     main()
@@ -1,30 +1,33 @@
 from __future__ import annotations
 
 from pathlib import Path
-import pandas as pd
+import argparse
 
-from backend.app.db import get_conn
+from datetime import datetime
 
-#  Outputs (v4)
+import pyarrow as pa
+
+from backend.scripts.ranking_export import (
+    add_export_args,
+    add_incremental_args,
+    export_incremental,
+    export_ranking_dataset,
+)
+
+#  Outputs (v4); the CSV is only written with --csv
 OUT_CSV = Path("ranking_dataset_v4.csv")
 OUT_PARQUET = Path("data/processed/ranking/ranking_dataset_v4.parquet")
 
-# v4 SQL: adds is_warm_user, user_click_count, item_age_hours
-SQL = """
+# Incremental mode output: served_date=YYYY-MM-DD partitions + _watermark.json
+OUT_DATASET_DIR = Path("data/processed/ranking/ranking_dataset_v4")
+
+# v4 SQL: adds is_warm_user, user_click_count, item_age_hours.
+# Features are point-in-time: the snapshot logged at serving time when present
+# (migrations/002), else recomputed from clicks strictly before served_at.
+SQL_TEMPLATE = """
 WITH clicked AS (
   SELECT DISTINCT impression_id, item_id
   FROM clicks
-),
-user_click_stats AS (
-  -- clicks table doesn't store anonymous_id, so join through impressions_served
-  SELECT
-    i.anonymous_id,
-    COUNT(*)::int AS user_click_count,
-    MAX(c.clicked_at) AS last_click_at
-  FROM clicks c
-  JOIN impressions_served i
-    ON i.impression_id = c.impression_id
-  GROUP BY i.anonymous_id
 )
 SELECT
   ii.impression_id,
@@ -37,13 +40,10 @@ SELECT
   i.served_at,
   CASE WHEN c.impression_id IS NOT NULL THEN 1 ELSE 0 END AS label,
 
-  --  NEW FEATURES
-  CASE
-    WHEN u.user_click_count IS NULL OR u.user_click_count = 0 THEN 0
-    ELSE 1
-  END AS is_warm_user,
-  COALESCE(u.user_click_count, 0) AS user_click_count,
-  EXTRACT(EPOCH FROM (i.served_at - it.ingested_at)) / 3600.0 AS item_age_hours
+  --  NEW FEATURES (as of served_at)
+  COALESCE(i.is_warm_user::int, CASE WHEN COALESCE(pit.n, 0) >= 1 THEN 1 ELSE 0 END) AS is_warm_user,
+  COALESCE(i.user_click_count, pit.n, 0) AS user_click_count,
+  COALESCE(ii.item_age_hours, EXTRACT(EPOCH FROM (i.served_at - it.ingested_at)) / 3600.0) AS item_age_hours
 
 FROM impression_items ii
 JOIN impressions_served i
@@ -53,48 +53,67 @@ JOIN items it
 LEFT JOIN clicked c
   ON c.impression_id = ii.impression_id
  AND c.item_id = ii.item_id
-LEFT JOIN user_click_stats u
-  ON u.anonymous_id = i.anonymous_id
+LEFT JOIN LATERAL (
+  -- only for impressions logged before feature snapshots existed;
+  -- clicks table doesn't store anonymous_id, so join through impressions_served
+  SELECT COUNT(*)::int AS n
+  FROM clicks c2
+  JOIN impressions_served i2
+    ON i2.impression_id = c2.impression_id
+  WHERE i.user_click_count IS NULL
+    AND i2.anonymous_id = i.anonymous_id
+    AND c2.clicked_at < i.served_at
+) pit ON TRUE
+{window}
 ORDER BY i.served_at ASC, ii.impression_id ASC, ii.position ASC;
 """
 
+SQL = SQL_TEMPLATE.format(window="")
+SQL_INCREMENTAL = SQL_TEMPLATE.format(window="WHERE i.served_at > %(lower)s AND i.served_at <= %(upper)s")
+
+# Compact, explicit column types (SELECT order)
+SCHEMA = pa.schema(
+    [
+        ("impression_id", pa.string()),
+        ("anonymous_id", pa.string()),
+        ("item_id", pa.string()),
+        ("position", pa.int32()),
+        ("retrieval_score", pa.float32()),
+        # rank_score / final_score can be NULL for older rows
+        ("rank_score", pa.float32()),
+        ("final_score", pa.float32()),
+        ("served_at", pa.timestamp("us", tz="UTC")),
+        ("label", pa.int8()),
+        #  New feature types
+        ("is_warm_user", pa.int8()),
+        ("user_click_count", pa.int32()),
+        ("item_age_hours", pa.float32()),
+    ]
+)
+
+
 def main() -> None:
-    with get_conn() as conn:
-        df = pd.read_sql(SQL, conn)
-
-    # Parquet compatibility (UUID objects -> string)
-    df["impression_id"] = df["impression_id"].astype(str)
-
-    # Types for ML
-    df["position"] = df["position"].astype("int32")
-    df["retrieval_score"] = pd.to_numeric(df["retrieval_score"], errors="coerce").astype("float32")
-
-    # rank_score / final_score can be NULL for older rows; coerce safely
-    df["rank_score"] = pd.to_numeric(df["rank_score"], errors="coerce").astype("float32")
-    df["final_score"] = pd.to_numeric(df["final_score"], errors="coerce").astype("float32")
-
-    df["label"] = df["label"].astype("int8")
-    df["served_at"] = pd.to_datetime(df["served_at"], utc=True)
-
-    #  New feature types
-    df["is_warm_user"] = df["is_warm_user"].astype("int8")
-    df["user_click_count"] = pd.to_numeric(df["user_click_count"], errors="coerce").fillna(0).astype("int32")
-    df["item_age_hours"] = pd.to_numeric(df["item_age_hours"], errors="coerce").astype("float32")
-
-    OUT_CSV.parent.mkdir(parents=True, exist_ok=True)
-    OUT_PARQUET.parent.mkdir(parents=True, exist_ok=True)
-
-    df.to_csv(OUT_CSV, index=False)
-    df.to_parquet(OUT_PARQUET, index=False)
-
-    print("CSV written to:", OUT_CSV)
-    print("Parquet written to:", OUT_PARQUET)
-    print("Rows:", len(df))
-    print("Unique impressions:", df["impression_id"].nunique())
-    print("Label distribution:", df["label"].value_counts().to_dict())
-    print("Null rank_score:", int(df["rank_score"].isna().sum()))
-    print("Null final_score:", int(df["final_score"].isna().sum()))
-    print("Columns:", list(df.columns))
+    parser = add_incremental_args(add_export_args(argparse.ArgumentParser()))
+    args = parser.parse_args()
+
+    if args.incremental:
+        export_incremental(
+            SQL_INCREMENTAL,
+            SCHEMA,
+            OUT_DATASET_DIR,
+            settle_hours=args.settle_hours,
+            since=datetime.fromisoformat(args.since) if args.since else None,
+            chunk_rows=args.chunk_rows,
+        )
+        return
+
+    export_ranking_dataset(
+        SQL,
+        SCHEMA,
+        OUT_PARQUET,
+        out_csv=OUT_CSV if args.csv else None,
+        chunk_rows=args.chunk_rows,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+
+# Binary datasets (binned features + labels + groups), one directory per cache key
+CACHE_DIR = Path("data/cache/lgb_datasets")
+
+# Binning parameters are baked into the binary file, so they are part of the cache key.
+# Training params must not override them (LightGBM refuses to re-bin a loaded dataset).
+DATASET_PARAMS = {"max_bin": 255, "min_data_in_bin": 3, "verbosity": -1}
+
+DEFAULT_VAL_FRACTION = 0.2
+
+
+def source_version(files: list[Path]) -> str:
+    """Cheap version of the source data: path, size and mtime of every Parquet part."""
+    if not files:
+        raise FileNotFoundError("No ranking dataset files found")
+    h = hashlib.sha256()
+    for p in sorted(files):
+        st = p.stat()
+        h.update(f"{p}|{st.st_size}|{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()[:16]
+
+
+def cache_key(version: str, features: list[str], label: str, val_fraction: float) -> str:
+    spec = {
+        "source": version,
+        "features": list(features),
+        "label": label,
+        "val_fraction": val_fraction,
+        "dataset_params": DATASET_PARAMS,
+    }
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def group_sizes(impression_ids: np.ndarray) -> np.ndarray:
+    """Run lengths of consecutive equal ids (rows must already be contiguous per impression)."""
+    if len(impression_ids) == 0:
+        return np.zeros(0, dtype=np.int32)
+    starts = np.flatnonzero(np.r_[True, impression_ids[1:] != impression_ids[:-1]])
+    return np.diff(np.r_[starts, len(impression_ids)]).astype(np.int32)
+
+
+@dataclass
+class RankingData:
+    train: lgb.Dataset
+    valid: lgb.Dataset
+    # Raw validation arrays for scoring (a binned lgb.Dataset cannot be predicted on)
+    X_val: np.ndarray
+    y_val: np.ndarray
+    val_groups: np.ndarray
+    meta: dict
+    path: Path
+    from_cache: bool
+
+
+def split_by_time(
+    df: pd.DataFrame,
+    features: list[str],
+    label: str,
+    val_fraction: float,
+    *,
+    dtype=np.float32,
+):
+    """
+    ((X, y, group_sizes) train, (X, y, group_sizes) val, span) with the newest `val_fraction`
+    of impressions as validation. Rows come back group-contiguous and time-ordered.
+    """
+    df = df.dropna(subset=[label])
+    for c in features:
+        df[c] = pd.to_numeric(df[c], errors="coerce").fillna(0)
+
+    # Group-contiguous, time-ordered rows; the split falls on an impression boundary
+    df = df.sort_values(["served_at", "impression_id", "position"], kind="mergesort")
+    imp = df["impression_id"].astype(str).to_numpy()
+    sizes = group_sizes(imp)
+    n_train_groups = int(len(sizes) * (1 - val_fraction))
+    split = int(sizes[:n_train_groups].sum())
+
+    X = df[features].to_numpy(dtype=dtype)
+    y = df[label].to_numpy(dtype=np.int32)
+    return (
+        (X[:split], y[:split], sizes[:n_train_groups]),
+        (X[split:], y[split:], sizes[n_train_groups:]),
+        {
+            "served_at_min": str(df["served_at"].min()),
+            "served_at_max": str(df["served_at"].max()),
+            "val_from": str(df["served_at"].iloc[split]) if split < len(df) else None,
+            "train_to": str(df["served_at"].iloc[split - 1]) if split > 0 else None,
+        },
+    )
+
+
+def _build(
+    out_dir: Path,
+    load_df: Callable[[], pd.DataFrame],
+    *,
+    features: list[str],
+    label: str,
+    val_fraction: float,
+    meta: dict,
+) -> None:
+    (X_tr, y_tr, g_tr), (X_val, y_val, g_val), span = split_by_time(load_df(), features, label, val_fraction)
+    if len(g_tr) == 0 or len(g_val) == 0:
+        raise ValueError(f"Not enough impressions to split (train={len(g_tr)}, val={len(g_val)})")
+
+    out_dir.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(prefix=f".{out_dir.name}.", dir=out_dir.parent))
+    try:
+        train = lgb.Dataset(X_tr, label=y_tr, group=g_tr, feature_name=list(features), params=DATASET_PARAMS)
+        valid = lgb.Dataset(X_val, label=y_val, group=g_val, reference=train)
+        train.save_binary(str(tmp / "train.bin"))
+        valid.save_binary(str(tmp / "valid.bin"))
+        np.savez(tmp / "valid_raw.npz", X=X_val, y=y_val, groups=g_val)
+
+        meta = {
+            **meta,
+            **span,
+            "rows_train": int(len(y_tr)),
+            "rows_val": int(len(y_val)),
+            "impressions_train": int(len(g_tr)),
+            "impressions_val": int(len(g_val)),
+            "clicks_train": int(y_tr.sum()),
+            "clicks_val": int(y_val.sum()),
+        }
+        (tmp / "meta.json").write_text(json.dumps(meta, indent=2))
+        os.replace(tmp, out_dir)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+
+def load_or_build(
+    load_df: Callable[[], pd.DataFrame],
+    *,
+    version: str,
+    features: list[str],
+    label: str = "label",
+    val_fraction: float = DEFAULT_VAL_FRACTION,
+    cache_dir: Path = CACHE_DIR,
+    rebuild: bool = False,
+) -> RankingData:
+    """
+    Returns grouped train/valid LightGBM datasets for `version` + `features`.
+
+    The first call reads the source through `load_df()` and writes the binary files;
+    later calls (other hyperparameters, other objectives) load them directly, skipping
+    Parquet decoding and feature binning.
+    """
+    key = cache_key(version, features, label, val_fraction)
+    path = cache_dir / key
+    from_cache = path.exists() and not rebuild
+
+    if not from_cache:
+        if path.exists():
+            shutil.rmtree(path)
+        _build(
+            path,
+            load_df,
+            features=features,
+            label=label,
+            val_fraction=val_fraction,
+            meta={"key": key, "source_version": version, "features": list(features), "label": label},
+        )
+
+    return load_cached(path, from_cache=from_cache)
+
+
+def load_cached(path: Path, *, from_cache: bool = True) -> RankingData:
+    """Opens an already-built cache entry (e.g. in sweep workers sharing one build)."""
+    meta = json.loads((path / "meta.json").read_text())
+    train = lgb.Dataset(str(path / "train.bin"))
+    valid = lgb.Dataset(str(path / "valid.bin"), reference=train)
+    raw = np.load(path / "valid_raw.npz")
+    return RankingData(
+        train=train,
+        valid=valid,
+        X_val=raw["X"],
+        y_val=raw["y"],
+        val_groups=raw["groups"],
+        meta=meta,
+        path=Path(path),
+        from_cache=from_cache,
+    )
@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pandas as pd
+import pyarrow.dataset as ds
+
+# Written by export_ranking_dataset_from_db_v4.py --incremental
+PARTITIONED_V4_DIR = Path("data/processed/ranking/ranking_dataset_v4")
+
+
+def partition_files(
+    dataset_dir: Path = PARTITIONED_V4_DIR,
+    *,
+    since: str | None = None,
+    until: str | None = None,
+) -> list[Path]:
+    """Parquet parts read_partitioned() would open for [since, until] (hidden/temp files excluded)."""
+    files = []
+    for part_dir in sorted(dataset_dir.glob("served_date=*")):
+        date = part_dir.name.split("=", 1)[1]
+        if (since is not None and date < since) or (until is not None and date > until):
+            continue
+        files.extend(p for p in sorted(part_dir.glob("*.parquet")) if not p.name.startswith("."))
+    return files
+
+
+def read_partitioned(
+    dataset_dir: Path = PARTITIONED_V4_DIR,
+    *,
+    since: str | None = None,
+    until: str | None = None,
+    columns: list[str] | None = None,
+) -> pd.DataFrame:
+    """
+    Reads a served_date=YYYY-MM-DD partitioned ranking dataset.
+
+    since / until are inclusive ISO dates; the filter is on the partition key, so
+    pyarrow only opens files for the requested days (partition pruning).
+    """
+    dataset = ds.dataset(str(dataset_dir), format="parquet", partitioning="hive")
+
+    flt = None
+    if since is not None:
+        flt = ds.field("served_date") >= since
+    if until is not None:
+        cond = ds.field("served_date") <= until
+        flt = cond if flt is None else (flt & cond)
+
+    table = dataset.to_table(columns=columns, filter=flt)
+    df = table.to_pandas()
+    if "served_date" in df.columns:
+        df = df.drop(columns=["served_date"])
+    return df
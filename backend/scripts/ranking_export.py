@@ -0,0 +1,270 @@
+from __future__ import annotations
+
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+import argparse
+import json
+import os
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+from backend.app.db import get_conn
+
+# Rows fetched per round trip from the server-side cursor (= one Parquet row group)
+DEFAULT_CHUNK_ROWS = 100_000
+
+# Incremental mode: impressions younger than this are left for the next run, so late clicks
+# land on their impression before it is exported with label=0
+DEFAULT_SETTLE_HOURS = 6.0
+WATERMARK_FILE = "_watermark.json"
+
+
+def add_export_args(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    parser.add_argument("--csv", action="store_true", help="Also write the CSV copy (off by default)")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS, help="Rows per fetch / row group")
+    return parser
+
+
+def add_incremental_args(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only export impressions past the stored served_at watermark into the partitioned dataset",
+    )
+    parser.add_argument(
+        "--settle-hours",
+        type=float,
+        default=DEFAULT_SETTLE_HOURS,
+        help="Label-settling window: skip impressions served more recently than this",
+    )
+    parser.add_argument(
+        "--since",
+        default=None,
+        help="ISO timestamp to start from when no watermark exists yet (default: beginning of the log)",
+    )
+    return parser
+
+
+def _to_column(values: list, field: pa.Field) -> pa.Array:
+    """Python values from psycopg -> a compact Arrow column of the declared type."""
+    t = field.type
+    if pa.types.is_string(t) or pa.types.is_large_string(t):
+        # UUIDs come back as uuid.UUID
+        values = [None if v is None else str(v) for v in values]
+    elif pa.types.is_floating(t):
+        # NUMERIC (e.g. EXTRACT(EPOCH ...)) comes back as Decimal
+        values = [None if v is None else float(v) for v in values]
+    elif pa.types.is_integer(t):
+        values = [None if v is None else int(v) for v in values]
+    return pa.array(values, type=t)
+
+
+def _chunk_to_table(rows: list[tuple], schema: pa.Schema) -> pa.Table:
+    columns = list(zip(*rows)) if rows else [() for _ in schema]
+    return pa.Table.from_arrays([_to_column(list(col), f) for col, f in zip(columns, schema)], schema=schema)
+
+
+def stream_query(
+    sql: str,
+    schema: pa.Schema,
+    *,
+    params: dict | tuple | None = None,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+    cursor_name: str = "ranking_export",
+):
+    """
+    Yields Arrow tables of at most `chunk_rows` rows from a named (server-side) cursor,
+    so client memory stays bounded by one chunk regardless of log size.
+    `schema` must list the query's columns in SELECT order.
+    """
+    with get_conn() as conn:
+        with conn.cursor(name=cursor_name) as cur:
+            cur.itersize = chunk_rows
+            cur.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                yield _chunk_to_table(rows, schema)
+
+
+class ExportStats:
+    """Running summary of an export (the old scripts printed these from the full DataFrame)."""
+
+    def __init__(self) -> None:
+        self.rows = 0
+        self.impressions = 0
+        self.labels: Counter = Counter()
+        self.nulls: Counter = Counter()
+        self._last_impression = None
+
+    def update(self, table: pa.Table) -> None:
+        self.rows += table.num_rows
+
+        # Rows arrive ordered by (served_at, impression_id, position): count impression boundaries
+        for imp in table.column("impression_id").to_pylist():
+            if imp != self._last_impression:
+                self.impressions += 1
+                self._last_impression = imp
+
+        if "label" in table.column_names:
+            for value, count in Counter(table.column("label").to_pylist()).items():
+                self.labels[value] += count
+        for name in ("rank_score", "final_score"):
+            if name in table.column_names:
+                self.nulls[name] += table.column(name).null_count
+
+    def print_summary(self, schema: pa.Schema) -> None:
+        print("Rows:", self.rows)
+        print("Unique impressions:", self.impressions)
+        print("Label distribution:", dict(self.labels))
+        for name, count in self.nulls.items():
+            print(f"Null {name}:", count)
+        print("Columns:", schema.names)
+
+
+def export_ranking_dataset(
+    sql: str,
+    schema: pa.Schema,
+    out_parquet: Path,
+    *,
+    out_csv: Path | None = None,
+    params: dict | tuple | None = None,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+) -> ExportStats:
+    """
+    Streams `sql` into `out_parquet` one row group per chunk (and optionally into `out_csv`).
+    Files are written under temp names and renamed when complete.
+    """
+    out_parquet.parent.mkdir(parents=True, exist_ok=True)
+    tmp_parquet = out_parquet.with_name(out_parquet.name + ".tmp")
+    tmp_csv = out_csv.with_name(out_csv.name + ".tmp") if out_csv is not None else None
+
+    stats = ExportStats()
+    csv_writer = None
+    with pq.ParquetWriter(tmp_parquet, schema, compression="zstd") as writer:
+        try:
+            if tmp_csv is not None:
+                tmp_csv.parent.mkdir(parents=True, exist_ok=True)
+                csv_writer = pacsv.CSVWriter(str(tmp_csv), schema)
+
+            for table in stream_query(sql, schema, params=params, chunk_rows=chunk_rows):
+                writer.write_table(table)
+                if csv_writer is not None:
+                    csv_writer.write_table(table)
+                stats.update(table)
+        finally:
+            if csv_writer is not None:
+                csv_writer.close()
+
+    os.replace(tmp_parquet, out_parquet)
+    print("Parquet written to:", out_parquet)
+    if out_csv is not None:
+        os.replace(tmp_csv, out_csv)
+        print("CSV written to:", out_csv)
+
+    stats.print_summary(schema)
+    return stats
+
+
+# ----------------------------
+# Incremental (watermark) export -> date-partitioned dataset
+# ----------------------------
+def read_watermark(dataset_dir: Path) -> datetime | None:
+    path = dataset_dir / WATERMARK_FILE
+    if not path.exists():
+        return None
+    return datetime.fromisoformat(json.loads(path.read_text())["served_at"])
+
+
+def write_watermark(dataset_dir: Path, served_at: datetime, rows: int) -> None:
+    path = dataset_dir / WATERMARK_FILE
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(
+        json.dumps(
+            {
+                "served_at": served_at.isoformat(),
+                "rows_last_run": rows,
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+            },
+            indent=2,
+        )
+    )
+    os.replace(tmp, path)
+
+
+def export_incremental(
+    sql: str,
+    schema: pa.Schema,
+    dataset_dir: Path,
+    *,
+    settle_hours: float = DEFAULT_SETTLE_HOURS,
+    since: datetime | None = None,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+) -> ExportStats:
+    """
+    Exports impressions with watermark < served_at <= now - settle_hours into
+    <dataset_dir>/served_date=YYYY-MM-DD/part-<watermark>.parquet, then advances the watermark.
+
+    `sql` must filter on %(lower)s / %(upper)s and order by served_at.
+    Part names derive from the starting watermark, so a run that dies before the watermark
+    moves is redone by the next run and overwrites its own parts instead of duplicating rows.
+    """
+    dataset_dir.mkdir(parents=True, exist_ok=True)
+
+    lower = read_watermark(dataset_dir) or since or datetime(1970, 1, 1, tzinfo=timezone.utc)
+    if lower.tzinfo is None:
+        lower = lower.replace(tzinfo=timezone.utc)
+    upper = datetime.now(timezone.utc) - timedelta(hours=settle_hours)
+    if upper <= lower:
+        print(f"Nothing to export: watermark {lower.isoformat()} is inside the settling window")
+        return ExportStats()
+
+    print(f"Incremental window: ({lower.isoformat()}, {upper.isoformat()}]")
+    part_name = f"part-{lower.strftime('%Y%m%dT%H%M%S%fZ')}.parquet"
+
+    stats = ExportStats()
+    open_writers: dict[str, tuple[pq.ParquetWriter, Path, Path]] = {}
+    finished: list[tuple[Path, Path]] = []
+
+    def _close(date: str) -> None:
+        writer, tmp, final = open_writers.pop(date)
+        writer.close()
+        finished.append((tmp, final))
+
+    try:
+        for table in stream_query(sql, schema, params={"lower": lower, "upper": upper}, chunk_rows=chunk_rows):
+            dates = pc.strftime(table.column("served_at"), format="%Y-%m-%d")
+            chunk_dates = sorted(set(dates.to_pylist()))
+
+            # Rows arrive ordered by served_at: earlier days are complete once a chunk starts later
+            for date in [d for d in open_writers if d < chunk_dates[0]]:
+                _close(date)
+
+            for date in chunk_dates:
+                if date not in open_writers:
+                    part_dir = dataset_dir / f"served_date={date}"
+                    part_dir.mkdir(parents=True, exist_ok=True)
+                    final = part_dir / part_name
+                    # Dot-prefixed: dataset readers skip hidden files, so a crash never leaves a readable partial
+                    tmp = final.with_name("." + final.name + ".tmp")
+                    open_writers[date] = (pq.ParquetWriter(tmp, schema, compression="zstd"), tmp, final)
+                open_writers[date][0].write_table(table.filter(pc.equal(dates, date)))
+
+            stats.update(table)
+    finally:
+        for date in list(open_writers):
+            _close(date)
+
+    for tmp, final in finished:
+        os.replace(tmp, final)
+    write_watermark(dataset_dir, upper, stats.rows)
+
+    print(f"Partitions written: {len(finished)} under {dataset_dir}")
+    stats.print_summary(schema)
+    return stats
+
@@ -0,0 +1,465 @@
+from __future__ import annotations
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+import argparse
+import json
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from backend.app.features.definitions import WARM_MIN_CLICKS, is_warm_user, item_age_hours
+from backend.app.features.feature_store import FeatureSnapshot
+from backend.app.ranking.pipeline import (
+    CANDIDATE_TOP_K,
+    LAMBDA_DIVERSITY,
+    PENALTY_CAP,
+    RECENT_CLICKS_K,
+    RankerSet,
+    load_rankers,
+    rank_candidates,
+    rerank_diversity,
+    warm_candidates,
+)
+from backend.app.retrieval.faiss_store import bundles_dir, load_bundle_dir, read_current_tag
+from backend.scripts.ranking_metrics import GroupedRanking, bootstrap_ci, summarize
+
+# ----------------------------
+# Offline replay of the recommendation funnel
+# ----------------------------
+# Re-executes retrieve -> rank -> diversity re-rank (backend.app.ranking.pipeline, the same
+# code the API runs) for logged impressions or a captured requests.jsonl, against a frozen
+# FAISS bundle and ranker files. The database is only read (requests, history, catalog);
+# results go to data/processed/replay/<run>/.
+
+OUT_ROOT = Path("data/processed/replay")
+RANKERS_DIR = Path("data/models/rankers")
+DEFAULT_LGBM = RANKERS_DIR / "ranker_lgbm_v2.joblib"
+DEFAULT_LR = RANKERS_DIR / "ranker_lr_v1.joblib"
+
+# Requests per task sent to a worker (amortizes pickling)
+REQUESTS_PER_TASK = 256
+
+# Point-in-time history: clicks strictly before served_at
+IMPRESSIONS_SQL = """
+SELECT
+  i.impression_id::text,
+  i.anonymous_id,
+  EXTRACT(EPOCH FROM i.served_at)::float8 AS served_at,
+  COALESCE(i.page_size, 10) AS page_size,
+  COALESCE(i.user_click_count, h.n, 0) AS user_click_count,
+  COALESCE(r.ids, ARRAY[]::text[]) AS recent_clicked_ids
+FROM impressions_served i
+LEFT JOIN LATERAL (
+  SELECT COUNT(*)::int AS n
+  FROM clicks c2
+  JOIN impressions_served i2 ON i2.impression_id = c2.impression_id
+  WHERE i.user_click_count IS NULL
+    AND i2.anonymous_id = i.anonymous_id
+    AND c2.clicked_at < i.served_at
+) h ON TRUE
+LEFT JOIN LATERAL (
+  SELECT array_agg(item_id ORDER BY clicked_at DESC) AS ids
+  FROM (
+    SELECT c3.item_id, c3.clicked_at
+    FROM clicks c3
+    JOIN impressions_served i3 ON i3.impression_id = c3.impression_id
+    WHERE i3.anonymous_id = i.anonymous_id
+      AND c3.clicked_at < i.served_at
+    ORDER BY c3.clicked_at DESC
+    LIMIT %(recent_k)s
+  ) last_clicks
+) r ON TRUE
+WHERE i.anonymous_id IS NOT NULL
+  AND (%(since)s::timestamptz IS NULL OR i.served_at >= %(since)s::timestamptz)
+  AND (%(until)s::timestamptz IS NULL OR i.served_at < %(until)s::timestamptz)
+ORDER BY i.served_at ASC
+LIMIT %(limit)s;
+"""
+
+LOGGED_ITEMS_SQL = """
+SELECT
+  ii.impression_id::text,
+  ii.item_id,
+  ii.position,
+  COALESCE(ii.retrieval_pos, ii.position) AS retrieval_pos,
+  COALESCE(ii.retrieval_score, 0.0) AS retrieval_score,
+  (c.impression_id IS NOT NULL)::int AS label
+FROM impression_items ii
+LEFT JOIN (SELECT DISTINCT impression_id, item_id FROM clicks) c
+  ON c.impression_id = ii.impression_id AND c.item_id = ii.item_id
+WHERE ii.impression_id = ANY(%s::uuid[]);
+"""
+
+# History for captured requests (anonymous_id, served_at) that did not record it
+HISTORY_SQL = """
+SELECT
+  q.ord,
+  COALESCE(h.n, 0) AS user_click_count,
+  COALESCE(r.ids, ARRAY[]::text[]) AS recent_clicked_ids
+FROM unnest(%(anon)s::text[], %(ts)s::float8[]) WITH ORDINALITY AS q(anonymous_id, served_at, ord)
+LEFT JOIN LATERAL (
+  SELECT COUNT(*)::int AS n
+  FROM clicks c2
+  JOIN impressions_served i2 ON i2.impression_id = c2.impression_id
+  WHERE i2.anonymous_id = q.anonymous_id AND c2.clicked_at < to_timestamp(q.served_at)
+) h ON TRUE
+LEFT JOIN LATERAL (
+  SELECT array_agg(item_id ORDER BY clicked_at DESC) AS ids
+  FROM (
+    SELECT c3.item_id, c3.clicked_at
+    FROM clicks c3
+    JOIN impressions_served i3 ON i3.impression_id = c3.impression_id
+    WHERE i3.anonymous_id = q.anonymous_id AND c3.clicked_at < to_timestamp(q.served_at)
+    ORDER BY c3.clicked_at DESC
+    LIMIT %(recent_k)s
+  ) last_clicks
+) r ON TRUE
+ORDER BY q.ord;
+"""
+
+ITEMS_SQL = "SELECT item_id, title, EXTRACT(EPOCH FROM ingested_at)::float8 FROM items;"
+
+
+# ----------------------------
+# Request loading (main process, read-only)
+# ----------------------------
+def load_logged_requests(since: str | None, until: str | None, limit: int | None) -> list[dict]:
+    from backend.app.db import get_conn
+
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                IMPRESSIONS_SQL,
+                {"since": since, "until": until, "limit": limit, "recent_k": RECENT_CLICKS_K},
+            )
+            reqs = [
+                {
+                    "impression_id": imp,
+                    "anonymous_id": anon,
+                    "served_at": float(ts),
+                    "page_size": int(page_size),
+                    "user_click_count": int(n),
+                    "recent_clicked_ids": list(recent),
+                }
+                for imp, anon, ts, page_size, n, recent in cur.fetchall()
+            ]
+
+            by_imp: dict[str, list] = {r["impression_id"]: [] for r in reqs}
+            if reqs:
+                cur.execute(LOGGED_ITEMS_SQL, (list(by_imp),))
+                for imp, item_id, pos, rpos, rscore, label in cur.fetchall():
+                    by_imp[imp].append((item_id, int(pos), int(rpos), float(rscore), int(label)))
+        conn.rollback()
+
+    for r in reqs:
+        r["logged_items"] = sorted(by_imp[r["impression_id"]], key=lambda x: x[1])
+    return reqs
+
+
+def load_captured_requests(path: Path, limit: int | None) -> list[dict]:
+    """
+    One JSON object per line: anonymous_id, page_size and optionally served_at (ISO or epoch),
+    request_id / impression_id, user_click_count, recent_clicked_ids, logged_items.
+    Missing history is resolved point-in-time from the database.
+    """
+    reqs = []
+    with open(path) as f:
+        for n, line in enumerate(f):
+            if limit is not None and len(reqs) >= limit:
+                break
+            if not line.strip():
+                continue
+            raw = json.loads(line)
+            served_at = raw.get("served_at")
+            if served_at is None:
+                served_at = time.time()
+            elif isinstance(served_at, str):
+                dt = datetime.fromisoformat(served_at)
+                served_at = (dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)).timestamp()
+            reqs.append(
+                {
+                    "impression_id": str(raw.get("impression_id") or raw.get("request_id") or f"req-{n}"),
+                    "anonymous_id": raw["anonymous_id"],
+                    "served_at": float(served_at),
+                    "page_size": int(raw.get("page_size", 10)),
+                    "user_click_count": raw.get("user_click_count"),
+                    "recent_clicked_ids": raw.get("recent_clicked_ids"),
+                    "logged_items": [tuple(x) for x in raw.get("logged_items", [])],
+                }
+            )
+
+    missing = [r for r in reqs if r["user_click_count"] is None or r["recent_clicked_ids"] is None]
+    if missing:
+        from backend.app.db import get_conn
+
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    HISTORY_SQL,
+                    {
+                        "anon": [r["anonymous_id"] for r in missing],
+                        "ts": [r["served_at"] for r in missing],
+                        "recent_k": RECENT_CLICKS_K,
+                    },
+                )
+                for r, (_ord, n, recent) in zip(missing, cur.fetchall()):
+                    if r["user_click_count"] is None:
+                        r["user_click_count"] = int(n)
+                    if r["recent_clicked_ids"] is None:
+                        r["recent_clicked_ids"] = list(recent)
+            conn.rollback()
+    return reqs
+
+
+def load_catalog() -> tuple[dict[str, str], dict[str, float]]:
+    from backend.app.db import get_conn
+
+    titles: dict[str, str] = {}
+    ingested: dict[str, float] = {}
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(ITEMS_SQL)
+            for item_id, title, ts in cur.fetchall():
+                titles[str(item_id)] = title or ""
+                if ts is not None:
+                    ingested[str(item_id)] = float(ts)
+        conn.rollback()
+    return titles, ingested
+
+
+# ----------------------------
+# Worker (frozen store + rankers, no database)
+# ----------------------------
+_CTX: dict = {}
+
+
+def _init_worker(bundle_dir: str, lgbm_path: str | None, lr_path: str | None, catalog, config: dict) -> None:
+    # One BLAS/FAISS thread per process: parallelism comes from the pool
+    os.environ["OMP_NUM_THREADS"] = "1"
+    import faiss
+
+    faiss.omp_set_num_threads(1)
+
+    titles, ingested = catalog
+    _CTX.update(
+        store=load_bundle_dir(Path(bundle_dir), lookup_version_id=False),
+        rankers=load_rankers(
+            Path(lgbm_path) if lgbm_path else None,
+            Path(lr_path) if lr_path else None,
+        ),
+        titles=titles,
+        ingested=ingested,
+        config=config,
+    )
+
+
+def replay_request(req: dict, *, store, rankers: RankerSet, titles, ingested, config: dict) -> tuple[str, list[dict]]:
+    """Same stages as get_recommendations; cold users re-rank their logged candidates."""
+    page_size = req["page_size"]
+    candidates: list[tuple[str, float]] = []
+    path = "cold"
+
+    if req["user_click_count"] >= WARM_MIN_CLICKS:
+        candidates = warm_candidates(
+            store, req["recent_clicked_ids"], page_size, top_k=config["candidate_top_k"]
+        )
+        if candidates:
+            path = "warm"
+
+    if not candidates:
+        # Live serving samples cold candidates at random; replay keeps the logged sample
+        logged = sorted(req["logged_items"], key=lambda x: x[2])
+        candidates = [(item_id, rscore) for item_id, _pos, _rpos, rscore, _label in logged][:page_size]
+    if not candidates:
+        return "skipped", []
+
+    item_ids = [cid for cid, _s in candidates]
+    n = int(req["user_click_count"])
+    features = FeatureSnapshot(
+        user_click_count=n,
+        is_warm_user=is_warm_user(n),
+        item_age_hours=[item_age_hours(ingested.get(i), req["served_at"]) for i in item_ids],
+    )
+
+    ranked = rank_candidates(candidates, features=features, rankers=rankers)
+    ranked = rerank_diversity(
+        ranked,
+        {i: titles.get(i, "") for i in item_ids},
+        lambda_diversity=config["lambda_diversity"],
+        penalty_cap=config["penalty_cap"],
+    )
+    return path, ranked
+
+
+def _replay_task(reqs: list[dict]) -> list[dict]:
+    rows = []
+    for req in reqs:
+        labels = {item_id: label for item_id, _pos, _rpos, _rscore, label in req["logged_items"]}
+        path, ranked = replay_request(req, **_CTX)
+        for pos, e in enumerate(ranked, start=1):
+            rows.append(
+                {
+                    "impression_id": req["impression_id"],
+                    "path": path,
+                    "position": pos,
+                    "item_id": e["item_id"],
+                    "retrieval_pos": int(e["retrieval_pos"]),
+                    "retrieval_score": float(e["retrieval_score"]),
+                    "rank_score": float(e["rank_score"]),
+                    "final_score": float(e["final_score"]),
+                    "ranker": e.get("ranker"),
+                    # Label only exists for items the user was actually shown
+                    "logged": e["item_id"] in labels,
+                    "label": int(labels.get(e["item_id"], 0)),
+                }
+            )
+    return rows
+
+
+# ----------------------------
+# Metrics
+# ----------------------------
+def replay_metrics(lists: pd.DataFrame, reqs: list[dict], *, k: int, n_boot: int) -> dict:
+    """Replayed order vs the logged served order, on impressions with at least one logged click."""
+    logged = pd.DataFrame(
+        [
+            (r["impression_id"], item_id, pos, label)
+            for r in reqs
+            for item_id, pos, _rpos, _rscore, label in r["logged_items"]
+        ],
+        columns=["impression_id", "item_id", "position", "label"],
+    )
+    out: dict = {
+        "impressions_replayed": int(lists["impression_id"].nunique()) if len(lists) else 0,
+        "rows": int(len(lists)),
+        "paths": lists.drop_duplicates("impression_id")["path"].value_counts().to_dict() if len(lists) else {},
+        # Share of replayed items that were shown in the logged list (labels are only known there)
+        "logged_coverage": float(lists["logged"].mean()) if len(lists) else 0.0,
+    }
+    if logged.empty or lists.empty:
+        return out
+
+    clicked = logged.groupby("impression_id")["label"].transform("max") > 0
+    logged = logged[clicked]
+    replay = lists[lists["impression_id"].isin(set(logged["impression_id"]))]
+    if replay.empty:
+        return out
+
+    per_served = GroupedRanking(logged["impression_id"], logged["label"]).per_group(
+        -logged["position"].to_numpy(dtype=np.float64), k=k
+    )
+    per_replay = GroupedRanking(replay["impression_id"], replay["label"]).per_group(
+        -replay["position"].to_numpy(dtype=np.float64), k=k
+    )
+    out["impressions_with_clicks"] = int(logged["impression_id"].nunique())
+    out["served"] = summarize(per_served)
+    out["replay"] = summarize(per_replay)
+    if n_boot > 0:
+        ci = bootstrap_ci({f"served {m}": v for m, v in per_served.items()}, n_boot=n_boot)
+        ci.update(bootstrap_ci({f"replay {m}": v for m, v in per_replay.items()}, n_boot=n_boot))
+        out["ci95"] = {name: list(bounds) for name, bounds in ci.items()}
+    return out
+
+
+# ----------------------------
+# Main
+# ----------------------------
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay logged/captured requests through the funnel offline")
+    parser.add_argument("--requests", type=Path, default=None, help="requests.jsonl capture (default: logged impressions)")
+    parser.add_argument("--since", default=None, help="Logged impressions served at/after this ISO timestamp")
+    parser.add_argument("--until", default=None, help="Logged impressions served before this ISO timestamp")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--bundle", default=None, help="FAISS bundle tag or directory (default: CURRENT, frozen at start)")
+    parser.add_argument("--lgbm", type=Path, default=DEFAULT_LGBM, help="LightGBM ranker (.joblib); 'none' to disable")
+    parser.add_argument("--lr", type=Path, default=DEFAULT_LR, help="LR fallback ranker (.joblib); 'none' to disable")
+    parser.add_argument("--candidate-top-k", type=int, default=CANDIDATE_TOP_K)
+    parser.add_argument("--lambda-diversity", type=float, default=LAMBDA_DIVERSITY)
+    parser.add_argument("--penalty-cap", type=float, default=PENALTY_CAP)
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--bootstrap", type=int, default=0, help="Bootstrap resamples for 95%% CIs (0 = off)")
+    parser.add_argument("--run-name", default=None, help=f"Output directory name under {OUT_ROOT}")
+    args = parser.parse_args()
+
+    # Freeze the bundle now: later publishes do not affect this run
+    if args.bundle and Path(args.bundle).is_dir():
+        bundle_dir = Path(args.bundle)
+    else:
+        tag = args.bundle or read_current_tag()
+        if tag is None:
+            raise FileNotFoundError(f"No FAISS bundle published under {bundles_dir()} (pass --bundle)")
+        bundle_dir = bundles_dir() / tag
+    lgbm_path = None if str(args.lgbm).lower() == "none" else str(args.lgbm)
+    lr_path = None if str(args.lr).lower() == "none" else str(args.lr)
+
+    config = {
+        "candidate_top_k": args.candidate_top_k,
+        "lambda_diversity": args.lambda_diversity,
+        "penalty_cap": args.penalty_cap,
+    }
+
+    t0 = time.perf_counter()
+    if args.requests is not None:
+        reqs = load_captured_requests(args.requests, args.limit)
+        source = str(args.requests)
+    else:
+        reqs = load_logged_requests(args.since, args.until, args.limit)
+        source = f"impressions_served [{args.since or '*'} .. {args.until or '*'}]"
+    catalog = load_catalog()
+    t_load = time.perf_counter() - t0
+    print(f"Loaded {len(reqs)} requests, {len(catalog[0])} items in {t_load:.2f}s")
+
+    t1 = time.perf_counter()
+    tasks = [reqs[i : i + REQUESTS_PER_TASK] for i in range(0, len(reqs), REQUESTS_PER_TASK)]
+    rows: list[dict] = []
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=mp.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(str(bundle_dir), lgbm_path, lr_path, catalog, config),
+    ) as pool:
+        for chunk in pool.map(_replay_task, tasks):
+            rows.extend(chunk)
+    t_replay = time.perf_counter() - t1
+
+    lists = pd.DataFrame(
+        rows,
+        columns=[
+            "impression_id", "path", "position", "item_id", "retrieval_pos", "retrieval_score",
+            "rank_score", "final_score", "ranker", "logged", "label",
+        ],
+    )
+    metrics = replay_metrics(lists, reqs, k=args.k, n_boot=args.bootstrap)
+
+    run_name = args.run_name or datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    out_dir = OUT_ROOT / run_name
+    out_dir.mkdir(parents=True, exist_ok=True)
+    lists.to_parquet(out_dir / "lists.parquet", index=False)
+
+    summary = {
+        "source": source,
+        "bundle_dir": str(bundle_dir),
+        "lgbm": lgbm_path,
+        "lr": lr_path,
+        "config": config,
+        "workers": args.workers,
+        "requests": len(reqs),
+        "load_seconds": round(t_load, 3),
+        "replay_seconds": round(t_replay, 3),
+        "requests_per_sec": round(len(reqs) / t_replay, 1) if t_replay > 0 else None,
+        "metrics": metrics,
+    }
+    (out_dir / "summary.json").write_text(json.dumps(summary, indent=2))
+
+    print("Lists written to:", out_dir / "lists.parquet")
+    print("Summary:", json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+from datetime import timedelta
+import argparse
+import time
+
+# ----------------------------
+# Incremental hourly metrics rollups (migrations/003_metrics_rollups.sql)
+# ----------------------------
+# Each pass finds the hours that have new rows: the distinct served_at / clicked_at hours of
+# impressions and clicks *ingested* (migrations/004) since the previous pass's mark, minus
+# INGEST_OVERLAP_S for transactions that committed late. Those hours (and only those) are
+# recomputed and replaced in metrics_hourly / metrics_item_clicks_hourly in one transaction.
+# Rows the event log loader writes long after their event time still land in the right hour,
+# however late. A pass reads only the new rows plus the dirty hours (ingested_at / served_at /
+# clicked_at indexes), and re-running it is harmless.
+#
+# The first pass (no mark yet) rolls up the last --backfill-hours by event time.
+
+JOB = "metrics_hourly"
+INGEST_OVERLAP_S = 300
+
+
+def load_bucket_edges(cur) -> list[int]:
+    cur.execute("SELECT lower_ms FROM metrics_dwell_buckets ORDER BY bucket;")
+    return [int(r[0]) for r in cur.fetchall()]
+
+
+_DIRTY_HOURS_SQL = """
+SELECT date_trunc('hour', served_at) FROM impressions_served WHERE ingested_at >= %(since)s
+UNION
+SELECT date_trunc('hour', clicked_at) FROM clicks WHERE ingested_at >= %(since)s
+ORDER BY 1;
+"""
+
+_BACKFILL_HOURS_SQL = """
+SELECT generate_series(
+  date_trunc('hour', %(now)s::timestamptz - make_interval(hours => %(hours)s)),
+  date_trunc('hour', %(now)s::timestamptz),
+  interval '1 hour'
+);
+"""
+
+
+def _hourly_sql(n_buckets: int) -> str:
+    hist = ", ".join(f"COUNT(*) FILTER (WHERE b = {i})" for i in range(1, n_buckets + 1))
+    return f"""
+    WITH hours AS (
+      SELECT unnest(%(hours)s::timestamptz[]) AS hour
+    ),
+    imp AS (
+      SELECT h.hour, COALESCE(i.surface, '') AS surface, COALESCE(i.locale, '') AS locale,
+             COUNT(*) AS impressions
+      FROM hours h
+      JOIN impressions_served i ON i.served_at >= h.hour AND i.served_at < h.hour + interval '1 hour'
+      GROUP BY 1, 2, 3
+    ),
+    clk AS (
+      SELECT hour, surface, locale,
+             COUNT(*) AS clicks,
+             COUNT(dwell_ms) AS dwell_count,
+             COALESCE(SUM(dwell_ms), 0) AS dwell_sum_ms,
+             MAX(dwell_ms) AS dwell_max_ms,
+             ARRAY[{hist}]::bigint[] AS dwell_hist
+      FROM (
+        SELECT h.hour, COALESCE(i.surface, '') AS surface,
+               COALESCE(i.locale, '') AS locale,
+               c.dwell_ms,
+               width_bucket(GREATEST(c.dwell_ms, 0), %(edges)s::int[]) AS b
+        FROM hours h
+        JOIN clicks c ON c.clicked_at >= h.hour AND c.clicked_at < h.hour + interval '1 hour'
+        JOIN impressions_served i ON i.impression_id = c.impression_id
+      ) x
+      GROUP BY 1, 2, 3
+    )
+    INSERT INTO metrics_hourly(
+      hour, surface, locale, impressions, clicks, dwell_count, dwell_sum_ms, dwell_max_ms, dwell_hist
+    )
+    SELECT
+      hour, surface, locale,
+      COALESCE(imp.impressions, 0),
+      COALESCE(clk.clicks, 0),
+      COALESCE(clk.dwell_count, 0),
+      COALESCE(clk.dwell_sum_ms, 0),
+      clk.dwell_max_ms,
+      COALESCE(clk.dwell_hist, array_fill(0::bigint, ARRAY[{n_buckets}]))
+    FROM imp FULL JOIN clk USING (hour, surface, locale);
+    """
+
+
+_ITEM_CLICKS_SQL = """
+INSERT INTO metrics_item_clicks_hourly(hour, item_id, clicks)
+SELECT h.hour, c.item_id, COUNT(*)
+FROM unnest(%(hours)s::timestamptz[]) AS h(hour)
+JOIN clicks c ON c.clicked_at >= h.hour AND c.clicked_at < h.hour + interval '1 hour'
+GROUP BY 1, 2;
+"""
+
+
+def rollup(conn, *, backfill_hours: int, overlap_s: float = INGEST_OVERLAP_S) -> dict:
+    """One pass; returns the recomputed hours and row counts."""
+    with conn.cursor() as cur:
+        # Serializes concurrent runs (the second waits, then recomputes from the new mark)
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s));", (JOB,))
+        cur.execute("SELECT now();")
+        now = cur.fetchone()[0]
+        cur.execute("SELECT rolled_up_to FROM metrics_rollup_state WHERE job = %s;", (JOB,))
+        row = cur.fetchone()
+        if row:
+            cur.execute(_DIRTY_HOURS_SQL, {"since": row[0] - timedelta(seconds=overlap_s)})
+        else:
+            cur.execute(_BACKFILL_HOURS_SQL, {"now": now, "hours": backfill_hours})
+        hours = [r[0] for r in cur.fetchall()]
+
+        hourly_rows = item_rows = 0
+        if hours:
+            edges = load_bucket_edges(cur)
+            params = {"hours": hours, "edges": edges}
+            cur.execute("DELETE FROM metrics_hourly WHERE hour = ANY(%(hours)s::timestamptz[]);", params)
+            cur.execute(_hourly_sql(len(edges)), params)
+            hourly_rows = cur.rowcount
+            cur.execute("DELETE FROM metrics_item_clicks_hourly WHERE hour = ANY(%(hours)s::timestamptz[]);", params)
+            cur.execute(_ITEM_CLICKS_SQL, params)
+            item_rows = cur.rowcount
+
+        cur.execute(
+            """
+            INSERT INTO metrics_rollup_state(job, rolled_up_to, updated_at)
+            VALUES (%s, %s, now())
+            ON CONFLICT (job) DO UPDATE SET rolled_up_to = EXCLUDED.rolled_up_to, updated_at = now();
+            """,
+            (JOB, now),
+        )
+    conn.commit()
+    return {
+        "hours": len(hours),
+        "from_hour": hours[0].isoformat() if hours else None,
+        "to_hour": hours[-1].isoformat() if hours else None,
+        "hourly_rows": hourly_rows,
+        "item_rows": item_rows,
+    }
+
+
+def main() -> None:
+    from backend.app.db import get_conn
+
+    parser = argparse.ArgumentParser(description="Maintain the hourly metrics rollup tables")
+    parser.add_argument("--interval", type=float, default=60.0, help="Seconds between passes")
+    parser.add_argument("--once", action="store_true", help="Single pass, then exit")
+    parser.add_argument(
+        "--backfill-hours", type=int, default=24 * 30, help="History rolled up on the first run"
+    )
+    parser.add_argument(
+        "--overlap-s", type=float, default=INGEST_OVERLAP_S, help="Seconds of ingest re-scanned before the last mark"
+    )
+    args = parser.parse_args()
+
+    while True:
+        t0 = time.perf_counter()
+        try:
+            with get_conn() as conn:
+                try:
+                    r = rollup(conn, backfill_hours=args.backfill_hours, overlap_s=args.overlap_s)
+                except Exception:
+                    conn.rollback()
+                    raise
+            print(f"[rollup] {r} in {time.perf_counter() - t0:.3f}s")
+        except Exception as e:
+            print(f"[rollup] Pass failed: {e}")
+        if args.once:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
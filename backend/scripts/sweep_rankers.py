@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+from pathlib import Path
+import argparse
+import itertools
+import json
+import multiprocessing as mp
+import os
+import random
+import time
+
+import lightgbm as lgb
+
+from backend.scripts.lgb_dataset_cache import load_cached
+from backend.scripts.ranking_metrics import GroupedRanking, summarize
+from backend.scripts.train_ranker_lgbm_lambdarank import add_data_args, load_ranking_data
+
+# ----------------------------
+# Hyperparameter sweep for the LightGBM rankers
+# ----------------------------
+# Trials run concurrently in a spawn process pool. Every worker opens the same cached binary
+# dataset (lgb_dataset_cache, built once up front) and trains with num_threads=threads-per-worker,
+# so workers x threads never exceeds the cores (no OpenMP oversubscription).
+
+OUT_DIR = Path("data/models/rankers")
+LEADERBOARD_PATH = OUT_DIR / "ranker_sweep_leaderboard.json"
+BEST_MODEL_PATH = OUT_DIR / "ranker_sweep_best.txt"
+
+# Grid used when no --space file is given. Lists are crossed; scalars are fixed.
+DEFAULT_SPACE = {
+    "objective": ["lambdarank", "binary"],
+    "learning_rate": [0.03, 0.05, 0.1],
+    "num_leaves": [15, 31, 63],
+    "min_data_in_leaf": [20, 50, 100],
+    "feature_fraction": [0.8, 1.0],
+    "lambda_l2": [0.0, 1.0],
+}
+
+
+def expand_space(space: dict, n_trials: int | None, seed: int) -> list[dict]:
+    """Cartesian product of the list-valued entries; random subset if n_trials is smaller."""
+    keys = list(space)
+    axes = [v if isinstance(v, list) else [v] for v in space.values()]
+    grid = [dict(zip(keys, combo)) for combo in itertools.product(*axes)]
+    if n_trials is not None and n_trials < len(grid):
+        grid = random.Random(seed).sample(grid, n_trials)
+    return grid
+
+
+def run_trial(trial_id: int, hp: dict, *, dataset_path: str, threads: int, settings: dict) -> dict:
+    k = settings["eval_at"]
+    data = load_cached(Path(dataset_path))
+    params = {
+        "metric": "ndcg",
+        "eval_at": [k],
+        "seed": settings["seed"],
+        "num_threads": threads,
+        "verbosity": -1,
+        **hp,
+    }
+
+    t0 = time.perf_counter()
+    booster = lgb.train(
+        params,
+        data.train,
+        num_boost_round=settings["num_boost_round"],
+        valid_sets=[data.valid],
+        valid_names=["val"],
+        callbacks=[lgb.early_stopping(settings["early_stopping_rounds"], verbose=False)],
+    )
+    train_seconds = time.perf_counter() - t0
+
+    scores = booster.predict(data.X_val, num_iteration=booster.best_iteration, num_threads=threads)
+    metrics = summarize(GroupedRanking.from_group_sizes(data.val_groups, data.y_val).per_group(scores, k=k))
+
+    return {
+        "trial": trial_id,
+        "params": hp,
+        "best_iteration": int(booster.best_iteration),
+        "train_seconds": round(train_seconds, 3),
+        "metrics": metrics,
+        # Only shipped back to the parent when it will be saved
+        "model": booster.model_to_string(num_iteration=booster.best_iteration) if settings["keep_model"] else None,
+    }
+
+
+def main() -> None:
+    parser = add_data_args(argparse.ArgumentParser(description="Parallel LightGBM ranker sweep"))
+    parser.add_argument("--space", type=Path, default=None, help="JSON search space (default: built-in grid)")
+    parser.add_argument("--n-trials", type=int, default=None, help="Random subset of the grid (default: all)")
+    parser.add_argument("--threads-per-worker", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=None, help="Default: cores // threads-per-worker")
+    parser.add_argument("--num-boost-round", type=int, default=1000)
+    parser.add_argument("--early-stopping-rounds", type=int, default=50)
+    parser.add_argument("--eval-at", type=int, default=10)
+    parser.add_argument("--rank-by", default=None, help="Metric to rank trials by (default: NDCG@<eval-at>)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save-best", action="store_true", help=f"Also write the best booster to {BEST_MODEL_PATH}")
+    args = parser.parse_args()
+
+    space = json.loads(args.space.read_text()) if args.space else DEFAULT_SPACE
+    trials = expand_space(space, args.n_trials, args.seed)
+    rank_by = args.rank_by or f"NDCG@{args.eval_at}"
+
+    threads = max(1, args.threads_per_worker)
+    workers = args.workers or max(1, (os.cpu_count() or 1) // threads)
+    # Inherited by the spawned workers, so their OpenMP runtime starts with the same cap
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+
+    # Build (or reuse) the binary dataset once; workers only open it
+    data, data_source = load_ranking_data(args)
+    settings = {
+        "eval_at": args.eval_at,
+        "num_boost_round": args.num_boost_round,
+        "early_stopping_rounds": args.early_stopping_rounds,
+        "seed": args.seed,
+        "keep_model": args.save_best,
+    }
+
+    print(f"Sweep: {len(trials)} trials, {workers} workers x {threads} threads, ranking by {rank_by}")
+    t0 = time.perf_counter()
+    results: list[dict] = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as pool:
+        futures = [
+            pool.submit(
+                run_trial, i, hp, dataset_path=str(data.path), threads=threads, settings=settings
+            )
+            for i, hp in enumerate(trials)
+        ]
+        for fut in as_completed(futures):
+            try:
+                r = fut.result()
+            except Exception as e:
+                print(f"  trial failed: {e}")
+                continue
+            results.append(r)
+            print(
+                f"  trial {r['trial']:>3}: {rank_by}={r['metrics'][rank_by]:.5f} "
+                f"iters={r['best_iteration']} ({r['train_seconds']:.1f}s) {r['params']}"
+            )
+    wall_seconds = time.perf_counter() - t0
+
+    results.sort(key=lambda r: r["metrics"][rank_by], reverse=True)
+    if not results:
+        raise RuntimeError("All sweep trials failed")
+
+    if args.save_best:
+        BEST_MODEL_PATH.write_text(results[0]["model"])
+        print("Saved best:", BEST_MODEL_PATH)
+
+    leaderboard = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "data_path": data_source,
+        "dataset_cache": str(data.path),
+        "rows_train": data.meta["rows_train"],
+        "rows_val": data.meta["rows_val"],
+        "rank_by": rank_by,
+        "workers": workers,
+        "threads_per_worker": threads,
+        "wall_seconds": round(wall_seconds, 3),
+        "trials": [
+            {"rank": pos, **{k: v for k, v in r.items() if k != "model"}}
+            for pos, r in enumerate(results, start=1)
+        ],
+    }
+    LEADERBOARD_PATH.parent.mkdir(parents=True, exist_ok=True)
+    LEADERBOARD_PATH.write_text(json.dumps(leaderboard, indent=2))
+
+    print("Leaderboard written to:", LEADERBOARD_PATH)
+    print("Best:", json.dumps(leaderboard["trials"][0], indent=2))
+
+
+if __name__ == "__main__":
+    main()
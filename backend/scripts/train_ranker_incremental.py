@@ -0,0 +1,255 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from pathlib import Path
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import joblib
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+from sklearn.metrics import log_loss, roc_auc_score
+
+from backend.app.features.definitions import RANKER_FEATURES
+from backend.app.ranking.tree_scorer import export_booster, trees_path_for
+from backend.scripts.lgb_dataset_cache import source_version, split_by_time
+from backend.scripts.ranking_dataset import PARTITIONED_V4_DIR, partition_files, read_partitioned
+from backend.scripts.ranking_metrics import GroupedRanking, bootstrap_ci, summarize
+
+# ----------------------------
+# Warm-start incremental retraining of the served LightGBM ranker
+# ----------------------------
+# Continues boosting from the production model (init_model) on only the newest served_date
+# partition(s), under a wall-clock budget. The newest impressions of that slice are held out;
+# the candidate replaces the production model (and gets a model_versions row) only if it is
+# at least as good as the prior model on them.
+#
+# Partitions are daily but runs are hourly, so each promotion records the newest served_at
+# it trained on (STATE_PATH, keyed to the promoted file's sha256, and model_versions.config).
+# The next run only trains on rows after that mark; rows already boosted on are never
+# boosted on again. A model replaced by a full retrain has no mark and starts from scratch.
+
+OUT_DIR = Path("data/models/rankers")
+MODEL_PATH = OUT_DIR / "ranker_lgbm_v2.joblib"   # what the API serves (plus its .trees.npz export)
+METRICS_PATH = OUT_DIR / "ranker_lgbm_v2_incremental_metrics.json"
+STATE_PATH = OUT_DIR / "ranker_lgbm_v2_incremental_state.json"
+
+FEATURES = RANKER_FEATURES
+LABEL = "label"
+K = 10
+PRIMARY_METRIC = f"NDCG@{K}"
+
+
+def newest_partitions(dataset_dir: Path, n: int) -> list[str]:
+    """served_date values of the newest `n` non-empty partitions (oldest first)."""
+    dates = [
+        d.name.split("=", 1)[1]
+        for d in sorted(dataset_dir.glob("served_date=*"))
+        if any(not p.name.startswith(".") for p in d.glob("*.parquet"))
+    ]
+    if not dates:
+        raise FileNotFoundError(f"No served_date partitions under {dataset_dir}")
+    return dates[-n:]
+
+
+def read_trained_through(model_sha256: str) -> str | None:
+    """served_at high-water mark of the production model, if an incremental run produced it."""
+    if not STATE_PATH.exists():
+        return None
+    state = json.loads(STATE_PATH.read_text())
+    return state.get("trained_through") if state.get("model_sha256") == model_sha256 else None
+
+
+def write_trained_through(model_sha256: str, trained_through: str, version_tag: str) -> None:
+    tmp = STATE_PATH.with_name(STATE_PATH.name + ".tmp")
+    tmp.write_text(
+        json.dumps({"model_sha256": model_sha256, "trained_through": trained_through, "version_tag": version_tag})
+    )
+    os.replace(tmp, STATE_PATH)
+
+
+def after_mark(df: pd.DataFrame, trained_through: str | None) -> pd.DataFrame:
+    """Rows served strictly after the mark (all rows when there is none)."""
+    if trained_through is None:
+        return df
+    return df[pd.to_datetime(df["served_at"], utc=True) > pd.to_datetime(trained_through, utc=True)]
+
+
+def time_budget(seconds: float):
+    """Callback that stops boosting once `seconds` have elapsed, keeping the trees built so far."""
+    deadline = time.monotonic() + seconds
+
+    def _callback(env: lgb.callback.CallbackEnv) -> None:
+        if time.monotonic() >= deadline:
+            raise lgb.callback.EarlyStopException(env.iteration, env.evaluation_result_list or [])
+
+    _callback.order = 40
+    return _callback
+
+
+def evaluate(model, X: pd.DataFrame, y: np.ndarray, groups: np.ndarray) -> tuple[dict, dict[str, np.ndarray]]:
+    p = model.predict_proba(X)[:, 1]
+    per_imp = GroupedRanking.from_group_sizes(groups, y).per_group(p, k=K)
+    two_classes = len(np.unique(y)) > 1
+    summary = {
+        "auc": float(roc_auc_score(y, p)) if two_classes else None,
+        "logloss": float(log_loss(y, p, labels=[0, 1])),
+        **summarize(per_imp),
+    }
+    return summary, per_imp
+
+
+def register_ranker(version_tag: str, *, snapshot: str, metrics: dict, config: dict) -> int:
+    """Registers the promoted model in model_versions (component='ranker')."""
+    from backend.app.db import get_conn
+
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO model_versions(component, version_tag, training_data_snapshot, metrics_summary, config)
+                VALUES ('ranker', %s, %s, %s::jsonb, %s::jsonb)
+                ON CONFLICT (component, version_tag) DO UPDATE
+                  SET metrics_summary = EXCLUDED.metrics_summary, config = EXCLUDED.config
+                RETURNING model_version_id;
+                """,
+                (version_tag, snapshot, json.dumps(metrics), json.dumps(config)),
+            )
+            model_version_id = cur.fetchone()[0]
+        conn.commit()
+    return int(model_version_id)
+
+
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _atomic_dump(model, path: Path) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    joblib.dump(model, tmp)
+    os.replace(tmp, path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Warm-start the served LightGBM ranker on the newest partitions")
+    parser.add_argument("--dataset-dir", type=Path, default=PARTITIONED_V4_DIR)
+    parser.add_argument("--partitions", type=int, default=1, help="Number of newest served_date partitions to train on")
+    parser.add_argument("--rounds", type=int, default=50, help="Max trees added on top of the production model")
+    parser.add_argument("--learning-rate", type=float, default=None, help="Default: the production model's")
+    parser.add_argument("--time-budget", type=float, default=300.0, help="Seconds of boosting before stopping early")
+    parser.add_argument("--holdout-fraction", type=float, default=0.2, help="Newest impressions held out for the comparison")
+    parser.add_argument("--min-delta", type=float, default=0.0, help=f"Required {PRIMARY_METRIC} gain over the prior model")
+    parser.add_argument("--dry-run", action="store_true", help="Compare only; never replace the production model")
+    parser.add_argument("--no-register", action="store_true", help="Skip model_versions registration")
+    args = parser.parse_args()
+
+    prior = joblib.load(MODEL_PATH)
+    if list(prior.booster_.feature_name()) != list(FEATURES):
+        raise ValueError(f"Production model features {prior.booster_.feature_name()} != {FEATURES}; retrain from scratch")
+
+    parent_sha256 = _sha256(MODEL_PATH)
+    trained_through = read_trained_through(parent_sha256)
+    dates = newest_partitions(args.dataset_dir, args.partitions)
+    if trained_through is not None:
+        # Partitions before the mark's day hold nothing new
+        dates = [d for d in dates if d >= trained_through[:10]] or dates[-1:]
+    files = partition_files(args.dataset_dir, since=dates[0], until=dates[-1])
+    df = after_mark(read_partitioned(args.dataset_dir, since=dates[0], until=dates[-1]), trained_through)
+    if df.empty:
+        print(f"No rows served after {trained_through} in {dates}; nothing to train on")
+        return
+    (X_tr, y_tr, _), (X_ho, y_ho, g_ho), span = split_by_time(
+        df, FEATURES, LABEL, args.holdout_fraction, dtype=np.float64
+    )
+    if len(y_tr) == 0 or len(g_ho) == 0:
+        raise ValueError(f"Not enough impressions in {dates} to hold out {args.holdout_fraction:.0%}")
+    X_tr = pd.DataFrame(X_tr, columns=FEATURES)
+    X_ho = pd.DataFrame(X_ho, columns=FEATURES)
+
+    params = {**prior.get_params(), "n_estimators": args.rounds, "verbose": -1}
+    if args.learning_rate is not None:
+        params["learning_rate"] = args.learning_rate
+    candidate = lgb.LGBMClassifier(**params)
+
+    t0 = time.perf_counter()
+    candidate.fit(X_tr, y_tr, init_model=prior.booster_, callbacks=[time_budget(args.time_budget)])
+    train_seconds = time.perf_counter() - t0
+    trees_added = candidate.booster_.num_trees() - prior.booster_.num_trees()
+
+    prior_metrics, prior_pg = evaluate(prior, X_ho, y_ho, g_ho)
+    cand_metrics, cand_pg = evaluate(candidate, X_ho, y_ho, g_ho)
+    delta = cand_metrics[PRIMARY_METRIC] - prior_metrics[PRIMARY_METRIC]
+    # Same impressions under both models, so this is a paired CI
+    delta_ci = bootstrap_ci({"delta": cand_pg[PRIMARY_METRIC] - prior_pg[PRIMARY_METRIC]})["delta"]
+    promote = delta >= args.min_delta and trees_added > 0
+
+    version_tag = "lgbm_v2-incr-" + datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "version_tag": version_tag,
+        "parent_sha256": parent_sha256,
+        "partitions": dates,
+        "trained_after": trained_through,
+        "source_version": source_version(files),
+        **span,
+        "rows_train": int(len(y_tr)),
+        "rows_holdout": int(len(y_ho)),
+        "impressions_holdout": int(len(g_ho)),
+        "trees_prior": int(prior.booster_.num_trees()),
+        "trees_added": int(trees_added),
+        "time_budget_seconds": args.time_budget,
+        "train_seconds": round(train_seconds, 3),
+        "holdout_prior": prior_metrics,
+        "holdout_candidate": cand_metrics,
+        f"delta_{PRIMARY_METRIC}": delta,
+        f"delta_{PRIMARY_METRIC}_ci95": list(delta_ci),
+        "min_delta": args.min_delta,
+        "promoted": bool(promote and not args.dry_run),
+    }
+
+    if promote and not args.dry_run:
+        _atomic_dump(candidate, MODEL_PATH)
+        write_trained_through(_sha256(MODEL_PATH), span["train_to"], version_tag)
+        # Written after the joblib, so the API treats it as current
+        report["tree_export"] = export_booster(
+            candidate.booster_, trees_path_for(MODEL_PATH), X_ho.to_numpy(dtype=np.float64)
+        )
+        print("Promoted:", MODEL_PATH)
+
+        if not args.no_register:
+            try:
+                report["model_version_id"] = register_ranker(
+                    version_tag,
+                    snapshot=report["source_version"],
+                    metrics={"holdout": cand_metrics, "holdout_prior": prior_metrics, "partitions": dates},
+                    config={
+                        "features": FEATURES,
+                        "params": {k: v for k, v in params.items() if v is not None},
+                        "parent_sha256": report["parent_sha256"],
+                        "trained_after": trained_through,
+                        "trained_through": span["train_to"],
+                        "trees": int(candidate.booster_.num_trees()),
+                    },
+                )
+                print(f"Registered model_versions(ranker) id={report['model_version_id']}")
+            except Exception as e:
+                print(f"WARNING: could not register ranker in model_versions: {e}")
+    else:
+        reason = "dry run" if promote else f"{PRIMARY_METRIC} delta {delta:+.5f} < {args.min_delta}"
+        print(f"Kept production model ({reason})")
+
+    METRICS_PATH.parent.mkdir(parents=True, exist_ok=True)
+    METRICS_PATH.write_text(json.dumps(report, indent=2))
+    print("Metrics:", json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
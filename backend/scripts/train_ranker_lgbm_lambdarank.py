@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+from pathlib import Path
+import argparse
+import json
+import time
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+from sklearn.metrics import roc_auc_score
+
+from backend.app.features.definitions import RANKER_FEATURES
+from backend.app.ranking.tree_scorer import export_booster, trees_path_for
+from backend.scripts.lgb_dataset_cache import CACHE_DIR, load_or_build, source_version
+from backend.scripts.ranking_dataset import PARTITIONED_V4_DIR, partition_files, read_partitioned
+from backend.scripts.ranking_metrics import GroupedRanking, bootstrap_ci
+
+DATA_PATH = Path("data/processed/ranking/ranking_dataset_v4.parquet")
+OUT_DIR = Path("data/models/rankers")
+OUT_DIR.mkdir(parents=True, exist_ok=True)
+
+MODEL_PATH = OUT_DIR / "ranker_lgbm_lambdarank.txt"
+METRICS_PATH = OUT_DIR / "ranker_lgbm_lambdarank_metrics.json"
+
+FEATURES = RANKER_FEATURES
+LABEL = "label"
+# Columns needed to build groups and the time split
+KEY_COLUMNS = ["impression_id", "served_at", "position"]
+
+
+def add_data_args(parser: argparse.ArgumentParser) -> argparse.ArgumentParser:
+    parser.add_argument(
+        "--partitioned",
+        action="store_true",
+        help=f"Read the incremental served_date-partitioned dataset ({PARTITIONED_V4_DIR}) instead of {DATA_PATH}",
+    )
+    parser.add_argument("--since", default=None, help="First served_date to read (YYYY-MM-DD, --partitioned only)")
+    parser.add_argument("--until", default=None, help="Last served_date to read (YYYY-MM-DD, --partitioned only)")
+    parser.add_argument("--val-fraction", type=float, default=0.2, help="Most recent share of impressions held out")
+    parser.add_argument("--rebuild-cache", action="store_true", help=f"Ignore cached datasets under {CACHE_DIR}")
+    return parser
+
+
+def load_ranking_data(args: argparse.Namespace):
+    """Cached grouped datasets for the selected source (built on first use)."""
+    columns = list(dict.fromkeys(KEY_COLUMNS + FEATURES + [LABEL]))
+    if args.partitioned:
+        files = partition_files(since=args.since, until=args.until)
+        data_source = f"{PARTITIONED_V4_DIR} [{args.since or '*'} .. {args.until or '*'}]"
+
+        def load_df() -> pd.DataFrame:
+            return read_partitioned(since=args.since, until=args.until, columns=columns)
+
+    else:
+        files = [DATA_PATH]
+        data_source = str(DATA_PATH)
+
+        def load_df() -> pd.DataFrame:
+            return pd.read_parquet(DATA_PATH, columns=columns)
+
+    t0 = time.perf_counter()
+    data = load_or_build(
+        load_df,
+        version=source_version(files),
+        features=FEATURES,
+        label=LABEL,
+        val_fraction=args.val_fraction,
+        rebuild=args.rebuild_cache,
+    )
+    print(
+        f"Dataset {'loaded from cache' if data.from_cache else 'built'}: {data.path} "
+        f"({time.perf_counter() - t0:.2f}s)"
+    )
+    return data, data_source
+
+
+def main():
+    parser = add_data_args(argparse.ArgumentParser())
+    parser.add_argument("--learning-rate", type=float, default=0.05)
+    parser.add_argument("--num-leaves", type=int, default=31)
+    parser.add_argument("--min-data-in-leaf", type=int, default=50)
+    parser.add_argument("--feature-fraction", type=float, default=0.9)
+    parser.add_argument("--num-boost-round", type=int, default=1000)
+    parser.add_argument("--early-stopping-rounds", type=int, default=50)
+    parser.add_argument("--eval-at", type=int, default=10)
+    args = parser.parse_args()
+
+    data, data_source = load_ranking_data(args)
+
+    params = {
+        "objective": "lambdarank",
+        "metric": "ndcg",
+        "eval_at": [args.eval_at],
+        "learning_rate": args.learning_rate,
+        "num_leaves": args.num_leaves,
+        "min_data_in_leaf": args.min_data_in_leaf,
+        "feature_fraction": args.feature_fraction,
+        "seed": 42,
+        "verbosity": -1,
+    }
+
+    t0 = time.perf_counter()
+    booster = lgb.train(
+        params,
+        data.train,
+        num_boost_round=args.num_boost_round,
+        valid_sets=[data.valid],
+        valid_names=["val"],
+        callbacks=[
+            lgb.early_stopping(args.early_stopping_rounds),
+            lgb.log_evaluation(50),
+        ],
+    )
+    train_seconds = time.perf_counter() - t0
+
+    s_val = booster.predict(data.X_val, num_iteration=booster.best_iteration)
+    auc = roc_auc_score(data.y_val, s_val) if len(np.unique(data.y_val)) > 1 else float("nan")
+
+    k = args.eval_at
+    per_imp = GroupedRanking.from_group_sizes(data.val_groups, data.y_val).per_group(s_val, k=k)
+    ci = bootstrap_ci(per_imp)
+
+    metrics = {
+        "data_path": data_source,
+        "dataset_cache": str(data.path),
+        "dataset_from_cache": data.from_cache,
+        "features": FEATURES,
+        "params": params,
+        "best_iteration": int(booster.best_iteration),
+        "train_seconds": round(train_seconds, 3),
+        **{k: data.meta[k] for k in ("rows_train", "rows_val", "clicks_train", "clicks_val")},
+        "impressions_val": data.meta["impressions_val"],
+        "auc_val": float(auc) if auc == auc else None,
+        f"ndcg{k}_val": float(per_imp[f"NDCG@{k}"].mean()),
+        f"mrr{k}_val": float(per_imp[f"MRR@{k}"].mean()),
+        f"ndcg{k}_val_ci95": list(ci[f"NDCG@{k}"]),
+        f"mrr{k}_val_ci95": list(ci[f"MRR@{k}"]),
+    }
+
+    booster.save_model(str(MODEL_PATH), num_iteration=booster.best_iteration)
+    metrics["tree_export"] = export_booster(
+        booster, trees_path_for(MODEL_PATH), data.X_val, num_iteration=booster.best_iteration
+    )
+    METRICS_PATH.write_text(json.dumps(metrics, indent=2))
+
+    print("Saved:", MODEL_PATH)
+    print("Metrics:", json.dumps(metrics, indent=2))
+
+
+if __name__ == "__main__":
+    main()
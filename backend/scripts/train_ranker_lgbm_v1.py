@@ -6,6 +6,8 @@ import joblib
 import lightgbm as lgb
 from sklearn.metrics import roc_auc_score
 
+from backend.scripts.ranking_metrics import GroupedRanking
+
 DATA_PATH = Path("data/processed/ranking/ranking_dataset_v3.parquet")
 OUT_DIR = Path("data/models/rankers")
 OUT_DIR.mkdir(parents=True, exist_ok=True)
@@ -17,45 +19,6 @@ def time_split(df: pd.DataFrame, val_frac: float = 0.2):
     return df.iloc[:split_idx].copy(), df.iloc[split_idx:].copy()
 
 
-def ndcg_at_k(labels, scores, k=10):
-    order = np.argsort(-scores)[:k]
-    gains = (2 ** labels[order] - 1)
-    discounts = 1.0 / np.log2(np.arange(2, 2 + len(order)))
-    dcg = np.sum(gains * discounts)
-
-    ideal_order = np.argsort(-labels)[:k]
-    ideal_gains = (2 ** labels[ideal_order] - 1)
-    ideal_dcg = np.sum(ideal_gains * discounts[:len(ideal_order)])
-
-    return 0.0 if ideal_dcg == 0 else float(dcg / ideal_dcg)
-
-
-def mean_ndcg(df, k=10):
-    scores = []
-    for _, g in df.groupby("impression_id"):
-        y = g["label"].to_numpy(dtype=np.int32)
-        s = g["pred_score"].to_numpy(dtype=np.float32)
-        scores.append(ndcg_at_k(y, s, k=k))
-    return float(np.mean(scores)) if scores else 0.0
-
-
-def mrr_at_k(labels, scores, k=10):
-    order = np.argsort(-scores)[:k]
-    for rank, idx in enumerate(order, start=1):
-        if labels[idx] == 1:
-            return 1.0 / rank
-    return 0.0
-
-
-def mean_mrr(df, k=10):
-    scores = []
-    for _, g in df.groupby("impression_id"):
-        y = g["label"].to_numpy(dtype=np.int32)
-        s = g["pred_score"].to_numpy(dtype=np.float32)
-        scores.append(mrr_at_k(y, s, k=k))
-    return float(np.mean(scores)) if scores else 0.0
-
-
 def main():
     df = pd.read_parquet(DATA_PATH)
     df["served_at"] = pd.to_datetime(df["served_at"], utc=True)
@@ -93,11 +56,11 @@ def main():
     val_pred = model.predict_proba(X_val)[:, 1]
     val_auc = roc_auc_score(y_val, val_pred) if len(np.unique(y_val)) > 1 else float("nan")
 
-    val_scored = val_df.copy()
-    val_scored["pred_score"] = val_pred.astype(np.float32)
-
-    val_ndcg10 = mean_ndcg(val_scored, k=10)
-    val_mrr10 = mean_mrr(val_scored, k=10)
+    val_metrics = GroupedRanking(val_df["impression_id"], y_val).evaluate(
+        {"model": val_pred}, k=10, tiebreak=val_df["position"]
+    )["model"]
+    val_ndcg10 = val_metrics["NDCG@10"]
+    val_mrr10 = val_metrics["MRR@10"]
 
     print("=== LightGBM Ranker v1 (features: retrieval_score, position) ===")
     print("Train rows:", len(train_df), " Val rows:", len(val_df))
@@ -1,12 +1,18 @@
 from __future__ import annotations
 
 from pathlib import Path
+import argparse
 import json
-import numpy as np
 import pandas as pd
 from sklearn.metrics import roc_auc_score
 import lightgbm as lgb
 import joblib
+import numpy as np
+
+from backend.app.features.definitions import RANKER_FEATURES
+from backend.app.ranking.tree_scorer import export_booster, trees_path_for
+from backend.scripts.ranking_dataset import PARTITIONED_V4_DIR, read_partitioned
+from backend.scripts.ranking_metrics import GroupedRanking, bootstrap_ci
 
 DATA_PATH = Path("data/processed/ranking/ranking_dataset_v4.parquet")
 OUT_DIR = Path("data/models/rankers")
@@ -15,30 +21,28 @@ OUT_DIR.mkdir(parents=True, exist_ok=True)
 MODEL_PATH = OUT_DIR / "ranker_lgbm_v2.joblib"
 METRICS_PATH = OUT_DIR / "ranker_lgbm_v2_metrics.json"
 
-FEATURES = ["retrieval_score", "position", "is_warm_user", "user_click_count", "item_age_hours"]
+# Same definition (and order) the online ranker builds its inputs from
+FEATURES = RANKER_FEATURES
 LABEL = "label"
 
 
-def ndcg_at_k(labels, scores, k=10):
-    order = np.argsort(scores)[::-1][:k]
-    gains = np.array(labels)[order]
-    discounts = 1.0 / np.log2(np.arange(2, 2 + len(gains)))
-    dcg = float(np.sum(gains * discounts))
-    ideal = np.sort(labels)[::-1][:k]
-    ideal_dcg = float(np.sum(np.array(ideal) * discounts[: len(ideal)]))
-    return dcg / ideal_dcg if ideal_dcg > 0 else 0.0
-
-
-def mrr_at_k(labels, scores, k=10):
-    order = np.argsort(scores)[::-1][:k]
-    for rank, idx in enumerate(order, start=1):
-        if labels[idx] == 1:
-            return 1.0 / rank
-    return 0.0
-
-
 def main():
-    df = pd.read_parquet(DATA_PATH).copy()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--partitioned",
+        action="store_true",
+        help=f"Read the incremental served_date-partitioned dataset ({PARTITIONED_V4_DIR}) instead of {DATA_PATH}",
+    )
+    parser.add_argument("--since", default=None, help="First served_date to read (YYYY-MM-DD, --partitioned only)")
+    parser.add_argument("--until", default=None, help="Last served_date to read (YYYY-MM-DD, --partitioned only)")
+    args = parser.parse_args()
+
+    if args.partitioned:
+        df = read_partitioned(since=args.since, until=args.until)
+        data_source = f"{PARTITIONED_V4_DIR} [{args.since or '*'} .. {args.until or '*'}]"
+    else:
+        df = pd.read_parquet(DATA_PATH).copy()
+        data_source = str(DATA_PATH)
 
     # Clean
     df = df.dropna(subset=[LABEL])
@@ -70,27 +74,28 @@ def main():
 
     auc = roc_auc_score(y_val, p_val) if y_val.nunique() > 1 else float("nan")
 
-    ndcgs, mrrs = [], []
-    val_scored = val_df.copy()
-    val_scored["p"] = p_val
-
-    for _imp_id, g in val_scored.groupby("impression_id"):
-        ndcgs.append(ndcg_at_k(g[LABEL].tolist(), g["p"].tolist(), k=10))
-        mrrs.append(mrr_at_k(g[LABEL].tolist(), g["p"].tolist(), k=10))
+    per_imp = GroupedRanking(val_df["impression_id"], y_val).per_group(p_val, k=10, tiebreak=val_df["position"])
+    ci = bootstrap_ci(per_imp)
 
     metrics = {
-        "data_path": str(DATA_PATH),
+        "data_path": data_source,
         "features": FEATURES,
         "rows_train": int(len(train_df)),
         "rows_val": int(len(val_df)),
         "clicks_train": int(y_train.sum()),
         "clicks_val": int(y_val.sum()),
         "auc_val": float(auc) if auc == auc else None,
-        "ndcg10_val": float(np.mean(ndcgs)) if ndcgs else 0.0,
-        "mrr10_val": float(np.mean(mrrs)) if mrrs else 0.0,
+        "ndcg10_val": float(per_imp["NDCG@10"].mean()) if len(per_imp["NDCG@10"]) else 0.0,
+        "mrr10_val": float(per_imp["MRR@10"].mean()) if len(per_imp["MRR@10"]) else 0.0,
+        "ndcg10_val_ci95": list(ci["NDCG@10"]),
+        "mrr10_val_ci95": list(ci["MRR@10"]),
     }
 
     joblib.dump(clf, MODEL_PATH)
+    # Numpy export served in place of the joblib model; verified bit-exact on the validation rows
+    metrics["tree_export"] = export_booster(
+        clf.booster_, trees_path_for(MODEL_PATH), X_val.to_numpy(dtype=np.float64)
+    )
     METRICS_PATH.write_text(json.dumps(metrics, indent=2))
 
     print("Saved:", MODEL_PATH)
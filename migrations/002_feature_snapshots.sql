@@ -0,0 +1,19 @@
+BEGIN;
+
+-- Step 1: feature snapshots on the impression log
+-- Why: the ranker's online features are logged exactly as served, so training
+-- reads point-in-time values instead of recomputing them from today's tables.
+
+ALTER TABLE impressions_served
+  ADD COLUMN IF NOT EXISTS user_click_count INT,
+  ADD COLUMN IF NOT EXISTS is_warm_user SMALLINT;
+
+ALTER TABLE impression_items
+  ADD COLUMN IF NOT EXISTS item_age_hours REAL;
+
+-- Step 2: index for the point-in-time fallback (rows logged before this migration)
+-- Why: counts clicks per anonymous_id strictly before each served_at.
+
+CREATE INDEX IF NOT EXISTS idx_clicks_impression_clicked_at ON clicks(impression_id, clicked_at);
+
+COMMIT;
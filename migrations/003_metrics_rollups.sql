@@ -0,0 +1,56 @@
+BEGIN;
+
+-- Step 1: dwell histogram buckets
+-- Why: dwell percentiles cannot be summed across hours, histograms can. Every rollup row
+-- stores counts for these fixed buckets (bucket b covers [lower_ms(b), lower_ms(b+1)),
+-- the last one is open-ended), so any window is the element-wise sum of its hours.
+
+CREATE TABLE IF NOT EXISTS metrics_dwell_buckets (
+  bucket INT PRIMARY KEY,   -- 1-based, matches the dwell_hist array index
+  lower_ms INT NOT NULL UNIQUE
+);
+
+INSERT INTO metrics_dwell_buckets(bucket, lower_ms) VALUES
+  (1, 0), (2, 500), (3, 1000), (4, 2000), (5, 3000), (6, 5000), (7, 7500), (8, 10000),
+  (9, 15000), (10, 20000), (11, 30000), (12, 45000), (13, 60000), (14, 90000),
+  (15, 120000), (16, 180000), (17, 300000), (18, 600000)
+ON CONFLICT DO NOTHING;
+
+-- Step 2: hourly serving metrics per surface / locale
+-- Why: the metrics page reads these instead of scanning impressions_served / clicks.
+-- Impressions are bucketed by served_at, clicks (and dwell) by clicked_at.
+-- surface / locale are '' when the impression had none (part of the primary key).
+
+CREATE TABLE IF NOT EXISTS metrics_hourly (
+  hour TIMESTAMPTZ NOT NULL,
+  surface TEXT NOT NULL DEFAULT '',
+  locale TEXT NOT NULL DEFAULT '',
+  impressions BIGINT NOT NULL DEFAULT 0,
+  clicks BIGINT NOT NULL DEFAULT 0,
+  dwell_count BIGINT NOT NULL DEFAULT 0,     -- clicks with a dwell_ms
+  dwell_sum_ms BIGINT NOT NULL DEFAULT 0,
+  dwell_max_ms INT,
+  dwell_hist BIGINT[] NOT NULL,              -- counts per metrics_dwell_buckets.bucket
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (hour, surface, locale)
+);
+
+-- Step 3: hourly clicks per item (top clicked items)
+
+CREATE TABLE IF NOT EXISTS metrics_item_clicks_hourly (
+  hour TIMESTAMPTZ NOT NULL,
+  item_id TEXT NOT NULL,
+  clicks BIGINT NOT NULL,
+  PRIMARY KEY (hour, item_id)
+);
+
+-- Step 4: rollup job progress
+-- Why: each run recomputes only the hours since its last run (plus a lateness margin).
+
+CREATE TABLE IF NOT EXISTS metrics_rollup_state (
+  job TEXT PRIMARY KEY,
+  rolled_up_to TIMESTAMPTZ NOT NULL,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+COMMIT;
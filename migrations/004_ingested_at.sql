@@ -0,0 +1,22 @@
+BEGIN;
+
+-- Step 1: load time on clicks / impressions
+-- Why: with the event log (EVENT_LOG_ENABLED=1) rows keep the API's clicked_at / served_at
+-- but are inserted later by the loader (batch lag, clicks deferred until their impression
+-- lands). Tails that resume from "the last time I looked" (feature store, online LR) read
+-- ingested_at, the time the row was written, so late rows are not skipped.
+-- The column is added without a default first, so existing rows stay NULL (no table
+-- rewrite) and are never re-read by a tail; new rows get now().
+
+ALTER TABLE clicks ADD COLUMN IF NOT EXISTS ingested_at TIMESTAMPTZ;
+ALTER TABLE clicks ALTER COLUMN ingested_at SET DEFAULT now();
+
+ALTER TABLE impressions_served ADD COLUMN IF NOT EXISTS ingested_at TIMESTAMPTZ;
+ALTER TABLE impressions_served ALTER COLUMN ingested_at SET DEFAULT now();
+
+-- Step 2: indexes for the tails
+
+CREATE INDEX IF NOT EXISTS idx_clicks_ingested_at ON clicks(ingested_at);
+CREATE INDEX IF NOT EXISTS idx_impressions_ingested_at ON impressions_served(ingested_at);
+
+COMMIT;
@@ -0,0 +1,15 @@
+BEGIN;
+
+-- Step 1: the anonymous_id a registered user's traffic is logged under
+-- Why: a bearer token on /recommendations fills in the caller's anonymous_id (features,
+-- click history). It has to come from the user's own row, not be inferred from past
+-- impressions. Existing users get the id they were already given when they had no
+-- impressions (user_<user_id>); /auth/register sets it for new ones.
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS anonymous_id TEXT;
+
+UPDATE users SET anonymous_id = 'user_' || user_id WHERE anonymous_id IS NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_anonymous_id ON users(anonymous_id);
+
+COMMIT;
@@ -1,9 +1,16 @@
 import os
+import threading
 import requests
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional
 
 DEFAULT_TIMEOUT = 15
 
+# Client-side click buffering (POST /click/batch)
+CLICK_BATCH_SIZE = int(os.getenv("CLICK_BATCH_SIZE", "50"))
+CLICK_FLUSH_INTERVAL_S = float(os.getenv("CLICK_FLUSH_INTERVAL_S", "2"))
+CLICK_BUFFER_MAX = 10_000  # events kept for retry while the backend is unreachable
+MAX_CLICK_BATCH = 1000  # server limit per POST /click/batch (backend/app/schemas.py)
+
 class ApiClient:
     def __init__(self):
         self.base_url = os.getenv("BACKEND_URL", "http://localhost:8000").rstrip("/")
@@ -23,7 +30,136 @@ class ApiClient:
         r.raise_for_status()
         return r.json()
 
+    def log_clicks(self, events: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """POST /click/batch: {"ok", "duplicate", "invalid", "results": [{index, status, detail}]}."""
+        r = requests.post(self._url("/click/batch"), json={"clicks": events}, timeout=DEFAULT_TIMEOUT)
+        r.raise_for_status()
+        return r.json()
+
     def get_recent_clicks(self, anonymous_id: str, limit: int = 1) -> Any:
         r = requests.get(self._url(f"/users/{anonymous_id}/recent_clicks"), params={"limit": limit}, timeout=DEFAULT_TIMEOUT)
         r.raise_for_status()
         return r.json()
+
+    def get_metrics_summary(self, window_hours: int = 24) -> Dict[str, Any]:
+        """GET /metrics/summary: KPIs, dwell percentiles, per-surface segments and top items (server-cached)."""
+        r = requests.get(self._url("/metrics/summary"), params={"window_hours": window_hours}, timeout=DEFAULT_TIMEOUT)
+        r.raise_for_status()
+        return r.json()
+
+    def get_metrics_recent(self, window_hours: int = 24, limit: int = 50) -> Dict[str, Any]:
+        """GET /metrics/recent: {"impressions": {"columns", "rows"}, "clicks": {"columns", "rows"}}."""
+        r = requests.get(
+            self._url("/metrics/recent"),
+            params={"window_hours": window_hours, "limit": limit},
+            timeout=DEFAULT_TIMEOUT,
+        )
+        r.raise_for_status()
+        return r.json()
+
+
+class ClickBuffer:
+    """
+    Collects click events and sends them with POST /click/batch, when `batch_size`
+    events are queued or `flush_interval_s` after the first queued event (whichever
+    comes first). Events from a failed flush are kept and retried with the next one.
+    """
+
+    def __init__(
+        self,
+        client: Optional[ApiClient] = None,
+        batch_size: int = CLICK_BATCH_SIZE,
+        flush_interval_s: float = CLICK_FLUSH_INTERVAL_S,
+    ):
+        self.client = client or ApiClient()
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self._events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # one request in flight at a time
+        self._timer: Optional[threading.Timer] = None
+        self.last_error: Optional[str] = None
+        self.stats = {"sent": 0, "ok": 0, "duplicate": 0, "invalid": 0, "failed_flushes": 0, "dropped": 0}
+
+    def add(self, event: Dict[str, Any]) -> None:
+        with self._lock:
+            self._events.append(event)
+            overflow = len(self._events) - CLICK_BUFFER_MAX
+            if overflow > 0:
+                del self._events[:overflow]
+                self.stats["dropped"] += overflow
+            full = len(self._events) >= self.batch_size
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval_s, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._events)
+
+    def flush(self) -> Optional[Dict[str, Any]]:
+        """
+        Sends everything queued, in requests of at most min(batch_size, MAX_CLICK_BATCH)
+        events; returns the summed counts of the accepted requests (None if nothing was
+        accepted). On a network error or 5xx the unsent events are kept for the next flush;
+        a 4xx means the server will never accept that request, so its events are dropped.
+        """
+        with self._flush_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                pending, self._events = self._events, []
+            if not pending:
+                return None
+
+            chunk_size = max(1, min(self.batch_size, MAX_CLICK_BATCH))
+            total: Optional[Dict[str, Any]] = None
+            sent = 0
+            self.last_error = None
+            while sent < len(pending):
+                batch = pending[sent : sent + chunk_size]
+                try:
+                    resp = self.client.log_clicks(batch)
+                except Exception as e:
+                    self.last_error = str(e)
+                    status = getattr(getattr(e, "response", None), "status_code", None)
+                    if status is not None and 400 <= status < 500:
+                        sent += len(batch)
+                        self.stats["dropped"] += len(batch)
+                        continue
+                    with self._lock:
+                        # Keep order: unsent events go back in front of anything queued meanwhile
+                        self._events = pending[sent:] + self._events
+                        self.stats["failed_flushes"] += 1
+                        if self._timer is None:
+                            self._timer = threading.Timer(self.flush_interval_s, self.flush)
+                            self._timer.daemon = True
+                            self._timer.start()
+                    return total
+
+                self.stats["sent"] += len(batch)
+                total = total or {"ok": 0, "duplicate": 0, "invalid": 0, "results": []}
+                for key in ("ok", "duplicate", "invalid"):
+                    self.stats[key] += int(resp.get(key, 0))
+                    total[key] += int(resp.get(key, 0))
+                for r in resp.get("results", []):
+                    total["results"].append({**r, "index": sent + int(r.get("index", 0))})
+                sent += len(batch)
+            return total
+
+
+_CLICK_BUFFER: Optional[ClickBuffer] = None
+_CLICK_BUFFER_LOCK = threading.Lock()
+
+
+def get_click_buffer() -> ClickBuffer:
+    """Process-wide buffer (Streamlit reruns the page script, but modules stay loaded)."""
+    global _CLICK_BUFFER
+    with _CLICK_BUFFER_LOCK:
+        if _CLICK_BUFFER is None:
+            _CLICK_BUFFER = ClickBuffer()
+        return _CLICK_BUFFER
@@ -1,7 +1,7 @@
 import json
 import streamlit as st
 
-from api_client import ApiClient
+from api_client import ApiClient, get_click_buffer
 from state import ensure_state, start_dwell, get_dwell_ms
 
 # ---------- Login guard ----------
@@ -12,6 +12,7 @@ if not st.session_state.get("anonymous_id"):
 # ---------- Init ----------
 ensure_state()
 api = ApiClient()
+clicks = get_click_buffer()
 
 st.title("Browse")
 st.caption(f"Active user: `{st.session_state.anonymous_id}`")
@@ -138,6 +139,11 @@ if refresh or not st.session_state.last_recs:
         "locale": locale,
     }
 
+    # Queued clicks must be in before the next request sees this user as warm/cold
+    clicks.flush()
+    if clicks.last_error:
+        st.warning(f"/click/batch failed, {clicks.pending()} click(s) will be retried: {clicks.last_error}")
+
     try:
         resp = api.recommend(payload)
         st.session_state.last_impression_id = resp.get("impression_id")
@@ -216,9 +222,6 @@ for pos, it in enumerate(items):
                 "open_type": "card",
             }
 
-            try:
-                api.log_click(click_payload)
-                st.success(f"Click logged (dwell_ms={dwell_ms})")
-                st.info("Click **Get recommendations** again to refresh warm-user behavior.")
-            except Exception as e:
-                st.error(f"/click failed: {e}")
+            clicks.add(click_payload)
+            st.success(f"Click queued (dwell_ms={dwell_ms}, {clicks.pending()} pending)")
+            st.info("Click **Get recommendations** again to refresh warm-user behavior.")
@@ -1,8 +1,8 @@
 import os
 import json
-import pandas as pd
+import time
 import psycopg
-from psycopg.rows import dict_row
+import pyarrow.parquet as pq
 
 NEWS_PARQUET = os.path.join(os.getcwd(), "data", "processed", "news.parquet")
 
@@ -12,85 +12,136 @@ DB_NAME = os.getenv("DB_NAME", "newsrec")
 DB_USER = os.getenv("DB_USER", "newsrec")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "newsrec")
 
-BATCH_SIZE = int(os.getenv("BATCH_SIZE", "2000"))
-
-UPSERT_SQL = """
-INSERT INTO items (item_id, category, subcategory, title, abstract, entities)
-VALUES (%s, %s, %s, %s, %s, %s::jsonb)
-ON CONFLICT (item_id) DO UPDATE SET
-  category    = EXCLUDED.category,
-  subcategory = EXCLUDED.subcategory,
-  title       = EXCLUDED.title,
-  abstract    = EXCLUDED.abstract,
-  entities    = EXCLUDED.entities;
+# Rows per parquet record batch streamed into COPY
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "50000"))
+
+TEXT_COLUMNS = ["news_id", "category", "subcategory", "title", "abstract"]
+ENTITY_COLUMNS = ["title_entities_raw", "abstract_entities_raw"]
+
+# Session-private temp table (no WAL, invisible to concurrent loads), dropped at commit.
+# seq records input order so duplicate item_ids resolve deterministically.
+STAGING_DDL = """
+CREATE TEMP TABLE items_staging (
+  seq BIGINT GENERATED ALWAYS AS IDENTITY,
+  item_id TEXT,
+  category TEXT,
+  subcategory TEXT,
+  title TEXT,
+  abstract TEXT,
+  entities JSONB
+) ON COMMIT DROP;
 """
 
-def safe_entities(row) -> dict:
+COPY_SQL = "COPY items_staging (item_id, category, subcategory, title, abstract, entities) FROM STDIN"
+
+# One set-based upsert; rows whose content is unchanged are skipped (no dead tuples, no WAL).
+# For duplicate item_ids the last occurrence in the parquet wins.
+MERGE_SQL = """
+WITH latest AS (
+  SELECT DISTINCT ON (item_id) item_id, category, subcategory, title, abstract, entities
+  FROM items_staging
+  ORDER BY item_id, seq DESC
+),
+upserted AS (
+  INSERT INTO items (item_id, category, subcategory, title, abstract, entities)
+  SELECT item_id, category, subcategory, title, abstract, entities
+  FROM latest
+  ON CONFLICT (item_id) DO UPDATE SET
+    category    = EXCLUDED.category,
+    subcategory = EXCLUDED.subcategory,
+    title       = EXCLUDED.title,
+    abstract    = EXCLUDED.abstract,
+    entities    = EXCLUDED.entities
+  WHERE (items.category, items.subcategory, items.title, items.abstract, items.entities)
+        IS DISTINCT FROM
+        (EXCLUDED.category, EXCLUDED.subcategory, EXCLUDED.title, EXCLUDED.abstract, EXCLUDED.entities)
+  RETURNING (xmax = 0) AS inserted
+)
+SELECT
+  (SELECT COUNT(*) FROM latest) AS distinct_items,
+  COUNT(*) FILTER (WHERE inserted) AS inserted,
+  COUNT(*) FILTER (WHERE NOT inserted) AS updated
+FROM upserted;
+"""
+
+
+def entities_json(title_raw, abstract_raw) -> str:
     # Your parquet has *_entities_raw columns; store both under one json field.
-    # If they are already dict-like, keep them; if not, store as string.
     out = {}
-    for k in ["title_entities_raw", "abstract_entities_raw"]:
-        if k in row and row[k] is not None:
-            try:
-                # could be dict/list already
-                if isinstance(row[k], (dict, list)):
-                    out[k] = row[k]
-                else:
-                    out[k] = row[k]
-            except Exception:
-                out[k] = str(row[k])
-    return out
+    if title_raw is not None:
+        out["title_entities_raw"] = title_raw
+    if abstract_raw is not None:
+        out["abstract_entities_raw"] = abstract_raw
+    return json.dumps(out)
+
+
+def iter_rows(batch):
+    cols = batch.to_pydict()
+    n = batch.num_rows
+    empty = [None] * n
+    title_ents = cols.get("title_entities_raw", empty)
+    abstract_ents = cols.get("abstract_entities_raw", empty)
+
+    for i, news_id in enumerate(cols["news_id"]):
+        yield (
+            str(news_id),  # item_id
+            cols["category"][i] or "",
+            cols["subcategory"][i] or "",
+            cols["title"][i] or "",
+            cols["abstract"][i] or "",
+            entities_json(title_ents[i], abstract_ents[i]),
+        )
+
 
 def main():
     if not os.path.exists(NEWS_PARQUET):
         raise FileNotFoundError(f"Missing {NEWS_PARQUET}")
 
-    print(f" Reading: {NEWS_PARQUET}")
-    df = pd.read_parquet(NEWS_PARQUET)
-
-    needed = ["news_id", "category", "subcategory", "title", "abstract"]
-    for col in needed:
-        if col not in df.columns:
+    pf = pq.ParquetFile(NEWS_PARQUET)
+    available = set(pf.schema_arrow.names)
+    for col in TEXT_COLUMNS:
+        if col not in available:
             raise ValueError(f"news.parquet missing column: {col}")
+    columns = TEXT_COLUMNS + [c for c in ENTITY_COLUMNS if c in available]
 
-    # Make sure types are safe
-    df["news_id"] = df["news_id"].astype(str)
-    df["category"] = df["category"].fillna("").astype(str)
-    df["subcategory"] = df["subcategory"].fillna("").astype(str)
-    df["title"] = df["title"].fillna("").astype(str)
-    df["abstract"] = df["abstract"].fillna("").astype(str)
+    total = pf.metadata.num_rows
+    print(f" Reading: {NEWS_PARQUET} ({total} rows, batch={BATCH_SIZE})")
 
     dsn = f"host={DB_HOST} port={DB_PORT} dbname={DB_NAME} user={DB_USER} password={DB_PASSWORD}"
     print(f" Connecting to Postgres: {DB_HOST}:{DB_PORT}/{DB_NAME} as {DB_USER}")
 
-    total = len(df)
-    print(f" Upserting {total} items into public.items (batch={BATCH_SIZE})...")
-
-    with psycopg.connect(dsn, row_factory=dict_row) as conn:
+    t0 = time.perf_counter()
+    copied = 0
+    with psycopg.connect(dsn) as conn:
         with conn.cursor() as cur:
-            for start in range(0, total, BATCH_SIZE):
-                batch = df.iloc[start:start+BATCH_SIZE]
-
-                values = []
-                for _, r in batch.iterrows():
-                    entities = safe_entities(r.to_dict())
-                    values.append((
-                        r["news_id"],             # item_id
-                        r["category"],
-                        r["subcategory"],
-                        r["title"],
-                        r["abstract"],
-                        json.dumps(entities),
-                    ))
-
-                cur.executemany(UPSERT_SQL, values)
-
-                if start == 0 or start % (BATCH_SIZE * 10) == 0:
-                    print(f"  progress: {start}/{total}")
+            cur.execute(STAGING_DDL)
+
+            # 1) Stream record batches into the staging table with COPY
+            with cur.copy(COPY_SQL) as copy:
+                for batch in pf.iter_batches(batch_size=BATCH_SIZE, columns=columns):
+                    for row in iter_rows(batch):
+                        copy.write_row(row)
+                    copied += batch.num_rows
+                    print(f"  copied: {copied}/{total}")
+
+            t_copy = time.perf_counter() - t0
+            print(f" COPY done: {copied} rows in {t_copy:.2f}s ({copied / max(t_copy, 1e-9):.0f} rows/sec)")
+
+            # 2) Merge staging -> items in one statement
+            t1 = time.perf_counter()
+            cur.execute(MERGE_SQL)
+            distinct_items, inserted, updated = cur.fetchone()
+            t_merge = time.perf_counter() - t1
+            print(
+                f" MERGE done: inserted={inserted} updated={updated} "
+                f"unchanged={distinct_items - inserted - updated} "
+                f"duplicates={copied - distinct_items} in {t_merge:.2f}s"
+            )
 
         conn.commit()
 
-    print(" DONE. Items loaded/updated successfully.")
+    elapsed = time.perf_counter() - t0
+    print(f" DONE. {copied} items in {elapsed:.2f}s ({copied / max(elapsed, 1e-9):.0f} rows/sec)")
 
 if __name__ == "__main__":
     main()
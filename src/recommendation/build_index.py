@@ -1,13 +1,129 @@
 import os
+import json
+import shutil
+import hashlib
+import argparse
+import uuid
+from datetime import datetime, timezone
 import numpy as np
 
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = int(os.getenv("DB_PORT", "5433"))
+DB_NAME = os.getenv("DB_NAME", "newsrec")
+DB_USER = os.getenv("DB_USER", "newsrec")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "newsrec")
+
+
+def sha256_file(path: str, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def write_bundle(bundles_dir: str, embeddings: np.ndarray, ids: np.ndarray, index, index_type: str) -> tuple[str, dict]:
+    """
+    Writes a versioned bundle directory and returns (version_tag, manifest).
+
+    The bundle is assembled in a hidden temp dir and renamed into place, so a
+    half-written bundle is never visible under its final name. A random suffix keeps
+    tags (and temp dirs) unique across builds started within the same second.
+    """
+    import faiss
+
+    os.makedirs(bundles_dir, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    suffix = uuid.uuid4().hex[:6]
+    tmp_dir = os.path.join(bundles_dir, f".{stamp}-{suffix}.tmp")
+    os.makedirs(tmp_dir)
+
+    np.save(os.path.join(tmp_dir, "news_embeddings.npy"), embeddings)
+    # Fixed-width unicode (not an object array): loads without pickle as one flat buffer
+    np.save(os.path.join(tmp_dir, "news_ids.npy"), np.asarray(ids).astype(str), allow_pickle=False)
+    faiss.write_index(index, os.path.join(tmp_dir, "news_retrieval.index"))
+
+    files = {}
+    for name in ("news_embeddings.npy", "news_ids.npy", "news_retrieval.index"):
+        path = os.path.join(tmp_dir, name)
+        files[name] = {"sha256": sha256_file(path), "bytes": os.path.getsize(path)}
+
+    version_tag = f"{stamp}-{files['news_embeddings.npy']['sha256'][:8]}-{suffix}"
+    manifest = {
+        "version_tag": version_tag,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "count": int(embeddings.shape[0]),
+        "dim": int(embeddings.shape[1]),
+        "index_type": index_type,
+        "normalized": True,
+        "ids_format": "fixed_unicode",
+        "files": files,
+    }
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    final_dir = os.path.join(bundles_dir, version_tag)
+    try:
+        os.replace(tmp_dir, final_dir)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return version_tag, manifest
+
+
+def publish_bundle(bundles_dir: str, version_tag: str) -> None:
+    """Atomically points CURRENT at version_tag (servers pick it up on their next poll)."""
+    pointer = os.path.join(bundles_dir, "CURRENT")
+    tmp = pointer + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(version_tag + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, pointer)
+
+
+def register_bundle(version_tag: str, manifest: dict) -> int | None:
+    """Registers the bundle in model_versions (component='faiss_index')."""
+    import psycopg
+
+    dsn = f"host={DB_HOST} port={DB_PORT} dbname={DB_NAME} user={DB_USER} password={DB_PASSWORD}"
+    config = {k: v for k, v in manifest.items() if k != "files"}
+    with psycopg.connect(dsn) as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO model_versions(component, version_tag, training_data_snapshot, config)
+                VALUES ('faiss_index', %s, %s, %s::jsonb)
+                ON CONFLICT (component, version_tag) DO UPDATE SET config = EXCLUDED.config
+                RETURNING model_version_id;
+                """,
+                (
+                    version_tag,
+                    manifest["files"]["news_embeddings.npy"]["sha256"],
+                    json.dumps(config),
+                ),
+            )
+            model_version_id = cur.fetchone()[0]
+        conn.commit()
+    return int(model_version_id)
+
+
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--no-register", action="store_true", help="Skip model_versions registration")
+    parser.add_argument("--no-publish", action="store_true", help="Write the bundle but do not update CURRENT")
+    args = parser.parse_args()
+
     BASE_DIR = os.getcwd()
     EMBEDDINGS_FILE = os.path.join(BASE_DIR, "data/models/news_embeddings.npy")
     IDS_FILE = os.path.join(BASE_DIR, "data/models/news_ids.npy")
 
     INDEX_FILE = os.path.join(BASE_DIR, "data/models/news_retrieval.index")
     META_FILE = os.path.join(BASE_DIR, "data/models/news_retrieval.meta.npz")
+    BUNDLES_DIR = os.path.join(BASE_DIR, "data/models/faiss")
 
     if not os.path.exists(EMBEDDINGS_FILE):
         print(f" Error: {EMBEDDINGS_FILE} not found. Did Step 1 finish?")
@@ -43,7 +159,7 @@ def main():
     index.add(embeddings)
     print(f" Index built. ntotal={index.ntotal}")
 
-    # Save index + metadata
+    # Save index + metadata (legacy loose files, still used by offline scripts)
     print(f" Saving FAISS index -> {INDEX_FILE}")
     faiss.write_index(index, INDEX_FILE)
 
@@ -56,6 +172,22 @@ def main():
         index_type="IndexFlatIP",
     )
 
+    # Versioned bundle (what the API serves from)
+    print(f" Writing versioned bundle -> {BUNDLES_DIR}")
+    version_tag, manifest = write_bundle(BUNDLES_DIR, embeddings, ids, index, index_type="IndexFlatIP")
+    print(f" Bundle written: {version_tag}")
+
+    if not args.no_register:
+        try:
+            model_version_id = register_bundle(version_tag, manifest)
+            print(f" Registered model_versions(faiss_index) id={model_version_id}")
+        except Exception as e:
+            print(f" WARNING: could not register bundle in model_versions: {e}")
+
+    if not args.no_publish:
+        publish_bundle(BUNDLES_DIR, version_tag)
+        print(f" CURRENT -> {version_tag}")
+
     # Sanity test: self-query
     print(" Sanity test (self-query first vector, k=5)...")
     D, I = index.search(embeddings[0:1], 5)
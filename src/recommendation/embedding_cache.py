@@ -0,0 +1,109 @@
+import os
+import re
+import json
+import hashlib
+import numpy as np
+
+# 16-byte blake2b digest of the encoder input text ("category subcategory: title")
+KEY_DTYPE = np.dtype("S16")
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=KEY_DTYPE.itemsize).digest()
+
+
+def text_keys(texts: list[str]) -> np.ndarray:
+    return np.array([text_key(t) for t in texts], dtype=KEY_DTYPE)
+
+
+def _slug(model_name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]+", "__", model_name)
+
+
+class EmbeddingCache:
+    """
+    Persistent (model name, text hash) -> embedding cache.
+
+    Layout (one directory per model name):
+      <root>/<model_slug>/keys.npy     sorted S16 digests, shape (N,)
+      <root>/<model_slug>/vectors.npy  float32, shape (N, D), row i belongs to keys[i]
+      <root>/<model_slug>/meta.json    model name + dim
+
+    Both .npy files are memory-mapped on open; lookups are one np.searchsorted over keys.
+    Updates rewrite the pair under temp names and rename them into place.
+    """
+
+    def __init__(self, root: str, model_name: str):
+        self.model_name = model_name
+        self.dir = os.path.join(root, _slug(model_name))
+        self.keys_path = os.path.join(self.dir, "keys.npy")
+        self.vectors_path = os.path.join(self.dir, "vectors.npy")
+        self.meta_path = os.path.join(self.dir, "meta.json")
+
+        if os.path.exists(self.keys_path) and os.path.exists(self.vectors_path):
+            self.keys = np.load(self.keys_path, mmap_mode="r")
+            self.vectors = np.load(self.vectors_path, mmap_mode="r")
+            if self.keys.shape[0] != self.vectors.shape[0]:
+                raise ValueError(f"Corrupt embedding cache at {self.dir}: keys/vectors length mismatch")
+        else:
+            self.keys = np.empty(0, dtype=KEY_DTYPE)
+            self.vectors = None
+
+    def __len__(self) -> int:
+        return int(self.keys.shape[0])
+
+    @property
+    def dim(self) -> int | None:
+        return None if self.vectors is None else int(self.vectors.shape[1])
+
+    def lookup(self, keys: np.ndarray) -> np.ndarray:
+        """Returns the cache row for each key, -1 on a miss."""
+        if len(self) == 0 or keys.shape[0] == 0:
+            return np.full(keys.shape[0], -1, dtype=np.int64)
+        pos = np.searchsorted(self.keys, keys)
+        pos = np.minimum(pos, len(self) - 1)
+        return np.where(self.keys[pos] == keys, pos, -1).astype(np.int64)
+
+    def add(self, keys: np.ndarray, vectors: np.ndarray) -> int:
+        """
+        Merges new (key, vector) pairs into the cache and persists it. Keys already present
+        keep their cached vector. Returns the number of keys actually added.
+        """
+        keys, first = np.unique(keys, return_index=True)
+        vectors = np.asarray(vectors, dtype=np.float32)[first]
+        new = self.lookup(keys) < 0
+        keys, vectors = keys[new], vectors[new]
+        if keys.shape[0] == 0:
+            return 0
+
+        if self.vectors is None:
+            all_keys, all_vectors = keys, vectors
+        else:
+            if vectors.shape[1] != self.vectors.shape[1]:
+                raise ValueError(f"Dim mismatch: cache D={self.vectors.shape[1]} new D={vectors.shape[1]}")
+            all_keys = np.concatenate([np.asarray(self.keys), keys])
+            all_vectors = np.concatenate([np.asarray(self.vectors), vectors])
+
+        order = np.argsort(all_keys, kind="stable")
+        self._write(all_keys[order], all_vectors[order])
+        return int(keys.shape[0])
+
+    def _write(self, keys: np.ndarray, vectors: np.ndarray) -> None:
+        os.makedirs(self.dir, exist_ok=True)
+        tmp_keys = self.keys_path + ".tmp.npy"
+        tmp_vectors = self.vectors_path + ".tmp.npy"
+        np.save(tmp_keys, keys, allow_pickle=False)
+        np.save(tmp_vectors, vectors, allow_pickle=False)
+
+        # Release our maps of the old files before replacing them
+        self.keys, self.vectors = np.empty(0, dtype=KEY_DTYPE), None
+        # vectors first: a crash between the renames leaves old keys over new vectors,
+        # which the length check on open rejects instead of serving wrong rows
+        os.replace(tmp_vectors, self.vectors_path)
+        os.replace(tmp_keys, self.keys_path)
+
+        with open(self.meta_path, "w") as f:
+            json.dump({"model_name": self.model_name, "dim": int(vectors.shape[1]), "count": int(keys.shape[0])}, f)
+
+        self.keys = np.load(self.keys_path, mmap_mode="r")
+        self.vectors = np.load(self.vectors_path, mmap_mode="r")
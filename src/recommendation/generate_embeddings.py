@@ -1,8 +1,15 @@
 import os
+import time
+import argparse
 import pandas as pd
 import numpy as np
 import torch
-from transformers import AutoTokenizer, AutoModel
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing as mp
+from transformers import AutoTokenizer, AutoModel, AutoConfig
+
+from src.recommendation.embedding_cache import EmbeddingCache, text_keys
+from src.recommendation.onnx_encoder import OnnxEncoder, cosine_agreement, ensure_int8_model
 
 # ----------------------------
 # Configuration
@@ -14,12 +21,27 @@ OUTPUT_DIR = os.path.join(BASE_DIR, "data", "models")
 EMBED_FILE = os.path.join(OUTPUT_DIR, "news_embeddings.npy")
 IDS_FILE = os.path.join(OUTPUT_DIR, "news_ids.npy")
 
+# Persistent (model, text hash) -> vector cache; re-runs only encode new/edited texts
+CACHE_DIR = os.path.join(OUTPUT_DIR, "embedding_cache")
+
+# Exported + int8-quantized encoder for --backend onnx
+ONNX_DIR = os.path.join(OUTPUT_DIR, "onnx", "all-MiniLM-L6-v2")
+
 # Pretrained text encoder (baseline "News Tower")
 MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
 
+# int8 vectors are close to, not identical to, torch fp32: keep them in their own cache namespace
+CACHE_MODEL_KEYS = {
+    "torch": MODEL_NAME,
+    "onnx": f"{MODEL_NAME}@onnx-int8",
+}
+
 BATCH_SIZE = 64
 MAX_LENGTH = 128
 
+# Batches handed to a worker per task (amortizes IPC, keeps progress reporting responsive)
+BATCHES_PER_TASK = 8
+
 
 def mean_pooling(model_output, attention_mask):
     """
@@ -32,63 +54,265 @@ def mean_pooling(model_output, attention_mask):
     return summed / counts  # [B, H]
 
 
-def main():
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
+def build_texts(df: pd.DataFrame) -> list[str]:
+    # Build text input (simple + fast baseline)
+    # NOTE: fillna to avoid any rare NaNs breaking concatenation
+    cat = df["category"].fillna("").astype(str)
+    subcat = df["subcategory"].fillna("").astype(str)
+    title = df["title"].fillna("").astype(str)
+    return (cat + " " + subcat + ": " + title).tolist()
+
+
+# ----------------------------
+# Batch planning (length buckets)
+# ----------------------------
+def plan_batches(texts: list[str], tokenizer, batch_size: int) -> list[np.ndarray]:
+    """
+    Sorts texts by token length and cuts the sorted order into batches, so every batch
+    pads to a length close to its own texts instead of the longest title in file order.
+    Returns a list of index arrays into `texts`.
+    """
+    lengths = np.fromiter(
+        (len(x) for x in tokenizer(texts, truncation=True, max_length=MAX_LENGTH)["input_ids"]),
+        dtype=np.int32,
+        count=len(texts),
+    )
+    order = np.argsort(lengths, kind="stable")
+    return [order[i : i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+# ----------------------------
+# Worker process
+# ----------------------------
+_TOKENIZER = None
+_MODEL = None
+_ONNX = None
+_INTEROP_SET = False
+
+
+def _init_worker(threads: int, backend: str = "torch", onnx_path: str | None = None) -> None:
+    global _TOKENIZER, _MODEL, _ONNX, _INTEROP_SET
+    # Each process gets its own slice of the cores; without this every worker
+    # starts one intra-op thread per core and they all fight over the same CPUs.
+    torch.set_num_threads(threads)
+    # Only allowed before the process's first parallel op: with --workers 1 this process
+    # may already have run torch (validate_onnx), so set it at most once.
+    if not _INTEROP_SET:
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass
+        _INTEROP_SET = True
+
+    if backend == "onnx":
+        _ONNX = OnnxEncoder(MODEL_NAME, onnx_path, threads=threads, max_length=MAX_LENGTH)
+        return
+
+    _TOKENIZER = AutoTokenizer.from_pretrained(MODEL_NAME)
+    _MODEL = AutoModel.from_pretrained(MODEL_NAME)
+    _MODEL.eval()
+
+
+def _encode_batch(batch_texts: list[str]) -> np.ndarray:
+    if _ONNX is not None:
+        return _ONNX.encode(batch_texts)
+
+    inputs = _TOKENIZER(
+        batch_texts,
+        padding=True,
+        truncation=True,
+        max_length=MAX_LENGTH,
+        return_tensors="pt",
+    )
+    with torch.no_grad():
+        outputs = _MODEL(**inputs)
+        pooled = mean_pooling(outputs, inputs["attention_mask"])  # [B, H]
+    return pooled.numpy().astype(np.float32)
+
+
+def _encode_task(out_path: str, batches: list[tuple[np.ndarray, list[str]]]) -> int:
+    """
+    Encodes a list of (destination_rows, texts) batches and writes them straight into
+    the shared .npy memmap at their original rows.
+    """
+    out = np.load(out_path, mmap_mode="r+")
+    done = 0
+    for rows, batch_texts in batches:
+        out[rows] = _encode_batch(batch_texts)
+        done += len(rows)
+    out.flush()
+    del out
+    return done
 
-    device = torch.device("cpu")
 
-    print(" Loading pretrained news encoder...")
+def encode_into(
+    out_path: str,
+    texts: list[str],
+    rows: np.ndarray,
+    *,
+    workers: int,
+    threads_per_worker: int,
+    batch_size: int = BATCH_SIZE,
+    backend: str = "torch",
+    onnx_path: str | None = None,
+) -> int:
+    """
+    Encodes `texts` and writes text i into row rows[i] of the .npy file at out_path
+    (which must already exist with the right shape). Returns the number of rows written.
+    """
+    if not texts:
+        return 0
+
     tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-    model = AutoModel.from_pretrained(MODEL_NAME)
-    model.eval()
-    model.to(device)
+    batches = plan_batches(texts, tokenizer, batch_size)
+    tasks = []
+    for i in range(0, len(batches), BATCHES_PER_TASK):
+        chunk = batches[i : i + BATCHES_PER_TASK]
+        tasks.append([(rows[b], [texts[j] for j in b]) for b in chunk])
+
+    n = len(texts)
+    done = 0
+    t0 = time.perf_counter()
+
+    def _report():
+        rate = done / max(time.perf_counter() - t0, 1e-9)
+        print(f"  Progress: {done}/{n} ({rate:.0f} items/sec)")
+
+    if workers <= 1:
+        _init_worker(threads_per_worker, backend, onnx_path)
+        for task in tasks:
+            done += _encode_task(out_path, task)
+            _report()
+        return done
+
+    ctx = mp.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=ctx,
+        initializer=_init_worker,
+        initargs=(threads_per_worker, backend, onnx_path),
+    ) as ex:
+        futures = [ex.submit(_encode_task, out_path, task) for task in tasks]
+        for f in as_completed(futures):
+            done += f.result()
+            _report()
+    return done
+
+
+def validate_onnx(texts: list[str], onnx_path: str, *, sample: int, threads: int) -> np.ndarray:
+    """Encodes a random sample with both backends and returns per-text cosine agreement."""
+    rng = np.random.default_rng(0)
+    idx = rng.choice(len(texts), size=min(sample, len(texts)), replace=False)
+    batch = [texts[i] for i in idx]
+
+    _init_worker(threads, "torch")
+    ref = np.vstack([_encode_batch(batch[i : i + BATCH_SIZE]) for i in range(0, len(batch), BATCH_SIZE)])
+    onnx = OnnxEncoder(MODEL_NAME, onnx_path, threads=threads, max_length=MAX_LENGTH)
+    got = np.vstack([onnx.encode(batch[i : i + BATCH_SIZE]) for i in range(0, len(batch), BATCH_SIZE)])
+    return cosine_agreement(ref, got)
+
+
+def _default_workers() -> int:
+    cpus = os.cpu_count() or 1
+    return max(1, min(4, cpus // 2))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=_default_workers(), help="Encoder processes")
+    parser.add_argument(
+        "--threads-per-worker",
+        type=int,
+        default=0,
+        help="torch intra-op threads per process (default: cpu_count // workers)",
+    )
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="Embedding cache directory")
+    parser.add_argument("--no-cache", action="store_true", help="Re-encode everything, do not read/update the cache")
+    parser.add_argument("--backend", choices=["torch", "onnx"], default="torch", help="Encoder runtime")
+    parser.add_argument("--onnx-dir", default=ONNX_DIR, help="Where the exported/quantized ONNX model lives")
+    parser.add_argument("--validate-sample", type=int, default=256, help="Texts compared torch vs onnx (0 = skip)")
+    parser.add_argument("--min-cosine", type=float, default=0.98, help="Abort if any sampled cosine falls below this")
+    args = parser.parse_args()
+
+    workers = max(1, args.workers)
+    threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
 
     print(" Reading news.parquet...")
     df = pd.read_parquet(NEWS_INPUT)
 
-    # Save stable ID mapping (row index -> news_id)
-    print(" Saving news_id mapping...")
     news_ids = df["news_id"].astype(str).values
-    np.save(IDS_FILE, news_ids)
+    texts = build_texts(df)
+    n = len(texts)
 
-    # Build text input (simple + fast baseline)
-    # NOTE: fillna to avoid any rare NaNs breaking concatenation
-    cat = df["category"].fillna("").astype(str)
-    subcat = df["subcategory"].fillna("").astype(str)
-    title = df["title"].fillna("").astype(str)
-    texts = (cat + " " + subcat + ": " + title).tolist()
+    onnx_path = None
+    if args.backend == "onnx":
+        onnx_path = ensure_int8_model(MODEL_NAME, args.onnx_dir, mean_pooling)
+        if args.validate_sample > 0:
+            cos = validate_onnx(texts, onnx_path, sample=args.validate_sample, threads=threads)
+            print(f" ONNX int8 vs torch cosine: mean={cos.mean():.5f} min={cos.min():.5f} (n={len(cos)})")
+            if float(cos.min()) < args.min_cosine:
+                raise RuntimeError(f"ONNX int8 encoder disagrees with torch (min cosine {cos.min():.5f} < {args.min_cosine})")
 
-    n = len(texts)
-    print(f" Encoding {n} items on CPU (batch={BATCH_SIZE})...")
+    keys = text_keys(texts)
+    cache = None if args.no_cache else EmbeddingCache(args.cache_dir, CACHE_MODEL_KEYS[args.backend])
 
-    all_embeddings = []
-    with torch.no_grad():
-        for i in range(0, n, BATCH_SIZE):
-            batch_texts = texts[i : i + BATCH_SIZE]
+    if cache is not None:
+        cache_rows = cache.lookup(keys)
+        miss_idx = np.flatnonzero(cache_rows < 0)
+        print(f" Embedding cache: {n - len(miss_idx)}/{n} hits, {len(miss_idx)} to encode ({cache.dir})")
+    else:
+        cache_rows = np.full(n, -1, dtype=np.int64)
+        miss_idx = np.arange(n)
 
-            inputs = tokenizer(
-                batch_texts,
-                padding=True,
-                truncation=True,
-                max_length=MAX_LENGTH,
-                return_tensors="pt",
-            )
-            inputs = {k: v.to(device) for k, v in inputs.items()}
+    dim = cache.dim if cache is not None and cache.dim else int(AutoConfig.from_pretrained(MODEL_NAME).hidden_size)
 
-            outputs = model(**inputs)
-            pooled = mean_pooling(outputs, inputs["attention_mask"])  # [B, H]
+    # Preallocated .npy on disk; workers write their rows in place (no list + vstack).
+    # Written to a temp name and renamed, so build_index never sees a half-filled matrix.
+    tmp_embed = EMBED_FILE + ".tmp.npy"
+    out = np.lib.format.open_memmap(tmp_embed, mode="w+", dtype=np.float32, shape=(n, dim))
+    hit_idx = np.flatnonzero(cache_rows >= 0)
+    if len(hit_idx):
+        out[hit_idx] = cache.vectors[cache_rows[hit_idx]]
+    out.flush()
+    del out
 
-            all_embeddings.append(pooled.cpu().numpy().astype(np.float32))
+    print(
+        f" Encoding {len(miss_idx)} items on CPU (backend={args.backend}, workers={workers}, "
+        f"threads/worker={threads}, batch={args.batch_size})..."
+    )
+    t0 = time.perf_counter()
+    encode_into(
+        tmp_embed,
+        [texts[i] for i in miss_idx],
+        miss_idx,
+        workers=workers,
+        threads_per_worker=threads,
+        batch_size=args.batch_size,
+        backend=args.backend,
+        onnx_path=onnx_path,
+    )
+    elapsed = time.perf_counter() - t0
 
-            if i == 0 or (i % 4096 == 0):
-                print(f"  Progress: {i}/{n}")
+    if cache is not None and len(miss_idx):
+        encoded = np.load(tmp_embed, mmap_mode="r")
+        added = cache.add(keys[miss_idx], encoded[miss_idx])
+        del encoded
+        print(f" Embedding cache: added {added} vectors (now {len(cache)})")
 
-    final_matrix = np.vstack(all_embeddings)  # [N, H]
-    np.save(EMBED_FILE, final_matrix)
+    os.replace(tmp_embed, EMBED_FILE)
+
+    # Save stable ID mapping (row index -> news_id)
+    print(" Saving news_id mapping...")
+    np.save(IDS_FILE, news_ids)
 
+    final_matrix = np.load(EMBED_FILE, mmap_mode="r")
     print(" SUCCESS! Files created:")
     print(f"1) {EMBED_FILE}  shape={final_matrix.shape} dtype={final_matrix.dtype}")
     print(f"2) {IDS_FILE}     shape={news_ids.shape} dtype={news_ids.dtype}")
+    print(f" Throughput: {len(miss_idx) / max(elapsed, 1e-9):.1f} encoded items/sec ({elapsed:.1f}s)")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,114 @@
+import os
+import numpy as np
+import torch
+from transformers import AutoTokenizer, AutoModel
+
+# Inputs exported with the graph (BERT-style encoders, MiniLM included)
+_INPUT_NAMES = ["input_ids", "attention_mask", "token_type_ids"]
+
+
+class _PooledEncoder(torch.nn.Module):
+    """Encoder + pooling in one graph, so ONNX Runtime returns sentence vectors directly."""
+
+    def __init__(self, model, pooling):
+        super().__init__()
+        self.model = model
+        self.pooling = pooling
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        outputs = self.model(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids)
+        return self.pooling(outputs, attention_mask)
+
+
+def export_onnx(model_name: str, out_path: str, pooling, opset: int = 14) -> str:
+    """
+    Exports `model_name` with `pooling` applied on top (same pooling as the torch path)
+    to an fp32 ONNX graph with dynamic batch and sequence axes.
+    """
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+
+    wrapper = _PooledEncoder(model, pooling)
+    sample = tokenizer(["export sample"], padding=True, return_tensors="pt")
+    args = tuple(sample[name] for name in _INPUT_NAMES)
+
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    with torch.no_grad():
+        torch.onnx.export(
+            wrapper,
+            args,
+            out_path,
+            input_names=_INPUT_NAMES,
+            output_names=["sentence_embedding"],
+            dynamic_axes={
+                **{name: {0: "batch", 1: "seq"} for name in _INPUT_NAMES},
+                "sentence_embedding": {0: "batch"},
+            },
+            opset_version=opset,
+        )
+    return out_path
+
+
+def quantize_int8(fp32_path: str, int8_path: str) -> str:
+    """Dynamic int8 quantization (weights int8, activations quantized at runtime)."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    return int8_path
+
+
+def ensure_int8_model(model_name: str, onnx_dir: str, pooling) -> str:
+    """Exports + quantizes once; later runs reuse <onnx_dir>/model.int8.onnx."""
+    int8_path = os.path.join(onnx_dir, "model.int8.onnx")
+    if os.path.exists(int8_path):
+        return int8_path
+
+    fp32_path = os.path.join(onnx_dir, "model.fp32.onnx")
+    print(f" Exporting {model_name} to ONNX -> {fp32_path}")
+    export_onnx(model_name, fp32_path, pooling)
+    print(f" Quantizing (dynamic int8) -> {int8_path}")
+    tmp_path = int8_path + ".tmp"
+    quantize_int8(fp32_path, tmp_path)
+    os.replace(tmp_path, int8_path)
+    return int8_path
+
+
+class OnnxEncoder:
+    """
+    CPU sentence encoder on ONNX Runtime. Cheap enough to embed single articles on ingest:
+    encode(["category subcategory: title"]) -> float32 [1, H].
+    """
+
+    def __init__(self, model_name: str, onnx_path: str, *, threads: int = 1, max_length: int = 128):
+        import onnxruntime as ort
+
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = threads
+        opts.inter_op_num_threads = 1
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.session = ort.InferenceSession(onnx_path, sess_options=opts, providers=["CPUExecutionProvider"])
+        self.max_length = max_length
+        self._inputs = {i.name for i in self.session.get_inputs()}
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        enc = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="np",
+        )
+        feeds = {name: enc[name].astype(np.int64) for name in _INPUT_NAMES if name in self._inputs}
+        if "token_type_ids" in self._inputs and "token_type_ids" not in enc:
+            feeds["token_type_ids"] = np.zeros_like(feeds["input_ids"])
+        return self.session.run(["sentence_embedding"], feeds)[0].astype(np.float32)
+
+
+def cosine_agreement(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Row-wise cosine similarity between two [N, H] matrices."""
+    a = a / np.clip(np.linalg.norm(a, axis=1, keepdims=True), 1e-12, None)
+    b = b / np.clip(np.linalg.norm(b, axis=1, keepdims=True), 1e-12, None)
+    return np.sum(a * b, axis=1)